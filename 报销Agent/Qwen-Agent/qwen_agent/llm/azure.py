@@ -1,9 +1,8 @@
 import os
 from typing import Dict, Optional
 
-import openai
-
 from qwen_agent.llm.base import register_llm
+from qwen_agent.llm.client_pool import get_azure_openai_client
 from qwen_agent.llm.oai import TextChatAtOAI
 
 
@@ -35,7 +34,7 @@ class TextChatAtAzure(TextChatAtOAI):
             api_kwargs['api_version'] = api_version
 
         def _chat_complete_create(*args, **kwargs):
-            client = openai.AzureOpenAI(**api_kwargs)
+            client = get_azure_openai_client(**api_kwargs)
             return client.chat.completions.create(*args, **kwargs)
 
         self._chat_complete_create = _chat_complete_create
@@ -0,0 +1,172 @@
+"""A process-wide registry of OpenAI-compatible clients.
+
+Creating an `openai.OpenAI` object per request opens a fresh connection pool, so every call pays for the TCP and TLS
+handshakes again. Clients returned here are cached by their connection settings and share one keep-alive
+`httpx.Client`, which makes repeated short calls reuse warm connections. The sync clients are thread-safe; async
+clients are cached per event loop.
+"""
+
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+import openai
+
+from qwen_agent.log import logger
+from qwen_agent.settings import (HTTP2_ENABLED, HTTP_CONNECT_TIMEOUT, HTTP_KEEPALIVE_EXPIRY, HTTP_MAX_CONNECTIONS,
+                                 HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_TIMEOUT)
+
+_clients: Dict[Tuple, openai.OpenAI] = {}
+_clients_lock = threading.Lock()
+
+# httpx.AsyncClient connections are bound to the event loop that created them, so async clients are kept per loop
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, openai.AsyncOpenAI]]' = (
+    weakref.WeakKeyDictionary())
+# Background closes scheduled by close_clients(), kept alive until they finish
+_closing_tasks: set = set()
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec('h2') is None:
+        logger.warning('QWEN_AGENT_HTTP2 is set but the `h2` package is not installed, falling back to HTTP/1.1.')
+        return False
+    return True
+
+
+def _http_client_kwargs() -> dict:
+    return dict(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        http2=_http2_available(),
+        follow_redirects=True,
+    )
+
+
+def _build_http_client() -> httpx.Client:
+    return httpx.Client(**_http_client_kwargs())
+
+
+def _client_key(client_cls: type, client_kwargs: dict) -> Tuple:
+    return (client_cls.__name__,) + tuple(sorted((k, str(v)) for k, v in client_kwargs.items()))
+
+
+def _get_client(client_cls: type, **client_kwargs) -> openai.OpenAI:
+    key = _client_key(client_cls, client_kwargs)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = client_cls(http_client=_build_http_client(), **client_kwargs)
+            _clients[key] = client
+        return client
+
+
+def get_openai_client(base_url: Optional[str] = None, api_key: Optional[str] = None, **client_kwargs) -> openai.OpenAI:
+    """Get a pooled `openai.OpenAI` client for the given (base_url, api_key)."""
+    if base_url:
+        client_kwargs['base_url'] = base_url
+    if api_key:
+        client_kwargs['api_key'] = api_key
+    return _get_client(openai.OpenAI, **client_kwargs)
+
+
+def get_azure_openai_client(**client_kwargs) -> openai.AzureOpenAI:
+    """Get a pooled `openai.AzureOpenAI` client, keyed by azure_endpoint, api_key and api_version."""
+    return _get_client(openai.AzureOpenAI, **client_kwargs)
+
+
+def get_async_openai_client(base_url: Optional[str] = None,
+                            api_key: Optional[str] = None,
+                            **client_kwargs) -> openai.AsyncOpenAI:
+    """Get a pooled `openai.AsyncOpenAI` client for the running event loop.
+
+    Must be called from within a coroutine. Clients are dropped together with their event loop.
+    """
+    if base_url:
+        client_kwargs['base_url'] = base_url
+    if api_key:
+        client_kwargs['api_key'] = api_key
+    loop = asyncio.get_running_loop()
+    key = _client_key(openai.AsyncOpenAI, client_kwargs)
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = openai.AsyncOpenAI(http_client=httpx.AsyncClient(**_http_client_kwargs()), **client_kwargs)
+            loop_clients[key] = client
+        return client
+
+
+async def aclose_clients() -> None:
+    """Close the pooled async clients of the running event loop and their connections."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _async_clients.pop(loop, {})
+    for client in loop_clients.values():
+        await client.close()
+
+
+def _on_close_done(future) -> None:
+    """Log failures of a background close, which would otherwise go unnoticed."""
+    _closing_tasks.discard(future)
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.warning(f'Failed to close async OpenAI clients: {error}')
+
+
+def _close_async_clients(loop: asyncio.AbstractEventLoop, clients: list) -> None:
+    """Close async clients on the event loop that owns their connections."""
+    if loop.is_closed():
+        # The loop's transports are gone with it; there is nothing left to close gracefully.
+        return
+
+    async def _close_all():
+        for client in clients:
+            await client.close()
+
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if loop is running_loop:
+        # Called from inside the owning loop: cannot block on it, so close in the background.
+        # Keep a reference until it finishes, since the loop only holds tasks weakly.
+        task = loop.create_task(_close_all())
+        _closing_tasks.add(task)
+        task.add_done_callback(_on_close_done)
+    elif loop.is_running():
+        future = asyncio.run_coroutine_threadsafe(_close_all(), loop)
+        _closing_tasks.add(future)
+        future.add_done_callback(_on_close_done)
+    else:
+        loop.run_until_complete(_close_all())
+
+
+def close_clients() -> None:
+    """Close all pooled clients and their connections.
+
+    Async clients are closed on their own event loop: awaited directly when the loop is idle, scheduled on it when the
+    loop is running, and simply dropped when the loop is already closed. Inside a coroutine, prefer
+    `await aclose_clients()` to close the running loop's clients deterministically.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        async_clients = [(loop, list(loop_clients.values())) for loop, loop_clients in _async_clients.items()]
+        _async_clients.clear()
+    for loop, clients in async_clients:
+        try:
+            _close_async_clients(loop, clients)
+        except Exception as e:
+            logger.warning(f'Failed to close async OpenAI clients: {e}')
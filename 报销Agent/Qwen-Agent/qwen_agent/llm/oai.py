@@ -43,6 +43,8 @@ class TextChatAtOAI(BaseFnCallModel):
             self._complete_create = openai.Completion.create
             self._chat_complete_create = openai.ChatCompletion.create
         else:
+            from qwen_agent.llm.client_pool import get_openai_client
+
             api_kwargs = {}
             if api_base:
                 api_kwargs['base_url'] = api_base
@@ -60,7 +62,7 @@ class TextChatAtOAI(BaseFnCallModel):
                 if 'request_timeout' in kwargs:
                     kwargs['timeout'] = kwargs.pop('request_timeout')
 
-                client = openai.OpenAI(**api_kwargs)
+                client = get_openai_client(**api_kwargs)
                 return client.chat.completions.create(*args, **kwargs)
 
             def _complete_create(*args, **kwargs):
@@ -74,7 +76,7 @@ class TextChatAtOAI(BaseFnCallModel):
                 if 'request_timeout' in kwargs:
                     kwargs['timeout'] = kwargs.pop('request_timeout')
 
-                client = openai.OpenAI(**api_kwargs)
+                client = get_openai_client(**api_kwargs)
                 return client.completions.create(*args, **kwargs)
 
             self._complete_create = _complete_create
@@ -6,6 +6,14 @@ from typing import List, Literal
 DEFAULT_MAX_INPUT_TOKENS: int = int(os.getenv(
     'QWEN_AGENT_DEFAULT_MAX_INPUT_TOKENS', 58000))  # The LLM will truncate the input messages if they exceed this limit
 
+# Settings for the shared HTTP connection pool used by OpenAI-compatible clients
+HTTP_MAX_CONNECTIONS: int = int(os.getenv('QWEN_AGENT_HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv('QWEN_AGENT_HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv('QWEN_AGENT_HTTP_KEEPALIVE_EXPIRY', 60))  # Seconds an idle connection is kept
+HTTP_TIMEOUT: float = float(os.getenv('QWEN_AGENT_HTTP_TIMEOUT', 600))  # Seconds for read/write/pool
+HTTP_CONNECT_TIMEOUT: float = float(os.getenv('QWEN_AGENT_HTTP_CONNECT_TIMEOUT', 10))
+HTTP2_ENABLED: bool = os.getenv('QWEN_AGENT_HTTP2', '0').strip().lower() in ('1', 'true')  # Requires the `h2` package
+
 # Settings for agents
 MAX_LLM_CALL_PER_RUN: int = int(os.getenv('QWEN_AGENT_MAX_LLM_CALL_PER_RUN', 20))
 
@@ -0,0 +1,93 @@
+import asyncio
+
+from qwen_agent.llm import client_pool, get_chat_model
+from qwen_agent.llm.client_pool import aclose_clients, close_clients, get_async_openai_client, get_openai_client
+
+
+def test_client_pool_reuses_clients():
+    close_clients()
+    client = get_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+    assert get_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a') is client
+    assert get_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-b') is not client
+    assert get_openai_client(base_url='http://127.0.0.1:9000/v1', api_key='key-a') is not client
+    close_clients()
+    assert get_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a') is not client
+
+
+def test_oai_model_uses_pooled_client(monkeypatch):
+    close_clients()
+    llm_cfg = {'model': 'qwen2.5-7b-instruct', 'model_server': 'http://127.0.0.1:8000/v1', 'api_key': 'key-a'}
+    pooled = get_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+
+    calls = []
+    monkeypatch.setattr(pooled.chat.completions, 'create', lambda *args, **kwargs: calls.append(kwargs))
+    llm = get_chat_model(llm_cfg)
+    llm._chat_complete_create(model=llm.model, messages=[])
+    llm._chat_complete_create(model=llm.model, messages=[])
+    assert len(calls) == 2
+    close_clients()
+
+
+def test_async_client_pool_is_per_event_loop():
+    async def get_pair():
+        first = get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+        second = get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+        return first, second
+
+    first, second = asyncio.run(get_pair())
+    assert first is second
+    other, _ = asyncio.run(get_pair())
+    assert other is not first
+
+
+def test_close_clients_closes_async_clients():
+    async def get_client():
+        return get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+
+    loop = asyncio.new_event_loop()
+    try:
+        client = loop.run_until_complete(get_client())
+        close_clients()
+        assert client.is_closed()
+        assert loop.run_until_complete(get_client()) is not client
+    finally:
+        close_clients()
+        loop.close()
+
+
+def test_aclose_clients_closes_running_loop_clients():
+    async def run():
+        client = get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+        await aclose_clients()
+        assert client.is_closed()
+        assert get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a') is not client
+        await aclose_clients()
+
+    asyncio.run(run())
+
+
+def test_close_clients_inside_running_loop_keeps_task_and_logs_failures(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(client_pool.logger, 'warning', warnings.append)
+
+    async def run():
+        client = get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-a')
+        close_clients()
+        assert len(client_pool._closing_tasks) == 1
+        await asyncio.gather(*client_pool._closing_tasks)
+        assert client.is_closed()
+        assert not client_pool._closing_tasks
+
+        failing = get_async_openai_client(base_url='http://127.0.0.1:8000/v1', api_key='key-b')
+
+        async def fail():
+            raise RuntimeError('boom')
+
+        monkeypatch.setattr(failing, 'close', fail)
+        close_clients()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert not client_pool._closing_tasks
+
+    asyncio.run(run())
+    assert warnings == ['Failed to close async OpenAI clients: boom']
@@ -1,12 +1,12 @@
 import os
 import json
 import tempfile
-import base64
 import streamlit as st
 from datetime import datetime
 import pandas as pd
 import platform
 import sys
+import uuid
 
 # 设置环境变量，确保在Streamlit Cloud环境中正确运行
 os.environ['OPENCV_HEADLESS'] = '1'  # 强制OpenCV使用headless模式
@@ -24,16 +24,23 @@ from config import (
     LLM_CONFIG, 
     SYSTEM_INSTRUCTION, 
     TOOLS,
-    INVOICE_TYPES
+    INVOICE_TYPES,
+    PDF_CONFIG
 )
 
 # 导入工具类
 from tools.trip_recorder import TripRecorder
+from tools.itinerary_builder import ItineraryBuilder
 from tools.invoice_processor import InvoiceProcessor
-from tools.reimbursement_generator import ReimbursementGenerator
+from tools.reimbursement_generator import ReimbursementGenerator, new_claim_id
 from tools.ncc_submission import NCCSubmission
 from tools.invoice_image_processor import InvoiceImageProcessor
 from tools.mm_invoice_processor import MMInvoiceProcessor
+from tools.batch_extractor import BatchInvoiceExtractor
+from tools.duplicate_index import make_invoice_key
+from tools.pdf_rasterizer import warm_up_render_pool, render_pdf_page
+from tools.file_registry import get_file_registry
+from tools.preview_cache import get_preview_cache, PREVIEW_FILE_TYPES
 
 # 导入辅助函数
 from utils.helpers import (
@@ -60,6 +67,14 @@ st.set_page_config(
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 
+# 会话ID，用于在文件登记表中记录本会话上传的文件
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 报销单编号，本会话内增删发票、重新生成报销单时保持不变，重置数据后生成新的编号
+if 'claim_id' not in st.session_state:
+    st.session_state.claim_id = new_claim_id()
+
 if 'bot' not in st.session_state:
     # 创建临时帮助文件
     help_doc = load_help_document()
@@ -75,6 +90,10 @@ if 'bot' not in st.session_state:
         files=[help_doc_path]
     )
     st.session_state.help_doc_path = help_doc_path
+    
+    # 预先启动PDF渲染进程，首次上传PDF时无需等待进程启动
+    if PDF_CONFIG['warm_up']:
+        warm_up_render_pool()
 
 if 'current_step' not in st.session_state:
     st.session_state.current_step = "开始"
@@ -82,6 +101,10 @@ if 'current_step' not in st.session_state:
 if 'trips' not in st.session_state:
     st.session_state.trips = []
 
+# 行程列表是否由交通票据自动生成，用户手动录入行程后不再自动覆盖
+if 'trips_from_invoices' not in st.session_state:
+    st.session_state.trips_from_invoices = False
+
 if 'invoices' not in st.session_state:
     st.session_state.invoices = []
 
@@ -104,10 +127,6 @@ if 'all_processed_files' not in st.session_state:
 if 'has_processed_files' not in st.session_state:
     st.session_state.has_processed_files = False
 
-# 添加原始文件内容存储
-if 'original_file_contents' not in st.session_state:
-    st.session_state.original_file_contents = {}
-
 # 定义页面布局
 def render_header():
     """渲染页面头部"""
@@ -117,6 +136,65 @@ def render_header():
     # 水平分割线
     st.markdown("---")
 
+def render_file_preview(file_info, key):
+    """显示上传文件的缩略图，勾选查看原图时才读取并显示原始文件
+
+    Args:
+        file_info: 消息中的文件信息，包含filename、file_type和file_id
+        key: 查看原图开关的控件key，在页面中需唯一
+    """
+    file_type = file_info['file_type'].lower()
+    if file_type not in PREVIEW_FILE_TYPES:
+        st.write(f"已上传{file_info['file_type']}文件")
+        return
+    file_id = file_info.get("file_id", "")
+    try:
+        preview = get_preview_cache().get(file_id)
+        if preview is None:
+            st.warning("无法显示预览: 文件已过期，请重新上传")
+            return
+        st.image(preview, caption=file_info['filename'] + ("（首页）" if file_type == 'pdf' else ""))
+        if st.checkbox("查看原图", key=key):
+            file_bytes = get_file_registry().get_bytes(file_id)
+            if file_bytes is None:
+                st.warning("无法显示原图: 文件已过期，请重新上传")
+            elif file_type == 'pdf':
+                st.image(render_pdf_page(file_bytes), caption=file_info['filename'])
+            else:
+                st.image(file_bytes, caption=file_info['filename'])
+    except Exception as e:
+        st.error(f"无法显示预览: {str(e)}")
+
+def rebuild_trips_from_invoices():
+    """根据交通票据重建行程，用户尚未手动录入行程时通过行程录入工具自动填入行程列表
+
+    Returns:
+        行程重建结果，未更新行程列表时返回None
+    """
+    if st.session_state.trips and not st.session_state.trips_from_invoices:
+        return None
+    itinerary = ItineraryBuilder().build(st.session_state.invoices)
+    if not itinerary['trip_records']:
+        return None
+    trip_recorder = TripRecorder()
+    for trip_info in itinerary['trip_records']:
+        trip_recorder.call(json.dumps({"trip_info": trip_info}, ensure_ascii=False))
+    st.session_state.trips = trip_recorder.get_trips()
+    st.session_state.trips_from_invoices = True
+    return itinerary
+
+def describe_itinerary(itinerary):
+    """生成行程重建结果的文字说明"""
+    lines = [f"常驻地：{itinerary['home_city']}"]
+    for idx, trip in enumerate(itinerary['trips']):
+        line = f"- 出差{idx+1}：{trip['start_date']} 至 {trip['end_date']}，共{trip['days']}天，途经{'、'.join(trip['cities'])}"
+        if not trip['returned_home']:
+            line += "，未找到返回常驻地的票据"
+        for gap in trip['gaps']:
+            line += f"，{gap['date']}从{gap['from']}到{gap['to']}之间缺少票据"
+        lines.append(line)
+    return "\n".join(lines)
+
 def render_sidebar():
     """渲染侧边栏"""
     with st.sidebar:
@@ -146,7 +224,7 @@ def render_sidebar():
         # 文件处理状态重置按钮
         if st.button("清除已处理文件记录"):
             st.session_state.all_processed_files = []
-            st.session_state.original_file_contents = {}
+            get_file_registry().release(st.session_state.session_id)
             st.success("已清除所有已处理文件记录！可以重新上传并处理文件了。")
             st.rerun()
         
@@ -154,18 +232,20 @@ def render_sidebar():
         if st.button("重置所有数据"):
             st.session_state.messages = []
             st.session_state.trips = []
+            st.session_state.trips_from_invoices = False
             st.session_state.invoices = []
             st.session_state.reimbursement_form = None
+            st.session_state.claim_id = new_claim_id()
             st.session_state.current_step = "开始"
-            # 同时清除文件处理状态
+            # 同时清除文件处理状态，并释放本会话上传的文件
             st.session_state.all_processed_files = []
-            st.session_state.original_file_contents = {}
+            get_file_registry().release(st.session_state.session_id)
             st.rerun()
 
 def render_chat_interface():
     """渲染聊天界面"""
     # 显示聊天历史
-    for message in st.session_state.messages:
+    for message_index, message in enumerate(st.session_state.messages):
         role = message["role"]
         content = message["content"]
         
@@ -173,32 +253,11 @@ def render_chat_interface():
             st.chat_message("user").write(content)
             # 如果消息中包含文件信息，显示文件预览
             if "files" in message:
-                for file_info in message["files"]:
+                for file_index, file_info in enumerate(message["files"]):
                     with st.expander(f"文件: {file_info['filename']}"):
                         st.write(f"类型: {file_info['file_type']}")
                         
-                        # 获取文件内容，优先从会话状态中获取
-                        file_content = None
-                        file_id = file_info.get("file_id")
-                        if file_id and file_id in st.session_state.get("original_file_contents", {}):
-                            file_content = st.session_state.original_file_contents[file_id]["content"]
-                        else:
-                            file_content = file_info.get("content", "")
-                        
-                        if file_info['file_type'].lower() in ['jpg', 'jpeg', 'png']:
-                            try:
-                                # 解码base64为字节
-                                if file_content and len(file_content) > 100:  # 确保是有效内容
-                                    file_bytes = base64.b64decode(file_content)
-                                    st.image(file_bytes, caption=file_info['filename'])
-                                else:
-                                    st.warning("无法显示图片: 内容无效或不完整")
-                            except Exception as e:
-                                st.error(f"无法显示图片: {str(e)}")
-                        elif file_info['file_type'].lower() == 'pdf':
-                            st.write("PDF文件（已上传，待处理）")
-                        else:
-                            st.write(f"已上传{file_info['file_type']}文件")
+                        render_file_preview(file_info, f"view_original_{message_index}_{file_index}")
         else:
             st.chat_message("assistant").write(content)
     
@@ -239,35 +298,17 @@ def render_chat_interface():
             
             files_info = []
             
-            # 保存原始文件内容到会话状态中，用于后续处理
-            if 'original_file_contents' not in st.session_state:
-                st.session_state.original_file_contents = {}
-                
             for uploaded_file in uploaded_files:
                 try:
-                    # 读取文件内容
-                    file_bytes = uploaded_file.read()
-                    file_content = base64.b64encode(file_bytes).decode('utf-8')
-                    # 确保Base64编码正确
-                    file_content = fix_base64_padding(file_content)
+                    # 文件原始字节保存在磁盘上的文件登记表中，消息中只保存文件ID
                     file_type = uploaded_file.name.split('.')[-1].lower()
+                    file_id = get_file_registry().register(uploaded_file.getvalue(), uploaded_file.name, file_type,
+                                                           session_id=st.session_state.session_id)
                     
-                    # 创建一个更可靠的文件ID
-                    file_id = f"{uploaded_file.name}-{len(file_bytes)}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                    
-                    # 保存原始文件内容到会话状态
-                    st.session_state.original_file_contents[file_id] = {
-                        "content": file_content,
-                        "file_type": file_type
-                    }
-                    
-                    # 只在消息中保存文件引用，不包含实际内容
                     files_info.append({
                         "filename": uploaded_file.name,
                         "file_type": file_type,
-                        "file_id": file_id,
-                        # 包含一个安全的内容预览，不是实际内容
-                        "content_preview": "[已保存原始文件内容，文件ID: " + file_id + "]"
+                        "file_id": file_id
                     })
                 except Exception as e:
                     st.error(f"处理文件 {uploaded_file.name} 时出错: {str(e)}")
@@ -288,32 +329,11 @@ def render_chat_interface():
         st.chat_message("user").write(prompt)
         
         if "files" in user_message:
-            for file_info in user_message["files"]:
+            for file_index, file_info in enumerate(user_message["files"]):
                 with st.expander(f"文件: {file_info['filename']}"):
                     st.write(f"类型: {file_info['file_type']}")
                     
-                    # 获取文件内容，优先从会话状态中获取
-                    file_content = None
-                    file_id = file_info.get("file_id")
-                    if file_id and file_id in st.session_state.get("original_file_contents", {}):
-                        file_content = st.session_state.original_file_contents[file_id]["content"]
-                    else:
-                        file_content = file_info.get("content", "")
-                    
-                    if file_info['file_type'].lower() in ['jpg', 'jpeg', 'png']:
-                        try:
-                            # 解码base64为字节
-                            if file_content and len(file_content) > 100:  # 确保是有效内容
-                                file_bytes = base64.b64decode(file_content)
-                                st.image(file_bytes, caption=file_info['filename'])
-                            else:
-                                st.warning("无法显示图片: 内容无效或不完整")
-                        except Exception as e:
-                            st.error(f"无法显示图片: {str(e)}")
-                    elif file_info['file_type'].lower() == 'pdf':
-                        st.write("PDF文件（已上传，待处理）")
-                    else:
-                        st.write(f"已上传{file_info['file_type']}文件")
+                    render_file_preview(file_info, f"view_original_new_{file_index}")
             
             # 不再立即将文件标记为已处理，而是等到实际处理完成后再标记为已处理
             print("文件已上传但尚未处理，等待实际处理完成后再标记为已处理")
@@ -342,37 +362,17 @@ def render_chat_interface():
                         agent_msg = {"role": "user", "content": msg["content"]}
                         # 如果包含文件信息，添加到消息中
                         if "files" in msg:
-                            # 复制文件信息，确保内容正确
-                            agent_files = []
-                            for file_info in msg["files"]:
-                                # 创建文件信息的深拷贝
-                                new_file = {
-                                    "filename": file_info["filename"],
-                                    "file_type": file_info["file_type"]
-                                }
-                                
-                                # 获取文件内容，优先从会话状态中获取
-                                file_content = None
-                                file_id = file_info.get("file_id")
-                                if file_id and file_id in st.session_state.get("original_file_contents", {}):
-                                    # 从会话状态获取原始文件内容
-                                    file_content = st.session_state.original_file_contents[file_id]["content"]
-                                    print(f"从会话状态获取原始文件内容用于发送给Agent，文件ID: {file_id}, 内容长度: {len(file_content)}")
-                                else:
-                                    # 尝试从file_info获取内容（兼容旧代码）
-                                    file_content = file_info.get("content", "")
-                                
-                                # 确保内容有效
-                                if file_content and len(file_content) > 100 and not file_content.startswith("[已保存"):
-                                    new_file["content"] = file_content
-                                    print(f"成功添加文件内容到Agent消息中，文件: {file_info['filename']}, 内容长度: {len(file_content)}")
-                                else:
-                                    print(f"警告: 无法获取有效的文件内容或内容无效，文件ID: {file_id}")
-                                
-                                agent_files.append(new_file)
-                            
-                            if agent_files:
-                                agent_msg["files"] = agent_files
+                            # 只传递文件ID，工具调用时再按ID从文件登记表取回内容
+                            agent_files = [{
+                                "filename": file_info["filename"],
+                                "file_type": file_info["file_type"],
+                                "file_id": file_info.get("file_id", "")
+                            } for file_info in msg["files"]]
+                            agent_msg["files"] = agent_files
+                            agent_msg["content"] += "\n[已上传文件]" + "".join(
+                                f"\n- {file_info['filename']}（文件ID: {file_info['file_id']}，类型: {file_info['file_type']}）"
+                                for file_info in agent_files
+                            )
                         
                         # 如果消息已被处理过，添加标志
                         if msg.get("already_processed", False):
@@ -430,7 +430,8 @@ def render_chat_interface():
                     print("检测到文件上传，准备调用多模态发票处理器...")
                     # 创建处理工具实例
                     image_processor = InvoiceImageProcessor()
-                    mm_processor = MMInvoiceProcessor()
+                    batch_extractor = BatchInvoiceExtractor()
+                    extraction_jobs = []
                     processed_invoices = []
                     
                     with st.spinner("正在处理上传的文件..."):
@@ -440,131 +441,20 @@ def render_chat_interface():
                                 filename = file_info["filename"]
                                 file_type = file_info["file_type"]
                                 
-                                # 获取文件ID，优先使用file_info中的file_id
-                                file_id = file_info.get("file_id")
-                                
-                                # 尝试从会话状态获取原始文件内容
-                                file_content = None
-                                if file_id and file_id in st.session_state.get("original_file_contents", {}):
-                                    # 从会话状态获取原始文件内容
-                                    original_file_data = st.session_state.original_file_contents[file_id]
-                                    file_content = original_file_data["content"]
-                                    print(f"从会话状态获取到原始文件内容，文件ID: {file_id}, 内容长度: {len(file_content)}")
-                                elif "content" in file_info and len(file_info["content"]) > 100:
-                                    # 直接从file_info获取内容（兼容旧代码）
-                                    file_content = file_info["content"]
-                                    print(f"从file_info获取文件内容，长度: {len(file_content)}")
-                                
-                                # 检查文件内容是否有效
-                                if not file_content or len(file_content) < 100 or file_content.startswith("[已保存") or file_content.startswith("base64_encoded_content"):
-                                    st.error(f"无法获取文件 {filename} 的有效内容，跳过处理")
-                                    print(f"错误: 无法获取有效的文件内容，内容无效或不完整")
+                                # 文件内容保存在文件登记表中，这里只确认文件仍然存在
+                                file_id = file_info.get("file_id", "")
+                                file_meta = get_file_registry().describe(file_id)
+                                if file_meta is None:
+                                    st.error(f"文件 {filename} 已过期，请重新上传")
+                                    print(f"错误: 文件ID {file_id} 不存在或已过期")
                                     continue
                                 
-                                # 调试文件内容
-                                content_excerpt = file_content[:20] + "..." if len(file_content) > 20 else file_content
-                                print(f"DEBUG - 文件内容信息:")
-                                print(f"  文件名: {filename}")
-                                print(f"  内容类型: {type(file_content)}")
-                                print(f"  内容长度: {len(file_content)}")
-                                print(f"  内容摘要: {content_excerpt}")
-                                
                                 st.write(f"正在处理: {filename}")
-                                print(f"处理文件: {filename}, 类型: {file_type}")
+                                print(f"处理文件: {filename}, 类型: {file_type}, 文件ID: {file_id}, 大小: {file_meta['size']}字节")
                                 
-                                # 根据文件类型处理
+                                # PDF直接交给多模态发票处理器：数电票优先读取文本层，无文本层时再渲染为图像识别
                                 if file_type.lower() == 'pdf':
-                                    # 转换PDF为图像
-                                    print(f"开始处理PDF文件: {filename}")
-                                    
-                                    try:
-                                        result = json.loads(image_processor.call(json.dumps({
-                                            'image_params': {
-                                                'operation': 'pdf_to_image',
-                                                'image_data': file_content
-                                            }
-                                        })))
-                                        
-                                        print(f"PDF处理结果: {result.get('status')}")
-                                        
-                                        if result.get('status') == 'success':
-                                            st.success(f"成功将PDF {filename} 转换为{len(result.get('images', []))}张图像")
-                                            
-                                            # 使用第一张图片进行信息提取
-                                            if result.get('images'):
-                                                file_content = result['images'][0]
-                                                file_type = 'jpg'  # PDF转图片后为jpg格式
-                                                print(f"成功提取PDF第一页作为图像，进行后续处理")
-                                            else:
-                                                st.error(f"{filename}: PDF转换成功但未返回任何图像")
-                                                print(f"PDF转换成功但未返回任何图像")
-                                                # 尝试直接将文件作为图片处理
-                                                st.info("尝试直接将文件作为图片处理...")
-                                                continue
-                                        else:
-                                            error_message = result.get('message', 'PDF转换失败')
-                                            st.error(f"{filename}: {error_message}")
-                                            print(f"PDF转换失败: {error_message}")
-                                            
-                                            # 添加问题解决建议
-                                            st.info("""可能的解决方法:
-                                            1. 确保PDF文件内容有效且未加密
-                                            2. 尝试使用其他PDF查看器打开文件以验证其完整性
-                                            3. 尝试将PDF转换为图片后再上传
-                                            4. 如果问题持续存在，请尝试上传JPEG或PNG格式的文件""")
-                                            continue
-                                    except Exception as pdf_err:
-                                        error_msg = str(pdf_err)
-                                        st.error(f"处理PDF {filename} 时发生错误: {error_msg}")
-                                        print(f"处理PDF文件时发生异常: {error_msg}")
-                                        
-                                        # 如果是Base64 padding错误，尝试直接用文件二进制内容
-                                        if "Incorrect padding" in error_msg:
-                                            st.warning("检测到Base64编码问题，尝试使用替代方法...")
-                                            try:
-                                                # 重新读取文件
-                                                uploaded_file.seek(0)
-                                                file_bytes = uploaded_file.read()
-                                                
-                                                # 创建临时PDF文件
-                                                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-                                                    temp_pdf.write(file_bytes)
-                                                    pdf_path = temp_pdf.name
-                                                
-                                                st.info(f"正在尝试直接处理文件: {pdf_path}")
-                                                
-                                                # 验证PDF文件是否有效
-                                                if validate_pdf_file(pdf_path):
-                                                    st.success("PDF文件有效，继续处理...")
-                                                    # 处理逻辑...
-                                                else:
-                                                    st.error("PDF文件无效或损坏")
-                                                
-                                                # 清理临时文件
-                                                os.unlink(pdf_path)
-                                            except Exception as recover_err:
-                                                st.error(f"尝试恢复处理失败: {str(recover_err)}")
-                                        
-                                        # 添加问题解决建议
-                                        st.info("""可能的解决方法:
-                                        1. 请检查PDF文件是否完整且未损坏
-                                        2. 确认系统已安装PyMuPDF和pdf2image库
-                                        3. 尝试使用其他格式的文件（如JPEG或PNG）
-                                        4. 如果问题持续存在，请联系系统管理员""")
-                                        
-                                        import traceback
-                                        traceback.print_exc()
-                                        continue
-                                
-                                # 打印部分文件内容用于调试
-                                content_preview = file_content[:20] + "..." if len(file_content) > 20 else file_content
-                                print(f"文件内容预览: {content_preview}")
-                                
-                                # 检查文件内容是否是占位符文本
-                                if file_content.startswith("base64_encoded_content_of_file"):
-                                    print("错误: 检测到占位符文本而不是实际的Base64编码内容")
-                                    st.error(f"文件 {filename} 内容无效，无法处理")
-                                    continue
+                                    print(f"PDF文件将直接提交处理，优先使用文本层提取: {filename}")
                                 
                                 # 判断可能的票据类型
                                 possible_invoice_type = None
@@ -573,136 +463,111 @@ def render_chat_interface():
                                         possible_invoice_type = type_name
                                         break
                                 
-                                # 显式调用多模态发票处理器，不管什么类型的文件都尝试提取信息
-                                print(f"强制调用多模态发票处理器提取信息: {filename}")
-                                
-                                # 打印部分文件内容用于调试（不包含完整内容）
-                                content_preview = file_content[:20] + "..." if len(file_content) > 20 else file_content
-                                print(f"文件内容预览: {content_preview}")
-                                
-                                # 检查文件内容是否是占位符文本
-                                if file_content.startswith("base64_encoded_content_of_file"):
-                                    print("错误: 检测到占位符文本而不是实际的Base64编码内容")
-                                    st.error(f"文件 {filename} 内容无效，无法处理")
-                                    continue
-                                
-                                # 调用多模态发票处理器
-                                try:
-                                    print(f"准备mm_invoice_processor参数: file_type={file_type}, invoice_type={possible_invoice_type}")
-                                    
-                                    # 检查文件内容的有效性
-                                    if not file_content or len(file_content) < 100:
-                                        print(f"警告: 文件内容可能不完整，长度: {len(file_content) if file_content else 0}")
-                                        if not file_content:
-                                            st.error(f"文件 {filename} 内容为空，无法处理")
-                                            continue
-                                    
-                                    # 检查并修复base64编码
-                                    file_content = fix_base64_padding(file_content)
-                                    
-                                    # 打印部分文件内容用于调试
-                                    content_preview = file_content[:20] + "..." if len(file_content) > 20 else file_content
-                                    print(f"文件内容预览: {content_preview}")
-                                    
-                                    # 准备请求参数
-                                    mm_params = {
-                                        'process_params': {
-                                            'operation': 'extract_info',
-                                            'image_data': file_content,
-                                            'file_type': file_type,
-                                            'invoice_type': possible_invoice_type
-                                        }
-                                    }
-                                    
-                                    # 检查最终的image_data是否有效
-                                    image_data = mm_params['process_params']['image_data']
-                                    if not image_data or len(image_data) < 100:
-                                        st.error(f"文件 {filename} 的Base64编码数据无效，无法处理")
-                                        print(f"错误: image_data无效或太短 (长度: {len(image_data) if image_data else 0})")
-                                        continue
-                                    
-                                    # 不要打印完整参数，只打印结构
-                                    print(f"调用mm_invoice_processor.call，参数结构: {json.dumps({k: '...' for k in mm_params.keys()})}")
-                                    
-                                    # 调用处理器
-                                    mm_result = mm_processor.call(json.dumps(mm_params))
-                                    result_preview = mm_result[:100] + "..." if len(mm_result) > 100 else mm_result
-                                    print(f"mm_invoice_processor返回结果: {result_preview}")
-                                    
-                                    # 解析结果
-                                    result = json.loads(mm_result)
-                                    
-                                    if result.get('status') == 'success':
-                                        invoice_data = result.get('invoice_info', {})
-                                        if invoice_data:
-                                            invoice_data['filename'] = filename
-                                            invoice_data['file_type'] = file_type
-                                            invoice_data['original_content'] = file_content
-                                            
-                                            detected_type = invoice_data.get('invoice_type', '其他')
-                                            st.success(f"成功从{filename}中提取{detected_type}信息")
-                                            print(f"成功提取{detected_type}信息: {json.dumps(invoice_data, ensure_ascii=False)[:200]}...")
-                                            processed_invoices.append(invoice_data)
-                                        else:
-                                            st.warning(f"无法从{filename}中提取有效信息")
-                                            print(f"无法从{filename}中提取有效信息，返回的invoice_info为空")
-                                    else:
-                                        error_msg = result.get('message', '未知错误')
-                                        st.warning(f"处理{filename}失败: {error_msg}")
-                                        print(f"多模态处理失败: {error_msg}")
-                                        
-                                        # 即使处理失败，也创建一个基本的发票结构
-                                        basic_invoice = {
-                                            'invoice_type': possible_invoice_type or '其他',
-                                            'date': datetime.now().strftime('%Y-%m-%d'),
-                                            'amount': 0.0,
-                                            'invoice_id': f"AUTO{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                                            'filename': filename,
-                                            'file_type': file_type,
-                                            'original_content': file_content,
-                                            'needs_manual_input': True,
-                                            'error_message': error_msg
-                                        }
-                                        
-                                        # 根据发票类型添加特定字段
-                                        if possible_invoice_type in ["火车票", "机票", "汽车票"]:
-                                            basic_invoice.update({
-                                                'departure': '',
-                                                'destination': '',
-                                                'passenger': '',
-                                                'travel_date': ''  # 只在交通票据中添加
-                                            })
-                                        elif possible_invoice_type == "酒店住宿发票":
-                                            basic_invoice.update({
-                                                'hotel_name': '',
-                                                'check_in_date': '',
-                                                'check_out_date': '',
-                                                'nights': 1,
-                                                'guest_name': '',
-                                                'hotel_address': '',
-                                                'room_number': ''
-                                            })
-                                        elif possible_invoice_type == "打车票":
-                                            basic_invoice.update({
-                                                'start_location': '',
-                                                'end_location': '',
-                                                'taxi_number': ''
-                                            })
-                                            
-                                        st.info(f"已为{filename}创建基本发票结构，请在后续步骤中手动填写信息")
-                                        processed_invoices.append(basic_invoice)
-                                
-                                except Exception as extract_err:
-                                    st.error(f"处理文件{filename}时发生异常: {str(extract_err)}")
-                                    print(f"提取信息过程中发生异常: {str(extract_err)}")
-                                    import traceback
-                                    traceback.print_exc()
+                                # 加入批量提取队列，所有文件收集完成后并发处理
+                                print(f"加入批量提取队列: file_type={file_type}, invoice_type={possible_invoice_type}")
+                                extraction_jobs.append({
+                                    'filename': filename,
+                                    'file_id': file_id,
+                                    'file_type': file_type,
+                                    'invoice_type': possible_invoice_type
+                                })
                             
                             except Exception as e:
                                 st.error(f"处理文件{filename}时出错: {str(e)}")
                                 print(f"处理文件总体失败: {str(e)}")
                                 import traceback
                                 traceback.print_exc()
+                        
+                        # 并发提取所有文件的发票信息，结果按上传顺序返回
+                        if extraction_jobs:
+                            progress_placeholder = st.empty()
+                            finished_count = [0]
+                            
+                            def report_progress(batch_result):
+                                finished_count[0] += 1
+                                progress_placeholder.write(f"已完成 {finished_count[0]}/{len(extraction_jobs)}: {batch_result['filename']}")
+                            
+                            def report_invoice(event):
+                                # 多页PDF每识别出一张发票就立即显示，无需等待整个文件完成
+                                invoice_info = event['invoice_info']
+                                page_note = f"第{invoice_info['page']}页" if invoice_info.get('page') else ""
+                                st.write(f"{event['filename']}{page_note}: 识别到{invoice_info.get('invoice_type', '其他')}，金额 {invoice_info.get('amount', 0)}")
+                            
+                            try:
+                                batch_results = batch_extractor.extract_batch(extraction_jobs, on_result=report_progress, on_invoice=report_invoice)
+                            except Exception as batch_err:
+                                st.error(f"批量提取发票信息时发生异常: {str(batch_err)}")
+                                print(f"批量提取发票信息时发生异常: {str(batch_err)}")
+                                import traceback
+                                traceback.print_exc()
+                                batch_results = []
+                            
+                            for job, batch_result in zip(extraction_jobs, batch_results):
+                                filename = job['filename']
+                                file_type = job['file_type']
+                                file_id = job['file_id']
+                                possible_invoice_type = job['invoice_type']
+                                
+                                if batch_result.get('status') == 'success':
+                                    # 一个文件（如多页PDF）可能包含多张发票，每张发票一条记录
+                                    file_invoices = batch_result.get('invoices') or []
+                                    for invoice_data in file_invoices:
+                                        invoice_data['filename'] = filename
+                                        invoice_data['file_type'] = file_type
+                                        invoice_data['file_id'] = file_id
+                                        
+                                        detected_type = invoice_data.get('invoice_type', '其他')
+                                        st.success(f"成功从{filename}中提取{detected_type}信息")
+                                        print(f"成功提取{detected_type}信息: {json.dumps(invoice_data, ensure_ascii=False)[:200]}...")
+                                        processed_invoices.append(invoice_data)
+                                    if not file_invoices:
+                                        st.warning(f"无法从{filename}中提取有效信息")
+                                        print(f"无法从{filename}中提取有效信息，返回的invoice_info为空")
+                                else:
+                                    error_msg = batch_result.get('message', '未知错误')
+                                    st.warning(f"处理{filename}失败: {error_msg}")
+                                    print(f"多模态处理失败: {error_msg}")
+                                    
+                                    # 即使处理失败，也创建一个基本的发票结构
+                                    basic_invoice = {
+                                        'invoice_type': possible_invoice_type or '其他',
+                                        'date': datetime.now().strftime('%Y-%m-%d'),
+                                        'amount': 0.0,
+                                        'invoice_id': f"AUTO{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                                        'filename': filename,
+                                        'file_type': file_type,
+                                        'file_id': file_id,
+                                        'needs_manual_input': True,
+                                        'error_message': error_msg
+                                    }
+                                    
+                                    # 根据发票类型添加特定字段
+                                    if possible_invoice_type in ["火车票", "机票", "汽车票"]:
+                                        basic_invoice.update({
+                                            'departure': '',
+                                            'destination': '',
+                                            'passenger': '',
+                                            'travel_date': ''  # 只在交通票据中添加
+                                        })
+                                    elif possible_invoice_type == "酒店住宿发票":
+                                        basic_invoice.update({
+                                            'hotel_name': '',
+                                            'check_in_date': '',
+                                            'check_out_date': '',
+                                            'nights': 1,
+                                            'guest_name': '',
+                                            'hotel_address': '',
+                                            'room_number': ''
+                                        })
+                                    elif possible_invoice_type == "打车票":
+                                        basic_invoice.update({
+                                            'start_location': '',
+                                            'end_location': '',
+                                            'taxi_number': ''
+                                        })
+                                        
+                                    st.info(f"已为{filename}创建基本发票结构，请在后续步骤中手动填写信息")
+                                    processed_invoices.append(basic_invoice)
                     
                     # 如果成功处理了发票，添加到发票列表
                     if processed_invoices:
@@ -753,6 +618,14 @@ def render_chat_interface():
                             # 打印完整的标准化发票信息
                             print(f"标准化后的发票信息: {json.dumps(std_invoice, ensure_ascii=False)[:500]}...")
                             
+                            # 同一张发票重复上传时不重复添加；已在其他报销单中报销的给出提示
+                            if invoice.get('duplicate_claim_id'):
+                                st.warning(f"{std_invoice['filename']}中的发票已在报销单{invoice['duplicate_claim_id']}中报销")
+                            invoice_key = make_invoice_key(std_invoice)
+                            if invoice_key and any(make_invoice_key(inv) == invoice_key for inv in st.session_state.invoices):
+                                st.info(f"{std_invoice['filename']}中的发票{std_invoice['invoice_id']}已在发票列表中，跳过")
+                                continue
+                            
                             # 添加到session state
                             st.session_state.invoices.append(std_invoice)
                         
@@ -841,6 +714,11 @@ def render_chat_interface():
                         # 设置已处理文件的标志
                         st.session_state.has_processed_files = True
                         
+                        # 根据交通票据自动生成行程，无需用户逐项填写
+                        itinerary = rebuild_trips_from_invoices()
+                        if itinerary:
+                            st.info(f"已根据交通票据自动生成{len(st.session_state.trips)}条行程")
+                        
                         # 如果已经有行程信息，切换到报销单生成步骤
                         if len(st.session_state.trips) >= 1:
                             st.session_state.current_step = "报销单生成"
@@ -939,6 +817,10 @@ def render_chat_interface():
                             if transport_info:
                                 system_message += f"\n\n- 行程信息：{', '.join(transport_info)}"
                         
+                        if itinerary:
+                            system_message += "\n\n系统已根据交通票据自动重建行程并录入行程列表：\n" + describe_itinerary(itinerary)
+                            system_message += "\n请不要再要求用户逐项填写这些行程信息，只需请用户确认行程并补充出差事由；如有缺少票据的情况请提醒用户。"
+                        
                         system_message += "\n\n请直接基于以上已提取的信息为用户提供服务，不要再要求用户上传文件。"
                         system_message += "\n如果用户询问发票详情，请直接从上文提供的信息中回答。"
                         system_message += "\n如需生成报销单，可以指导用户使用报销单生成功能。"
@@ -996,6 +878,7 @@ def render_chat_interface():
                                         result = json.loads(msg["content"])
                                         if "trips" in result:
                                             st.session_state.trips = result["trips"]
+                                            st.session_state.trips_from_invoices = False
                                     except:
                                         pass
                                 
@@ -1083,8 +966,9 @@ def render_trip_input_form():
                         "round_trip": round_trip
                     }
                     
-                    # 添加到行程列表
+                    # 添加到行程列表，用户手动录入后不再根据票据自动覆盖行程
                     st.session_state.trips.append(trip_info)
+                    st.session_state.trips_from_invoices = False
                     
                     # 调用行程录入工具
                     trip_recorder = TripRecorder()
@@ -1218,49 +1102,36 @@ def render_invoice_upload_form():
                         try:
                             # 读取文件内容
                             file_bytes = uploaded_file.read()
-                            file_content = base64.b64encode(file_bytes).decode('utf-8')
-                            # 确保Base64编码正确
-                            file_content = fix_base64_padding(file_content)
                             file_type = uploaded_file.name.split('.')[-1].lower()
                             
-                            # 创建图像处理工具实例
-                            image_processor = InvoiceImageProcessor()
-                            
-                            # 如果是PDF文件，先转换为图像
-                            if file_type.lower() == 'pdf':
-                                with st.spinner("正在将PDF转换为图像..."):
-                                    result = json.loads(image_processor.call(json.dumps({
-                                        'image_params': {
-                                            'operation': 'pdf_to_image',
-                                            'image_data': file_content
-                                        }
-                                    })))
-                                    
-                                    if result.get('status') == 'success':
-                                        st.success(f"成功将PDF转换为{len(result.get('images', []))}张图像")
-                                        
-                                        # 使用第一张图片进行信息提取
-                                        if result.get('images'):
-                                            file_content = result['images'][0]
-                                            file_type = 'jpg'  # PDF转图片后为jpg格式
-                                    else:
-                                        st.error(result.get('message', 'PDF转换失败'))
-                            
-                            # 从图像中提取发票信息
+                            # 流式识别发票信息，模型每写完一个字段就先填到页面上
+                            stream_labels = {
+                                'invoice_id': '发票号码', 'amount': '金额', 'date': '日期',
+                                'departure': '出发地', 'destination': '目的地', 'passenger': '乘客',
+                                'travel_date': '乘坐日期', 'hotel_name': '酒店名称',
+                                'check_in_date': '入住日期', 'check_out_date': '退房日期',
+                                'start_location': '起点', 'end_location': '终点'
+                            }
+                            live_fields = {}
+                            live_placeholder = st.empty()
+                            extract_result = {'status': 'error', 'message': '未获取到识别结果'}
                             with st.spinner("正在识别发票信息..."):
-                                extract_result = json.loads(image_processor.call(json.dumps({
-                                    'image_params': {
-                                        'operation': 'extract_info',
-                                        'image_data': file_content,
-                                        'file_type': file_type,
-                                        'invoice_type': invoice_type
-                                    }
-                                })))
+                                for event in MMInvoiceProcessor().extract_stream(file_bytes, file_type, invoice_type, uploaded_file.name):
+                                    if event['type'] == 'result':
+                                        extract_result = event
+                                        continue
+                                    if event['key'] in stream_labels and event['value'] not in (None, ''):
+                                        live_fields[stream_labels[event['key']]] = event['value']
+                                        live_placeholder.markdown("\n".join(
+                                            f"- **{label}**: {value}" for label, value in live_fields.items()
+                                        ))
                                 
                                 if extract_result.get('status') == 'success':
                                     # 如果成功提取到发票信息
                                     extracted_info = extract_result.get('invoice_info', {})
                                     st.success(extract_result.get('message', '成功识别发票信息'))
+                                    if extracted_info.get('duplicate_claim_id'):
+                                        st.warning(f"该发票已在报销单{extracted_info['duplicate_claim_id']}中报销，请勿重复报销")
                                     
                                     # 更新表单值
                                     if invoice_type in ["火车票", "机票", "汽车票"]:
@@ -1586,6 +1457,7 @@ def render_reimbursement_form():
                             "trips": st.session_state.trips,
                             "invoices": st.session_state.invoices,
                             "confirmed": False,  # 初次生成时未确认
+                            "claim_id": st.session_state.claim_id,
                             **user_inputs  # 传递用户输入的字段
                         }
                     })))
@@ -1684,31 +1556,29 @@ def render_reimbursement_form():
             
             # 进入下一步按钮
             if st.button("确认并提交到NCC"):
-                # 用户确认后，如果需要再次生成报销单，将使用confirmed=True
-                if "validation_results" in st.session_state and (
-                    st.session_state.validation_results.get("issues") or 
-                    st.session_state.validation_results.get("warnings")
-                ):
-                    # 重新生成报销单，但标记为已确认
-                    reimbursement_tool = ReimbursementGenerator()
-                    result = json.loads(reimbursement_tool.call(json.dumps({
-                        "generation_params": {
-                            "trips": st.session_state.trips,
-                            "invoices": st.session_state.invoices,
-                            "confirmed": True,  # 用户已确认
-                            **{k: form.get(k, "") for k in [
-                                "报销人", "报销事由", "收款银行名称", "收款人", 
-                                "收款人卡号", "分摊", "分摊原因", "住宿费超标金额",
-                                "城市内公务交通车费超标金额", "超标说明"
-                            ]}
-                        }
-                    })))
-                    
-                    if result.get("status") == "success":
-                        st.session_state.reimbursement_form = result.get("reimbursement_form")
+                # 用户确认后使用confirmed=True重新生成报销单，同时登记发票的报销状态，防止重复报销
+                reimbursement_tool = ReimbursementGenerator()
+                result = json.loads(reimbursement_tool.call(json.dumps({
+                    "generation_params": {
+                        "trips": st.session_state.trips,
+                        "invoices": st.session_state.invoices,
+                        "confirmed": True,  # 用户已确认
+                        "claim_id": st.session_state.claim_id,
+                        **{k: form.get(k, "") for k in [
+                            "报销人", "报销事由", "收款银行名称", "收款人", 
+                            "收款人卡号", "分摊", "分摊原因", "住宿费超标金额",
+                            "城市内公务交通车费超标金额", "超标说明"
+                        ]}
+                    }
+                })))
                 
-                st.session_state.current_step = "提交NCC"
-                st.rerun()
+                if result.get("status") == "success":
+                    st.session_state.reimbursement_form = result.get("reimbursement_form")
+                    st.session_state.current_step = "提交NCC"
+                    st.rerun()
+                else:
+                    # 发票已在其他报销单中报销（包括其他会话同时确认）时不进入提交步骤
+                    st.error(result.get("message", "报销单确认失败"))
 
 def render_ncc_submission_form():
     """渲染NCC提交表单"""
@@ -1791,16 +1661,6 @@ def render_ncc_submission_form():
                 else:
                     st.error(result.get("message", "提交失败"))
 
-def fix_base64_padding(data: str) -> str:
-    """修复Base64编码的padding问题
-    
-    Base64编码的字符串长度应该是4的倍数，如果不是，需要添加=号作为填充
-    """
-    missing_padding = len(data) % 4
-    if missing_padding:
-        data += '=' * (4 - missing_padding)
-    return data
-
 # 主函数
 def main():
     render_header()
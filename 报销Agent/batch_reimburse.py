@@ -0,0 +1,60 @@
+"""月末批量报销
+
+遍历输入目录，每个直接包含发票文件的目录（一个员工或一次出差）生成一份报销单，
+结果写入输出目录中的同名子目录（reimbursement.json），并生成汇总报告summary.json和summary.csv。
+每个目录处理完成后立即写入断点文件，中断后使用相同的参数重新运行即可从断点继续。
+处理状态: success、warning（有提醒或未识别的文件）、rejected（缺少行程、发票重复报销等，
+补充材料后目录指纹变化才会重新处理）、error（处理过程中出现异常，下次运行时重试）。
+
+目录中可选的辅助文件:
+    invoices.json  已提取的发票列表，与目录中的发票文件合并
+    trips.json     手工整理的行程列表，提供时不再根据交通票据重建行程
+    profile.json   报销人、报销事由、收款银行名称、收款人卡号、常驻地等，上级目录中的同名文件逐级合并
+
+用法:
+    python batch_reimburse.py --input 三月报销 --output 三月报销结果 --workers 4
+    python batch_reimburse.py --input 三月报销 --output 三月报销结果 --restart   # 忽略断点重新处理
+"""
+import argparse
+import os
+import sys
+
+from config import BATCH_REIMBURSE_CONFIG
+from tools.batch_reimbursement import BatchReimbursementRunner
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='月末批量报销')
+    parser.add_argument('--input', '-i', required=True, help='报销材料根目录，每个员工或每次出差一个子目录')
+    parser.add_argument('--output', '-o', required=True, help='结果输出目录，同时保存断点文件和汇总报告')
+    parser.add_argument('--workers', '-w', type=int, default=BATCH_REIMBURSE_CONFIG['workers'], help='同时处理的目录数')
+    parser.add_argument('--home-city', default='', help='默认常驻地，profile.json中的常驻地优先')
+    parser.add_argument('--restart', action='store_true', help='删除断点文件，重新处理所有目录')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if not os.path.isdir(args.input):
+        print(f"输入目录不存在: {args.input}")
+        sys.exit(1)
+
+    checkpoint_path = os.path.join(args.output, BATCH_REIMBURSE_CONFIG['checkpoint_name'])
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+        print(f"已删除断点文件: {checkpoint_path}")
+
+    runner = BatchReimbursementRunner(args.input, args.output, workers=args.workers, home_city=args.home_city or None)
+    report = runner.run()
+
+    print("=" * 50)
+    print(f"报销目录: {report['units']}个，本次处理: {report['processed']}个，从断点跳过: {report['skipped']}个")
+    for status, count in sorted(report['counts'].items()):
+        print(f"  {status}: {count}个")
+    print(f"汇总报告: {report['summary_path']}")
+    # 有处理过程中出现异常的目录时返回非零状态码，便于定时任务重试；rejected需要人工补充材料，重试无效
+    sys.exit(1 if report['counts'].get('error') else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""图像预处理尺寸基准测试
+
+对比不同目标短边下发送给多模态模型的字节数、耗时与字段提取准确率。
+PDF样本按较高倍数渲染以模拟手机拍照的大图，并以PDF文本层的提取结果作为标准答案；
+图像样本可通过--ground-truth指定标准答案（{文件名: {字段: 值}}），否则以原图的提取结果为准。
+
+用法:
+    python benchmark/image_size_benchmark.py --input data --sizes 720 960 1280 1600
+    python benchmark/image_size_benchmark.py --input data --dry-run   # 只统计字节数，不调用模型
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from tools.image_preprocessor import ImagePreprocessor
+from tools.invoice_extractor import InvoiceExtractor
+from tools.pdf_text_extractor import PDFTextExtractor
+
+COMPARE_FIELDS = ['发票号码', '金额', '日期', '起始站', '到站', '乘坐日期', '酒店名称', '入住日期', '退房日期']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='图像预处理尺寸基准测试')
+    parser.add_argument('--input', '-i', default='data', help='样本目录，支持pdf、jpg、jpeg、png')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[720, 960, 1280, 1600], help='待比较的目标短边')
+    parser.add_argument('--format', default='JPEG', help='输出格式，JPEG或WEBP')
+    parser.add_argument('--quality', type=int, default=85, help='压缩质量')
+    parser.add_argument('--pdf-zoom', type=float, default=5.0, help='PDF样本的渲染倍数，用于模拟手机照片')
+    parser.add_argument('--ground-truth', help='图像样本的标准答案JSON文件')
+    parser.add_argument('--dry-run', action='store_true', help='只统计字节数，不调用模型')
+    return parser.parse_args()
+
+
+def load_samples(input_dir, pdf_zoom):
+    """读取样本，返回[(文件名, 图像字节, 标准答案或None)]"""
+    samples = []
+    text_extractor = PDFTextExtractor()
+    for filename in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, filename)
+        ext = filename.rsplit('.', 1)[-1].lower()
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+        if ext == 'pdf':
+            with fitz.open(stream=file_bytes, filetype='pdf') as doc:
+                image_bytes = doc.load_page(0).get_pixmap(matrix=fitz.Matrix(pdf_zoom, pdf_zoom)).tobytes('png')
+            samples.append((filename, image_bytes, text_extractor.extract(file_bytes)))
+        elif ext in ('jpg', 'jpeg', 'png'):
+            samples.append((filename, file_bytes, None))
+    return samples
+
+
+def normalize(field, value):
+    """统一字段值的格式，便于比较"""
+    text = re.sub(r'\s', '', str(value or ''))
+    if field == '金额':
+        try:
+            return f'{float(re.sub(r"[^0-9.]", "", text)):.2f}'
+        except ValueError:
+            return text
+    if '日期' in field:
+        return ''.join(f'{int(part):02d}' for part in re.findall(r'\d+', text))
+    if field in ('起始站', '到站'):
+        return text.rstrip('站')
+    return text
+
+
+def field_accuracy(expected, actual):
+    """返回(匹配字段数, 比较字段数)"""
+    matched = total = 0
+    for field in COMPARE_FIELDS:
+        if not expected.get(field):
+            continue
+        total += 1
+        if normalize(field, expected[field]) == normalize(field, actual.get(field)):
+            matched += 1
+    return matched, total
+
+
+def main():
+    args = parse_arguments()
+    samples = load_samples(args.input, args.pdf_zoom)
+    if not samples:
+        print(f"目录 {args.input} 中没有可用样本")
+        return
+
+    ground_truth = {}
+    if args.ground_truth:
+        with open(args.ground_truth, 'r', encoding='utf-8') as f:
+            ground_truth = json.load(f)
+
+    extractor = InvoiceExtractor()
+    # 没有标准答案的样本以原图（不预处理）的提取结果为准
+    if not args.dry_run:
+        extractor.preprocessor = None
+        for index, (filename, image_bytes, expected) in enumerate(samples):
+            expected = expected or ground_truth.get(filename) or extractor.extract_info_from_bytes(image_bytes)
+            samples[index] = (filename, image_bytes, expected)
+
+    original_bytes = sum(len(image_bytes) for _, image_bytes, _ in samples) / len(samples)
+    print(f"样本数: {len(samples)}, 原图平均大小: {original_bytes / 1024:.1f}KB")
+    print(f"{'短边':>6} {'平均大小(KB)':>12} {'压缩比':>8} {'平均耗时(s)':>12} {'字段准确率':>10}")
+
+    for size in args.sizes:
+        preprocessor = ImagePreprocessor(short_side=size, image_format=args.format, quality=args.quality)
+        extractor.preprocessor = preprocessor
+        sent_bytes = []
+        latencies = []
+        matched = total = 0
+        for filename, image_bytes, expected in samples:
+            processed, _, _ = preprocessor.process(image_bytes)
+            sent_bytes.append(len(processed))
+            if args.dry_run:
+                continue
+            start = time.perf_counter()
+            actual = extractor.extract_info_from_bytes(image_bytes)
+            latencies.append(time.perf_counter() - start)
+            file_matched, file_total = field_accuracy(expected, actual)
+            matched += file_matched
+            total += file_total
+
+        avg_bytes = sum(sent_bytes) / len(sent_bytes)
+        latency = f'{sum(latencies) / len(latencies):.2f}' if latencies else '-'
+        accuracy = f'{matched / total:.1%}' if total else '-'
+        print(f"{size:>6} {avg_bytes / 1024:>12.1f} {original_bytes / avg_bytes:>8.1f} {latency:>12} {accuracy:>10}")
+
+
+if __name__ == '__main__':
+    main()
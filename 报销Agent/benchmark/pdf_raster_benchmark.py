@@ -0,0 +1,121 @@
+"""PDF渲染基准测试
+
+对比原有的PDF转图像方式（写临时PDF文件、固定2倍渲染、PNG写入临时文件再读回）
+与渲染进程池方式（内存中打开、pix.tobytes()直接得到图像字节）的耗时和输出尺寸。
+进程池方式分别按固定2倍（与原有方式相同的分辨率）和按页面尺寸自动选择倍数测试，
+前者反映去掉临时文件往返的收益，后者反映渲染到模型目标分辨率的代价。
+
+用法:
+    python benchmark/pdf_raster_benchmark.py --input data --rounds 5
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+from PIL import Image
+from tools.pdf_rasterizer import rasterize_pdf, warm_up_render_pool, _reset_render_pool
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='PDF渲染基准测试')
+    parser.add_argument('--input', '-i', default='data', help='PDF样本目录')
+    parser.add_argument('--rounds', type=int, default=5, help='每个样本重复的次数')
+    return parser.parse_args()
+
+
+def legacy_convert(pdf_bytes):
+    """原有实现：临时文件往返，固定2倍渲染"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
+        temp_pdf.write(pdf_bytes)
+        pdf_path = temp_pdf.name
+    images = []
+    doc = fitz.open(pdf_path)
+    for page_num in range(len(doc)):
+        pix = doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(2, 2))
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_img:
+            temp_img_path = temp_img.name
+        pix.save(temp_img_path)
+        with open(temp_img_path, 'rb') as f:
+            images.append(base64.b64encode(f.read()).decode('utf-8'))
+        os.unlink(temp_img_path)
+    doc.close()
+    os.unlink(pdf_path)
+    return [base64.b64decode(image) for image in images]
+
+
+def pooled_convert(pdf_bytes, zoom=0):
+    """渲染进程池实现，zoom为0时按页面尺寸自动选择倍数"""
+    return [base64.b64decode(base64.b64encode(image)) for image in rasterize_pdf(pdf_bytes, zoom=zoom)]
+
+
+def measure(convert, samples, rounds):
+    """返回(每个样本的耗时中位数列表, 最后一次的输出)"""
+    latencies = []
+    outputs = {}
+    for filename, pdf_bytes in samples:
+        runs = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            outputs[filename] = convert(pdf_bytes)
+            runs.append(time.perf_counter() - start)
+        latencies.append(statistics.median(runs))
+    return latencies, outputs
+
+
+def describe(images):
+    """返回首页图像的尺寸和所有页面的总字节数"""
+    with Image.open(io.BytesIO(images[0])) as img:
+        size = f'{img.width}x{img.height}'
+    return size, sum(len(image) for image in images)
+
+
+def main():
+    args = parse_arguments()
+    samples = []
+    for filename in sorted(os.listdir(args.input)):
+        if filename.lower().endswith('.pdf'):
+            with open(os.path.join(args.input, filename), 'rb') as f:
+                samples.append((filename, f.read()))
+    if not samples:
+        print(f"目录 {args.input} 中没有PDF样本")
+        return
+
+    # 冷启动：进程池尚未创建，计入创建子进程的开销
+    start = time.perf_counter()
+    rasterize_pdf(samples[0][1])
+    cold_start = time.perf_counter() - start
+    _reset_render_pool()
+
+    start = time.perf_counter()
+    warm_up_render_pool()
+    warm_up = time.perf_counter() - start
+
+    legacy_latencies, legacy_outputs = measure(legacy_convert, samples, args.rounds)
+    fixed_latencies, fixed_outputs = measure(lambda pdf_bytes: pooled_convert(pdf_bytes, 2), samples, args.rounds)
+    pooled_latencies, pooled_outputs = measure(pooled_convert, samples, args.rounds)
+
+    print(f"样本数: {len(samples)}, 每个样本重复{args.rounds}次，取中位数")
+    print(f"进程池冷启动首次渲染: {cold_start * 1000:.1f}ms, 预热耗时: {warm_up * 1000:.1f}ms")
+    print(f"{'文件':<16} {'原有(ms)':>10} {'进程池2倍(ms)':>14} {'进程池自动(ms)':>14} "
+          f"{'原有尺寸':>12} {'自动尺寸':>12} {'原有KB':>8} {'2倍KB':>8} {'自动KB':>8}")
+    for index, (filename, _) in enumerate(samples):
+        legacy_size, legacy_bytes = describe(legacy_outputs[filename])
+        _, fixed_bytes = describe(fixed_outputs[filename])
+        pooled_size, pooled_bytes = describe(pooled_outputs[filename])
+        print(f"{filename:<16} {legacy_latencies[index] * 1000:>10.1f} {fixed_latencies[index] * 1000:>14.1f} "
+              f"{pooled_latencies[index] * 1000:>14.1f} {legacy_size:>12} {pooled_size:>12} "
+              f"{legacy_bytes / 1024:>8.1f} {fixed_bytes / 1024:>8.1f} {pooled_bytes / 1024:>8.1f}")
+    print(f"{'平均':<16} {statistics.mean(legacy_latencies) * 1000:>10.1f} {statistics.mean(fixed_latencies) * 1000:>14.1f} "
+          f"{statistics.mean(pooled_latencies) * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
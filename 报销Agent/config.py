@@ -48,8 +48,7 @@ SYSTEM_INSTRUCTION = f'''你是一个智能报销助手，可以帮助用户完
 1. 立即使用mm_invoice_processor工具处理上传的文件，这是一个强大的多模态发票处理工具
 2. 对于每个文件，调用mm_invoice_processor工具，设置process_params参数如下：
    - operation: "extract_info"
-   - image_data: 文件的base64编码内容
-   - file_type: 文件类型（如jpg、pdf等）
+   - file_id: 用户消息中列出的文件ID（形如file_开头的字符串），不要传递文件内容
    - invoice_type: 可选的发票类型提示
 3. 分析提取的信息，并向用户确认这些信息是否正确
 4. 将提取的信息整合到报销流程中
@@ -68,8 +67,7 @@ mm_invoice_processor工具是专门为处理图像和PDF文件设计的，它能
    {{
      "process_params": {{
        "operation": "extract_info",
-       "image_data": "[文件的base64内容]",
-       "file_type": "jpg",  # 或pdf、png等
+       "file_id": "file_3f2a9c...",  # 用户消息中列出的文件ID
        "invoice_type": "火车票"  # 可选，如果知道发票类型
      }}
    }}
@@ -126,6 +124,15 @@ REIMBURSEMENT_TYPE_MAPPING = {
     '出差境内其他地市': []  # 默认类型
 }
 
+# 住宿费标准：报销类型对应的每晚住宿费上限（元），格式如“出差北上:600,出差广深:550”；
+# 未设置标准的报销类型不计算住宿费超标金额，由用户自行填写
+HOTEL_CAP_CONFIG = {
+    'nightly_caps': {
+        name.strip(): float(cap)
+        for name, cap in (item.split(':', 1) for item in os.getenv('HOTEL_NIGHTLY_CAPS', '').split(',') if ':' in item)
+    },
+}
+
 # 收支项目映射
 EXPENSE_CATEGORY_MAPPING = {
     '差旅费-外勤出差': ['火车票', '机票', '汽车票', '酒店住宿发票'],
@@ -138,4 +145,102 @@ UPLOAD_CONFIG = {
     'allowed_extensions': ['pdf', 'jpg', 'jpeg', 'png', 'ofd', 'xml'],
     'max_file_size': 10 * 1024 * 1024,  # 10MB
     'upload_folder': os.path.join(os.path.dirname(__file__), 'uploads')
-} 
\ No newline at end of file
+} 
+
+# 批量发票提取配置
+EXTRACTION_CONFIG = {
+    'max_workers': int(os.getenv('EXTRACTION_MAX_WORKERS', '8')),  # 批量提取的工作线程数
+    'max_concurrency_per_key': int(os.getenv('EXTRACTION_MAX_CONCURRENCY_PER_KEY', '5')),  # 单个API Key的最大并发请求数
+    'requests_per_second': float(os.getenv('EXTRACTION_REQUESTS_PER_SECOND', '2')),  # 单个API Key每秒最多发起的请求数，0表示不限速
+    'json_mode': os.getenv('EXTRACTION_JSON_MODE', 'true').lower() == 'true',  # 通过response_format要求模型只输出JSON，服务不支持时自动关闭
+    # 级联使用的多模态模型，从小到大排列，前一级的结果未通过校验时交给下一级
+    'model_tiers': os.getenv('EXTRACTION_MODEL_TIERS', 'qwen2.5-vl-7b-instruct,qwen2.5-vl-72b-instruct').split(','),
+    'fast_model_kinds': os.getenv('EXTRACTION_FAST_MODEL_KINDS', 'transport,taxi,toll,meal').split(','),  # 允许从小模型开始级联的票据类别
+    'fast_model_min_confidence': float(os.getenv('EXTRACTION_FAST_MODEL_MIN_CONFIDENCE', '0.8')),  # 预分类置信度不低于该值才从小模型开始级联，否则直接使用最后一级
+    'classifier_min_confidence': float(os.getenv('EXTRACTION_CLASSIFIER_MIN_CONFIDENCE', '0.6')),  # 预分类置信度不低于该值才使用专用提示词
+    'date_window_days': int(os.getenv('EXTRACTION_DATE_WINDOW_DAYS', '730')),  # 校验时允许的最早日期（距今天数）
+    'max_amount': float(os.getenv('EXTRACTION_MAX_AMOUNT', '100000')),  # 校验时允许的最大单张发票金额
+    'cascade_log_path': os.getenv('EXTRACTION_CASCADE_LOG', os.path.join(os.path.dirname(__file__), 'cache', 'cascade_stats.jsonl')),  # 级联调用记录，为空时不记录
+}
+
+# 发票提取结果缓存配置
+CACHE_CONFIG = {
+    'enabled': os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true',
+    'db_path': os.getenv('EXTRACTION_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'cache', 'extraction_cache.db')),
+    'max_entries': int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '5000')),  # 缓存条目上限，超出后淘汰最久未访问的条目
+    'ttl_seconds': int(os.getenv('EXTRACTION_CACHE_TTL_DAYS', '30')) * 24 * 3600,  # 缓存有效期
+}
+
+# 跨会话发票去重索引配置
+DUPLICATE_INDEX_CONFIG = {
+    'enabled': os.getenv('DUPLICATE_INDEX_ENABLED', 'true').lower() == 'true',
+    'db_path': os.getenv('DUPLICATE_INDEX_PATH', os.path.join(os.path.dirname(__file__), 'cache', 'invoice_index.db')),
+    'phash_max_distance': int(os.getenv('DUPLICATE_PHASH_MAX_DISTANCE', '3')),  # 感知哈希的最大汉明距离，超过3时按段索引可能漏检
+}
+
+# 多页PDF处理配置
+PDF_CONFIG = {
+    'render_workers': int(os.getenv('PDF_RENDER_WORKERS', str(min(4, os.cpu_count() or 1)))),  # 页面渲染进程数
+    'page_workers': int(os.getenv('PDF_PAGE_WORKERS', '4')),  # 单个PDF并发识别的页数
+    'render_zoom': float(os.getenv('PDF_RENDER_ZOOM', '0')),  # 页面渲染缩放倍数，0表示按页面尺寸和模型输入分辨率自动选择
+    'min_zoom': float(os.getenv('PDF_MIN_ZOOM', '1')),  # 自动选择时的最小倍数
+    'max_zoom': float(os.getenv('PDF_MAX_ZOOM', '4')),  # 自动选择时的最大倍数（约300dpi）
+    'render_format': os.getenv('PDF_RENDER_FORMAT', 'png'),  # 渲染输出格式，png或jpg
+    'warm_up': os.getenv('PDF_RENDER_WARM_UP', 'true').lower() == 'true',  # 应用启动时是否预先启动渲染进程
+    'max_pages': int(os.getenv('PDF_MAX_PAGES', '50')),  # 单个PDF最多处理的页数
+}
+
+# 发送给多模态模型前的图像预处理配置
+IMAGE_PREPROCESS_CONFIG = {
+    'enabled': os.getenv('IMAGE_PREPROCESS_ENABLED', 'true').lower() == 'true',
+    'short_side': int(os.getenv('IMAGE_SHORT_SIDE', '1280')),  # 短边超过该值时等比缩小
+    'max_long_side': int(os.getenv('IMAGE_MAX_LONG_SIDE', '2560')),  # 长边上限，避免长条小票过大
+    'format': os.getenv('IMAGE_FORMAT', 'JPEG'),  # JPEG或WEBP
+    'quality': int(os.getenv('IMAGE_QUALITY', '85')),
+    'crop_border': os.getenv('IMAGE_CROP_BORDER', 'true').lower() == 'true',  # 是否裁掉空白边框
+}
+
+# 发票图像增强配置
+IMAGE_ENHANCE_CONFIG = {
+    'mode': os.getenv('IMAGE_ENHANCE_MODE', 'auto'),  # auto（按图像质量自动选择）、none、fast或quality
+    'min_sharpness': float(os.getenv('IMAGE_MIN_SHARPNESS', '100')),  # 拉普拉斯方差低于该值视为模糊
+    'min_contrast': float(os.getenv('IMAGE_MIN_CONTRAST', '100')),  # 灰度百分位跨度低于该值视为对比度不足
+    'max_side': int(os.getenv('IMAGE_ENHANCE_MAX_SIDE', '1600')),  # 去噪前长边超过该值时先缩小
+    'workers': int(os.getenv('IMAGE_ENHANCE_WORKERS', str(min(4, os.cpu_count() or 1)))),  # 批量增强的进程数
+}
+
+# 上传文件登记配置：文件按内容哈希保存在磁盘上，消息、工具参数和会话状态中只传递文件ID
+FILE_REGISTRY_CONFIG = {
+    'root': os.getenv('FILE_REGISTRY_ROOT', os.path.join(os.path.dirname(__file__), 'cache', 'uploads')),
+    'max_bytes': int(os.getenv('FILE_REGISTRY_MAX_MB', '2048')) * 1024 * 1024,  # 磁盘上保存的文件总大小上限，超出时淘汰最久未使用且无会话引用的文件
+    'session_quota_bytes': int(os.getenv('FILE_REGISTRY_SESSION_QUOTA_MB', '200')) * 1024 * 1024,  # 单个会话引用的文件总大小上限
+    'ttl_seconds': int(os.getenv('FILE_REGISTRY_TTL_SECONDS', str(24 * 3600))),  # 会话引用的保存时长，过期后视为无引用
+}
+
+# 行程与交通票据匹配配置
+TRIP_MATCH_CONFIG = {
+    'date_tolerance_days': int(os.getenv('TRIP_MATCH_DATE_TOLERANCE_DAYS', '2')),  # 票据乘车日期与行程日期允许相差的天数
+}
+
+# 行程重建配置
+ITINERARY_CONFIG = {
+    'home_city': os.getenv('ITINERARY_HOME_CITY', ''),  # 常驻地，为空时以最早一段行程的出发地为常驻地
+    'max_gap_days': int(os.getenv('ITINERARY_MAX_GAP_DAYS', '30')),  # 相邻两段行程间隔超过该天数时视为两次出差
+}
+
+# 缩略图缓存配置
+PREVIEW_CACHE_CONFIG = {
+    'root': os.getenv('PREVIEW_CACHE_ROOT', os.path.join(os.path.dirname(__file__), 'cache', 'previews')),
+    'max_side': int(os.getenv('PREVIEW_MAX_SIDE', '480')),  # 缩略图长边像素
+    'memory_items': int(os.getenv('PREVIEW_MEMORY_ITEMS', '256')),  # 内存中缓存的缩略图数量
+    'disk_max_bytes': int(os.getenv('PREVIEW_DISK_MAX_MB', '100')) * 1024 * 1024,  # 磁盘缓存总大小上限
+    'jpeg_quality': 80,
+}
+
+# 月末批量报销配置
+BATCH_REIMBURSE_CONFIG = {
+    'workers': int(os.getenv('BATCH_REIMBURSE_WORKERS', '4')),  # 同时处理的报销目录数，每个目录内的文件再由批量提取引擎并发识别
+    'file_types': ['pdf', 'ofd', 'xml', 'jpg', 'jpeg', 'png'],  # 作为发票文件处理的扩展名，OFD和XML电子发票直接解析
+    'checkpoint_name': 'checkpoint.jsonl',  # 输出目录中的断点文件，每处理完一个目录追加一行
+    'summary_name': 'summary',  # 输出目录中的汇总报告文件名（不含扩展名），同时生成json和csv
+}
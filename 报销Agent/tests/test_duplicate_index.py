@@ -0,0 +1,86 @@
+import pytest
+
+from tools.duplicate_index import DuplicateInvoiceIndex, make_invoice_key
+
+# 最高位为1，存储时需要转换为有符号整数
+BASE_PHASH = 0xF0E1D2C3B4A59687
+
+
+def _invoice(invoice_id, amount=100.0, date='2025年03月23日'):
+    return {'invoice_type': '火车票', 'invoice_id': invoice_id, 'amount': amount, 'date': date}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DuplicateInvoiceIndex(db_path=str(tmp_path / 'invoices.db'), phash_max_distance=3)
+
+
+def _flip(phash, bits):
+    for bit in bits:
+        phash ^= 1 << bit
+    return phash
+
+
+def test_make_invoice_key_skips_auto_ids_and_empty_amounts():
+    assert make_invoice_key(_invoice('25359134682000224168', 692)) == '25359134682000224168|692.00|20250323'
+    assert make_invoice_key(_invoice('AUTO20250323')) is None
+    assert make_invoice_key(_invoice('25359134682000224168', 0)) is None
+
+
+@pytest.mark.parametrize('bits', [[0], [5, 21], [3, 20, 40], [60, 61, 62]])
+def test_find_similar_within_distance(index, bits):
+    index.add(_invoice('1001'), content_sha256='a', phash=BASE_PHASH, prompt_version='v1')
+    similar = index.find_similar(_flip(BASE_PHASH, bits))
+    assert [(record['invoice_key'], record['distance']) for record in similar] == [
+        (make_invoice_key(_invoice('1001')), len(bits))]
+
+
+@pytest.mark.parametrize('bits', [[0, 16, 32, 48], [1, 2, 3, 4]])
+def test_find_similar_rejects_larger_distance(index, bits):
+    # 第一组每段各差一位，没有相同的段；第二组有三段相同，但距离超过上限
+    index.add(_invoice('1001'), content_sha256='a', phash=BASE_PHASH, prompt_version='v1')
+    assert index.find_similar(_flip(BASE_PHASH, bits)) == []
+
+
+def test_find_similar_sorts_by_distance(index):
+    index.add(_invoice('1001'), content_sha256='a', phash=_flip(BASE_PHASH, [1, 2]), prompt_version='v1')
+    index.add(_invoice('1002'), content_sha256='b', phash=BASE_PHASH, prompt_version='v1')
+    assert [record['distance'] for record in index.find_similar(BASE_PHASH)] == [0, 2]
+    assert index.find_similar(None) == []
+
+
+def test_lookup_file_requires_same_prompt_version(index):
+    index.add(_invoice('1001'), content_sha256='a', prompt_version='v1')
+    assert index.lookup_file('a', 'v1')['invoice_info']['invoice_id'] == '1001'
+    assert index.lookup_file('a', 'v2') is None
+
+
+def test_claim_marks_unclaimed_invoices(index):
+    index.add(_invoice('1001'))
+    result = index.claim([_invoice('1001'), _invoice('1002')], 'BX1')
+    assert result == {'issues': [], 'marked': 2}
+    assert index.lookup_invoice(_invoice('1001'))['claim_id'] == 'BX1'
+    assert index.lookup_invoice(_invoice('1002'))['claim_id'] == 'BX1'
+
+
+def test_claim_is_idempotent_for_same_claim(index):
+    index.claim([_invoice('1001')], 'BX1')
+    result = index.claim([_invoice('1001'), _invoice('1003')], 'BX1')
+    assert result == {'issues': [], 'marked': 1}
+
+
+def test_claim_conflict_rolls_back_whole_batch(index):
+    index.claim([_invoice('1001')], 'BX1')
+    result = index.claim([_invoice('1002'), _invoice('1001')], 'BX2')
+    assert result['marked'] == 0
+    assert len(result['issues']) == 1 and 'BX1' in result['issues'][0]
+    assert index.lookup_invoice(_invoice('1001'))['claim_id'] == 'BX1'
+    assert index.lookup_invoice(_invoice('1002')) is None
+    assert index.check_claimable([_invoice('1002')], 'BX2') == []
+
+
+def test_claim_rejects_duplicates_within_batch(index):
+    result = index.claim([_invoice('1001'), _invoice('1001'), _invoice('AUTO20250323')], 'BX1')
+    assert result['marked'] == 0
+    assert result['issues'] == ['发票1001（金额100.0）在本次报销中重复出现']
+    assert index.stats() == {'invoices': 0, 'claimed': 0, 'files': 0}
@@ -0,0 +1,25 @@
+import base64
+import binascii
+
+import pytest
+
+from utils.helpers import decode_base64_data
+
+PAYLOAD = bytes(range(256)) * 3
+
+
+def test_decode_base64_ignores_line_breaks_and_spaces():
+    encoded = base64.encodebytes(PAYLOAD).decode()
+    assert '\n' in encoded
+    assert decode_base64_data(encoded) == PAYLOAD
+    assert decode_base64_data(f"data:application/pdf;base64, {encoded.replace(chr(10), chr(13) + chr(10))} ") == PAYLOAD
+
+
+def test_decode_base64_restores_padding_after_whitespace():
+    encoded = base64.b64encode(b'ab').decode().rstrip('=')
+    assert decode_base64_data(f"{encoded[:2]}\n{encoded[2:]}\n") == b'ab'
+
+
+def test_decode_base64_rejects_invalid_characters():
+    with pytest.raises(binascii.Error):
+        decode_base64_data('YW*i')
@@ -0,0 +1,131 @@
+import datetime
+
+import pytest
+
+from config import HOTEL_CAP_CONFIG
+from tools.hotel_coverage import HotelCoverageIndex, check_hotel_coverage, merge_windows
+from tools.reimbursement_generator import ReimbursementGenerator
+
+
+def _date(text):
+    return datetime.date.fromisoformat(text)
+
+
+def _hotel(check_in, check_out=None, amount=0, **extra):
+    invoice = {'invoice_type': '酒店住宿发票', 'check_in_date': check_in, 'amount': amount}
+    if check_out:
+        invoice['check_out_date'] = check_out
+    invoice.update(extra)
+    return invoice
+
+
+def _trip(departure_date, arrival_date, arrival_place='北京'):
+    return {'departure_date': departure_date, 'arrival_date': arrival_date,
+            'departure_place': '上海', 'arrival_place': arrival_place}
+
+
+def test_overlapping_stays_are_double_booked():
+    index = HotelCoverageIndex([
+        _hotel('2025-03-01', '2025-03-04'),
+        {'invoice_type': '火车票', 'date': '2025-03-01'},
+        _hotel('2025-03-03', '2025-03-05'),
+    ])
+    coverage = index.query(_date('2025-03-01'), _date('2025-03-06'))
+    assert coverage['expected_nights'] == 5
+    assert coverage['covered_nights'] == 4
+    assert coverage['uncovered'] == [_date('2025-03-05')]
+    assert coverage['double_booked'] == {_date('2025-03-03'): [0, 2]}
+
+
+def test_merge_windows_joins_nested_and_touching_windows():
+    windows = [
+        (_date('2025-03-10'), _date('2025-03-12')),
+        (_date('2025-03-01'), _date('2025-03-08')),
+        (_date('2025-03-03'), _date('2025-03-05')),
+        (_date('2025-03-08'), _date('2025-03-09')),
+    ]
+    assert merge_windows(windows) == [
+        (_date('2025-03-01'), _date('2025-03-09')),
+        (_date('2025-03-10'), _date('2025-03-12')),
+    ]
+
+
+def test_nested_trips_count_nights_once():
+    result = check_hotel_coverage(
+        [_trip('2025-03-01', '2025-03-05'), _trip('2025-03-02', '2025-03-04')],
+        [_hotel('2025-03-01', '2025-03-05')])
+    assert [trip['covered_nights'] for trip in result['trips']] == [4, 2]
+    assert result['total_nights'] == 4
+    assert result['invoice_nights'] == {0: (4, 4)}
+
+
+def test_stay_starting_before_trip_only_counts_nights_inside():
+    result = check_hotel_coverage(
+        [_trip('2025-03-03', '2025-03-05')],
+        [_hotel('2025-03-01', '2025-03-05')])
+    assert result['trips'][0]['covered_nights'] == 2
+    assert result['trips'][0]['uncovered_nights'] == []
+    assert result['total_nights'] == 2
+    assert result['invoice_nights'] == {0: (2, 4)}
+    assert result['outside_invoices'] == []
+
+
+def test_non_iso_dates_and_nights_only_stays():
+    result = check_hotel_coverage(
+        [_trip('2025年3月1日', '20250305')],
+        [
+            _hotel('2025年03月01日', '2025年03月03日'),
+            _hotel('20250303', nights='2'),
+            {'invoice_type': '酒店住宿发票', 'raw_extracted_info': {'入住日期': '2025/03/04'}},
+        ])
+    trip = result['trips'][0]
+    assert trip['expected_nights'] == 4
+    assert trip['covered_nights'] == 4
+    assert trip['uncovered_nights'] == []
+    assert result['unparsed_invoices'] == [2]
+
+
+def test_outside_and_unparsed_invoices_are_reported():
+    result = check_hotel_coverage(
+        [_trip('2025-03-01', '2025-03-03')],
+        [_hotel('2025-03-01', '2025-03-03'), _hotel('2025-04-01', '2025-04-02'), _hotel('未知')])
+    assert result['total_nights'] == 2
+    assert result['outside_invoices'] == [1]
+    assert result['unparsed_invoices'] == [2]
+    assert result['trips'][0]['uncovered_text'] == ''
+
+
+@pytest.fixture
+def nightly_caps(monkeypatch):
+    monkeypatch.setitem(HOTEL_CAP_CONFIG['nightly_caps'], '出差北上', 500.0)
+
+
+def test_overage_excludes_outside_and_unparsed_invoices(nightly_caps):
+    invoices = [
+        _hotel('2025-03-01', '2025-03-03', amount=1200),
+        _hotel('2025-04-01', '2025-04-02', amount=800),
+        _hotel('未知', amount=900),
+    ]
+    form = ReimbursementGenerator()._generate_reimbursement_form(
+        [_trip('2025-03-01', '2025-03-03')], invoices, {})
+    assert form['住宿费标准金额'] == 1000
+    assert form['住宿费超标金额'] == '200.00'
+    assert '住宿2晚' in form['超标说明']
+
+
+def test_overage_prorates_stays_extending_past_trip(nightly_caps):
+    # 4晚共2000元，只有行程内的2晚计入，折算1000元，未超标
+    invoices = [_hotel('2025-03-01', '2025-03-05', amount=2000)]
+    form = ReimbursementGenerator()._generate_reimbursement_form(
+        [_trip('2025-03-03', '2025-03-05')], invoices, {})
+    assert form['住宿费标准金额'] == 1000
+    assert form['住宿费超标金额'] == '0'
+    assert form['超标说明'] == '无'
+
+
+def test_overage_keeps_user_entered_amount(nightly_caps):
+    invoices = [_hotel('2025-03-01', '2025-03-02', amount=900)]
+    form = ReimbursementGenerator()._generate_reimbursement_form(
+        [_trip('2025-03-01', '2025-03-02')], invoices, {'住宿费超标金额': '100', '超标说明': '会议酒店'})
+    assert form['住宿费超标金额'] == '100'
+    assert form['超标说明'] == '会议酒店'
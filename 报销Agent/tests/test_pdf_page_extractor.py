@@ -0,0 +1,99 @@
+import os
+
+import fitz  # PyMuPDF
+from tools.extraction_cache import ExtractionCache
+from tools.pdf_page_extractor import PDFPageExtractor, split_pdf_pages
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+
+def _read(name):
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def _merge(names):
+    """把多个样本PDF合并为一个多页PDF"""
+    with fitz.open() as merged:
+        for name in names:
+            with fitz.open(stream=_read(name), filetype='pdf') as doc:
+                merged.insert_pdf(doc)
+        return merged.tobytes()
+
+
+def test_split_multi_page_pdf_is_deterministic():
+    pdf_bytes = _merge(['酒店.pdf', '福州到上海.pdf'])
+    first = split_pdf_pages(pdf_bytes)
+    second = split_pdf_pages(pdf_bytes)
+    assert len(first) == len(second) >= 2
+    assert first == second
+    assert ([ExtractionCache.make_key(page, None, 'v1') for page in first]
+            == [ExtractionCache.make_key(page, None, 'v1') for page in second])
+
+
+def test_split_single_page_pdf_keeps_original_bytes():
+    pdf_bytes = _read('酒店.pdf')
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+        assert len(doc) == 1
+    assert split_pdf_pages(pdf_bytes) == [pdf_bytes]
+
+
+class StubProcessor:
+    """按页码顺序返回预设结果的发票处理器，配合page_workers=1使用"""
+
+    def __init__(self, page_infos):
+        self.page_infos = list(page_infos)
+
+    def extract_from_bytes(self, page_bytes, file_type, invoice_type=None, file_name=None):
+        info = self.page_infos.pop(0)
+        return {'status': 'success', 'message': '', 'invoice_info': dict(info) if info else None}
+
+
+def _blank_pdf(page_count):
+    with fitz.open() as doc:
+        for page_index in range(page_count):
+            doc.new_page().insert_text((72, 72), f'page {page_index + 1}')
+        return doc.tobytes()
+
+
+def _extract(page_infos):
+    emitted = []
+    extractor = PDFPageExtractor(StubProcessor(page_infos), page_workers=1)
+    invoices = extractor.extract(_blank_pdf(len(page_infos)), on_invoice=emitted.append)
+    return invoices, emitted
+
+
+def test_folio_page_without_invoice_number_is_not_a_separate_invoice():
+    invoices, emitted = _extract([
+        {'invoice_type': '酒店住宿发票', 'invoice_id': '25312000000012345678', 'amount': 900.0},
+        # 账单明细页没有发票号码，转换为系统格式时得到AUTO编号，但带有房费金额
+        {'invoice_type': '酒店住宿发票', 'invoice_id': 'AUTO2025-03-26', 'amount': 900.0},
+    ])
+    assert [invoice['invoice_id'] for invoice in invoices] == ['25312000000012345678']
+    assert emitted == invoices
+    assert sum(invoice['amount'] for invoice in invoices) == 900.0
+
+
+def test_attachment_page_without_number_or_amount_is_skipped():
+    invoices, _ = _extract([
+        {'invoice_type': '其他', 'invoice_id': 'AUTO', 'amount': 0},
+        {'invoice_type': '火车票', 'invoice_id': '25319000000087654321', 'amount': 300.0},
+    ])
+    assert [invoice['page'] for invoice in invoices] == [2]
+
+
+def test_pages_without_any_invoice_number_are_kept():
+    invoices, emitted = _extract([
+        {'invoice_type': '其他', 'invoice_id': 'AUTO', 'amount': 20.0},
+        {'invoice_type': '其他', 'invoice_id': '', 'amount': 35.0},
+    ])
+    assert [invoice['amount'] for invoice in invoices] == [20.0, 35.0]
+    assert len(emitted) == 2
+
+
+def test_continuation_page_with_same_number_is_merged():
+    invoices, _ = _extract([
+        {'invoice_type': '酒店住宿发票', 'invoice_id': '123', 'amount': 500.0},
+        {'invoice_type': '酒店住宿发票', 'invoice_id': '123', 'amount': 500.0},
+    ])
+    assert len(invoices) == 1
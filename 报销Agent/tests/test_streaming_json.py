@@ -0,0 +1,72 @@
+import json
+import random
+
+from tools.streaming_json import IncrementalJSONParser
+
+SAMPLE = ('```json\n{"发票类型": "火车票", "备注": "含\\"引号\\"和}括号", "金额": 72.0, '
+          '"行程": {"起始站": "上海南站", "经停": ["嘉兴南", {"站": "杭州东站"}]}, '
+          '"座位": [], "已报销": false, "发票号码": null, "票价": 72}\n```')
+
+
+def _feed_in_chunks(text, sizes):
+    parser = IncrementalJSONParser()
+    completed = []
+    position = 0
+    for size in sizes:
+        completed.extend(parser.feed(text[position:position + size]))
+        position += size
+    completed.extend(parser.feed(text[position:]))
+    return parser, completed
+
+
+def test_parses_fields_in_order():
+    parser = IncrementalJSONParser()
+    completed = parser.feed(SAMPLE)
+    expected = json.loads(SAMPLE[len('```json\n'):-len('\n```')])
+    assert completed == list(expected.items())
+    assert parser.fields == expected
+    assert parser.done
+
+
+def test_escaped_quotes_in_keys_and_values():
+    parser = IncrementalJSONParser()
+    completed = parser.feed(r'{"a\"b": "x\\", "c": "\"}\""}')
+    assert completed == [('a"b', 'x\\'), ('c', '"}"')]
+
+
+def test_field_is_returned_as_soon_as_it_is_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"发票类型": "火车') == []
+    assert parser.feed('票", "金额": 7') == [('发票类型', '火车票')]
+    assert parser.feed('2') == []
+    assert parser.feed(', "行程": {"站": ["上海"]') == [('金额', 72)]
+    assert parser.feed('}') == [('行程', {'站': ['上海']})]
+    assert not parser.done
+    assert parser.feed('}') == []
+    assert parser.done
+
+
+def test_number_or_literal_directly_before_closing_brace():
+    for text, value in (('{"n": 1.5}', 1.5), ('{"n":true}', True), ('{"n": null }', None)):
+        parser = IncrementalJSONParser()
+        assert parser.feed(text) == [('n', value)]
+        assert parser.done
+
+
+def test_fence_prefix_is_skipped():
+    parser = IncrementalJSONParser()
+    assert parser.feed('好的，识别结果如下：\n```json\n') == []
+    assert parser.feed('{"a": 1}') == [('a', 1)]
+
+
+def test_arbitrary_chunk_boundaries():
+    expected = IncrementalJSONParser().feed(SAMPLE)
+    for size in range(1, 8):
+        parser, completed = _feed_in_chunks(SAMPLE, [size] * (len(SAMPLE) // size))
+        assert completed == expected
+        assert parser.done
+    rng = random.Random(0)
+    for _ in range(50):
+        sizes = [rng.randint(0, 6) for _ in range(len(SAMPLE))]
+        parser, completed = _feed_in_chunks(SAMPLE, sizes)
+        assert completed == expected
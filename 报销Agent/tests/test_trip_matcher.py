@@ -0,0 +1,99 @@
+import datetime
+import glob
+import os
+
+from tools.mm_invoice_processor import MMInvoiceProcessor
+from tools.pdf_text_extractor import PDFTextExtractor
+from tools.trip_matcher import TripMatcher, _min_cost_flow
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+SAMPLE_TRIPS = [
+    {'departure_place': '福州', 'arrival_place': '上海', 'departure_date': '2025-03-23', 'arrival_date': '2025-03-31'},
+    {'departure_place': '上海', 'arrival_place': '杭州', 'departure_date': '2025-03-25', 'arrival_date': '2025-03-25'},
+    {'departure_place': '福州', 'arrival_place': '深圳', 'departure_date': '2025-04-23', 'arrival_date': '2025-04-25'},
+]
+
+
+def _date(text):
+    return datetime.date.fromisoformat(text)
+
+
+def _ticket(departure, destination, travel_date):
+    return {'invoice_type': '火车票', 'departure': departure, 'destination': destination, 'travel_date': travel_date}
+
+
+def _sample_invoices():
+    """从data目录中的样本PDF提取发票，与上传后的发票格式一致"""
+    extractor = PDFTextExtractor()
+    processor = MMInvoiceProcessor()
+    invoices = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.pdf'))):
+        with open(path, 'rb') as f:
+            invoices.append(processor._convert_to_system_format(extractor.extract(f.read())))
+    return invoices
+
+
+def test_sample_itinerary_matches_all_legs():
+    invoices = _sample_invoices()
+    result = TripMatcher(date_tolerance_days=0).match(SAMPLE_TRIPS, invoices)
+    assert len(result['matched']) == 6
+    assert result['unmatched_legs'] == []
+    assert result['unused_invoices'] == []
+    for entry in result['matched']:
+        invoice = invoices[entry['invoice_index']]
+        assert entry['departure'] in invoice['departure']
+        assert entry['arrival'] in invoice['destination']
+
+
+def test_unmatched_leg_and_unused_invoice():
+    trips = [{'departure_place': '上海', 'arrival_place': '北京',
+              'departure_date': '2025-03-01', 'arrival_date': '2025-03-10'}]
+    invoices = [_ticket('上海虹桥', '北京南', '2025-03-01'), _ticket('北京南', '上海虹桥', '2025-03-20')]
+    result = TripMatcher(date_tolerance_days=2).match(trips, invoices)
+    assert [(entry['leg'], entry['invoice_index']) for entry in result['matched']] == [('outbound', 0)]
+    assert [(entry['leg'], entry['date']) for entry in result['unmatched_legs']] == [('return', '2025-03-10')]
+    assert result['unused_invoices'] == [1]
+
+
+def test_competing_trips_get_closest_tickets():
+    # 两个行程都能用3月2日的票，最优方案把它留给3月2日出发的行程，3月1日的行程用3月1日的票
+    trips = [
+        {'departure_place': '上海', 'arrival_place': '北京', 'departure_date': '2025-03-02', 'round_trip': False},
+        {'departure_place': '上海', 'arrival_place': '北京', 'departure_date': '2025-03-01', 'round_trip': False},
+    ]
+    invoices = [_ticket('上海', '北京', '2025-03-02'), _ticket('上海', '北京', '2025-03-01')]
+    result = TripMatcher(date_tolerance_days=2).match(trips, invoices)
+    assert {entry['trip_index']: entry['invoice_index'] for entry in result['matched']} == {0: 0, 1: 1}
+
+
+def test_single_ticket_goes_to_one_of_competing_trips():
+    trips = [
+        {'departure_place': '上海', 'arrival_place': '北京', 'departure_date': '2025-03-01', 'round_trip': False},
+        {'departure_place': '上海', 'arrival_place': '北京', 'departure_date': '2025-03-02', 'round_trip': False},
+    ]
+    result = TripMatcher(date_tolerance_days=2).match(trips, [_ticket('上海', '北京', '2025-03-02')])
+    assert [(entry['trip_index'], entry['invoice_index']) for entry in result['matched']] == [(1, 0)]
+    assert [entry['trip_index'] for entry in result['unmatched_legs']] == [0]
+
+
+def test_station_aliases_resolve_to_trip_cities():
+    trips = [{'departure_place': '福州', 'arrival_place': '上海',
+              'departure_date': '2025-03-23', 'arrival_date': '2025-03-31'}]
+    invoices = [_ticket('福州站', '上海虹桥站', '2025年03月23日'), _ticket('上海南站', '福州南站', '20250331')]
+    result = TripMatcher(date_tolerance_days=0).match(trips, invoices)
+    assert [(entry['leg'], entry['invoice_index']) for entry in result['matched']] == [('outbound', 0), ('return', 1)]
+
+
+def test_min_cost_flow_maximises_matches_before_cost():
+    # 3月1日的行程段可以用3月1日或3月2日的票，3月3日的行程段只能用3月2日的票（容差1天），
+    # 匹配最多的方案是3月1日用3月1日的票、3月3日用3月2日的票
+    flows = _min_cost_flow({_date('2025-03-01'): 1, _date('2025-03-03'): 1},
+                           {_date('2025-03-01'): 1, _date('2025-03-02'): 1}, 1)
+    assert flows == {(_date('2025-03-01'), _date('2025-03-01')): 1, (_date('2025-03-03'), _date('2025-03-02')): 1}
+
+
+def test_min_cost_flow_aggregates_same_day_legs():
+    flows = _min_cost_flow({_date('2025-03-01'): 3}, {_date('2025-03-01'): 1, _date('2025-03-02'): 1,
+                                                      _date('2025-03-05'): 4}, 2)
+    assert flows == {(_date('2025-03-01'), _date('2025-03-01')): 1, (_date('2025-03-01'), _date('2025-03-02')): 1}
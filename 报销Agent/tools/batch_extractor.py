@@ -0,0 +1,287 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+from config import EXTRACTION_CONFIG
+from tools.mm_invoice_processor import MMInvoiceProcessor
+from tools.pdf_page_extractor import PDFPageExtractor
+from tools.file_registry import get_file_registry
+from utils.helpers import decode_base64_data
+
+
+class KeyRateLimiter:
+    """按API Key限制并发数和请求速率的限流器"""
+
+    def __init__(self, max_concurrency: int, requests_per_second: float = 0):
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._min_interval = 1.0 / requests_per_second if requests_per_second and requests_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    @contextmanager
+    def acquire(self):
+        """获取一个调用名额，必要时等待到下一个可用的时间片"""
+        self._semaphore.acquire()
+        try:
+            if self._min_interval:
+                with self._lock:
+                    now = time.monotonic()
+                    wait_time = self._next_slot - now
+                    self._next_slot = max(now, self._next_slot) + self._min_interval
+                if wait_time > 0:
+                    time.sleep(wait_time)
+            yield
+        finally:
+            self._semaphore.release()
+
+
+# 进程内共享的限流器，同一个API Key的所有批次共用一个配额
+_rate_limiters: Dict[str, KeyRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key: str,
+                     max_concurrency: Optional[int] = None,
+                     requests_per_second: Optional[float] = None) -> KeyRateLimiter:
+    """获取指定API Key对应的限流器，不存在时按配置创建
+
+    Args:
+        api_key: 模型服务的API Key
+        max_concurrency: 该Key允许的最大并发请求数
+        requests_per_second: 该Key允许的每秒请求数，0表示不限速
+
+    Returns:
+        KeyRateLimiter: 限流器实例
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(api_key)
+        if limiter is None:
+            limiter = KeyRateLimiter(
+                max_concurrency or EXTRACTION_CONFIG['max_concurrency_per_key'],
+                EXTRACTION_CONFIG['requests_per_second'] if requests_per_second is None else requests_per_second
+            )
+            _rate_limiters[api_key] = limiter
+        return limiter
+
+
+async def gather_bounded(task_factories: List[Callable[[], Awaitable[Any]]],
+                         max_concurrency: int,
+                         timeout: Optional[float] = None) -> List[Any]:
+    """以有限并发运行一组协程，单个任务超时或失败不影响其他任务
+
+    调用方取消时，所有尚未完成的任务都会被取消。
+
+    Args:
+        task_factories: 返回协程的无参函数列表，任务获得并发名额后才创建协程
+        max_concurrency: 同时运行的最大任务数
+        timeout: 单个任务的超时时间（秒），None表示不限时
+
+    Returns:
+        List: 与输入顺序一致的结果，失败或超时的任务对应位置为异常对象
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(factory):
+        async with semaphore:
+            return await asyncio.wait_for(factory(), timeout)
+
+    tasks = [asyncio.ensure_future(run(factory)) for factory in task_factories]
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class BatchInvoiceExtractor:
+    """批量发票提取引擎，以有限并发调用多模态发票处理器"""
+
+    def __init__(self,
+                 processor: Optional[MMInvoiceProcessor] = None,
+                 max_workers: Optional[int] = None,
+                 max_concurrency_per_key: Optional[int] = None,
+                 requests_per_second: Optional[float] = None):
+        self.processor = processor or MMInvoiceProcessor()
+        self.max_workers = max_workers or EXTRACTION_CONFIG['max_workers']
+        self.rate_limiter = get_rate_limiter(
+            self.processor.invoice_extractor.api_key,
+            max_concurrency_per_key,
+            requests_per_second
+        )
+        # 限流只作用于真正的大模型调用，PDF文本层和缓存命中不占用配额
+        self.processor.rate_limiter = self.rate_limiter
+        self.page_extractor = PDFPageExtractor(self.processor)
+
+    def extract_batch(self,
+                      files: List[Dict[str, Any]],
+                      on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      on_invoice: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """并发提取一批文件的发票信息
+
+        Args:
+            files: 待处理文件列表，每项包含file_id（或image_data）、file_type、invoice_type、filename
+            on_result: 每个文件处理完成时的回调，在调用方线程中执行
+            on_invoice: 每识别出一张发票时的回调（多页PDF逐页触发），在调用方线程中执行，
+                参数包含index、filename、invoice_info
+
+        Returns:
+            List[Dict]: 与输入顺序一致的处理结果，每项包含index、filename、status、message、
+                invoice_info（第一张发票）、invoices（文件中的全部发票）、elapsed
+        """
+        if not files:
+            return []
+
+        print(f"开始批量提取发票信息，文件数: {len(files)}, 并发数: {self.max_workers}")
+        batch_start = time.perf_counter()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(files)
+        # 工作线程把逐张发票和逐个文件的结果放入队列，由调用方线程统一回调
+        events: queue.Queue = queue.Queue()
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(files))) as executor:
+            for index, file_item in enumerate(files):
+                executor.submit(self._run_job, index, file_item, events)
+
+            pending = len(files)
+            while pending:
+                kind, payload = events.get()
+                if kind == 'invoice':
+                    if on_invoice:
+                        on_invoice(payload)
+                    continue
+
+                pending -= 1
+                results[payload['index']] = payload
+                print(f"文件 {payload['filename']} 处理完成，状态: {payload['status']}, "
+                      f"发票数: {len(payload['invoices'])}, 耗时: {payload['elapsed']:.2f}秒")
+                if on_result:
+                    on_result(payload)
+
+        print(f"批量提取完成，共{len(files)}个文件，总耗时: {time.perf_counter() - batch_start:.2f}秒")
+        return results
+
+    def _run_job(self, index: int, file_item: Dict[str, Any], events: queue.Queue) -> None:
+        """在工作线程中处理单个文件，并把结果放入事件队列"""
+        start = time.perf_counter()
+        try:
+            result = self._extract_one(index, file_item, events)
+        except Exception as e:
+            result = {
+                'index': index,
+                'filename': file_item.get('filename', ''),
+                'status': 'error',
+                'message': f'批量提取失败: {str(e)}',
+                'invoice_info': None,
+                'invoices': []
+            }
+        result['elapsed'] = time.perf_counter() - start
+        events.put(('result', result))
+
+    def _extract_one(self, index: int, file_item: Dict[str, Any], events: queue.Queue) -> Dict[str, Any]:
+        """处理单个文件，PDF逐页提取并拆分多张发票，图像整体提取"""
+        filename = file_item.get('filename', '')
+        file_type = file_item.get('file_type', 'jpg')
+
+        def emit_invoice(invoice_info: Dict[str, Any]) -> None:
+            events.put(('invoice', {'index': index, 'filename': filename, 'invoice_info': invoice_info}))
+
+        if file_type.lower() == 'pdf':
+            if file_item.get('file_id'):
+                pdf_bytes = get_file_registry().get_bytes(file_item['file_id'])
+                if pdf_bytes is None:
+                    raise ValueError(f"文件{file_item['file_id']}不存在或已过期")
+            else:
+                pdf_bytes = decode_base64_data(file_item.get('image_data', ''))
+            invoices = self.page_extractor.extract(pdf_bytes, file_item.get('invoice_type'),
+                                                   on_invoice=emit_invoice, file_name=filename)
+            return {
+                'index': index,
+                'filename': filename,
+                'status': 'success' if invoices else 'error',
+                'message': f'从PDF中识别出{len(invoices)}张发票' if invoices else 'PDF中未识别到发票',
+                'invoice_info': invoices[0] if invoices else None,
+                'invoices': invoices
+            }
+
+        params = json.dumps({
+            'process_params': {
+                'operation': 'extract_info',
+                'file_id': file_item.get('file_id', ''),
+                'image_data': file_item.get('image_data', ''),
+                'file_type': file_type,
+                'invoice_type': file_item.get('invoice_type'),
+                'file_name': filename
+            }
+        }, ensure_ascii=False)
+        response = json.loads(self.processor.call(params))
+
+        invoice_info = response.get('invoice_info')
+        if invoice_info:
+            emit_invoice(invoice_info)
+        return {
+            'index': index,
+            'filename': filename,
+            'status': response.get('status', 'error'),
+            'message': response.get('message', ''),
+            'invoice_info': invoice_info,
+            'invoices': [invoice_info] if invoice_info else []
+        }
+
+    async def extract_batch_async(self,
+                                  files: List[Dict[str, Any]],
+                                  max_concurrency: Optional[int] = None,
+                                  timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """在事件循环中并发提取一批文件的发票信息，适用于后端服务（PDF只处理首页）
+
+        每个文件调用MMInvoiceProcessor.acall，等待模型响应时不占用线程。
+
+        Args:
+            files: 待处理文件列表，每项包含file_id（或image_data）、file_type、invoice_type、filename
+            max_concurrency: 同时进行的提取数，默认使用单个API Key的并发上限
+            timeout: 单个文件的超时时间（秒）
+
+        Returns:
+            List[Dict]: 与输入顺序一致的处理结果，字段与extract_batch相同
+        """
+        max_concurrency = max_concurrency or EXTRACTION_CONFIG['max_concurrency_per_key']
+
+        def make_task(file_item):
+            params = json.dumps({
+                'process_params': {
+                    'operation': 'extract_info',
+                    'file_id': file_item.get('file_id', ''),
+                    'image_data': file_item.get('image_data', ''),
+                    'file_type': file_item.get('file_type', 'jpg'),
+                    'invoice_type': file_item.get('invoice_type'),
+                    'file_name': file_item.get('filename', '')
+                }
+            }, ensure_ascii=False)
+            return lambda: self.processor.acall(params)
+
+        start = time.perf_counter()
+        responses = await gather_bounded([make_task(item) for item in files], max_concurrency, timeout)
+        print(f"异步批量提取完成，共{len(files)}个文件，总耗时: {time.perf_counter() - start:.2f}秒")
+
+        results = []
+        for index, (file_item, response) in enumerate(zip(files, responses)):
+            if isinstance(response, asyncio.TimeoutError):
+                response = {'status': 'error', 'message': f'提取超时（{timeout}秒）'}
+            elif isinstance(response, BaseException):
+                response = {'status': 'error', 'message': f'批量提取失败: {str(response)}'}
+            else:
+                response = json.loads(response)
+            invoice_info = response.get('invoice_info')
+            results.append({
+                'index': index,
+                'filename': file_item.get('filename', ''),
+                'status': response.get('status', 'error'),
+                'message': response.get('message', ''),
+                'invoice_info': invoice_info,
+                'invoices': [invoice_info] if invoice_info else []
+            })
+        return results
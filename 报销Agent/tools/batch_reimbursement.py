@@ -0,0 +1,354 @@
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional, Callable
+from config import BATCH_REIMBURSE_CONFIG, INVOICE_TYPES
+from tools.batch_extractor import BatchInvoiceExtractor
+from tools.duplicate_index import make_invoice_key
+from tools.file_registry import get_file_registry
+from tools.itinerary_builder import ItineraryBuilder
+from tools.reimbursement_generator import ReimbursementGenerator
+
+# 报销目录中可选的辅助文件：已提取的发票、手工整理的行程、报销人信息（上级目录中的同名文件逐级合并）
+INVOICES_FILE = 'invoices.json'
+TRIPS_FILE = 'trips.json'
+PROFILE_FILE = 'profile.json'
+
+SUMMARY_COLUMNS = ['unit', 'status', 'message', 'claim_id', '报销人', '报销类型', '报销总金额',
+                   '发票数', '行程数', '住宿晚数', '问题数', '提醒数', '提取失败文件数', 'result_path', 'elapsed']
+
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    """先写临时文件再替换，进程中断时不会留下写了一半的结果文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def _unit_parts(unit: str) -> List[str]:
+    """把单元的相对路径拆分为各级目录名，输入目录本身为空列表"""
+    return [] if unit == '.' else unit.split('/')
+
+
+def _read_json(path: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class BatchCheckpoint:
+    """批量报销的断点文件
+
+    每处理完一个报销目录追加一行JSON并立即落盘，进程中断后最后一行可能不完整，加载时跳过。
+    同一目录出现多次时以最后一次为准；目录中的文件发生变化（指纹不同）时重新处理。
+    状态为success、warning或rejected（报销单生成工具拒绝生成，如缺少行程）的目录视为已完成，
+    只有处理过程中抛出异常（error）的目录在下次运行时重试。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(entry, dict) and entry.get('unit'):
+                        self.entries[entry['unit']] = entry
+
+    def is_done(self, unit: str, fingerprint: str) -> bool:
+        """目录已处理且文件未变化时返回True；处理过程中出现异常的目录在下次运行时重试"""
+        entry = self.entries.get(unit)
+        return bool(entry) and entry.get('fingerprint') == fingerprint and entry.get('status') != 'error'
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[entry['unit']] = entry
+
+
+class BatchReimbursementRunner:
+    """月末批量生成报销单
+
+    遍历输入目录，直接包含发票文件（或invoices.json）的目录作为一个报销单元（一个员工或一次出差）。
+    每个单元依次完成发票提取、行程重建、票据校验和报销单生成，结果写入输出目录中的同名子目录，
+    多个单元在线程池中并发处理：耗时主要在等待多模态模型响应，同一API Key的限流器只在进程内共享，
+    因此使用线程而不是进程。每完成一个单元就写入断点文件，重新运行时跳过已完成且文件未变化的单元。
+    """
+
+    def __init__(self,
+                 input_dir: str,
+                 output_dir: str,
+                 workers: Optional[int] = None,
+                 home_city: Optional[str] = None,
+                 extractor: Optional[BatchInvoiceExtractor] = None):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.workers = workers or BATCH_REIMBURSE_CONFIG['workers']
+        self.home_city = home_city
+        self.file_types = set(BATCH_REIMBURSE_CONFIG['file_types'])
+        self.checkpoint = BatchCheckpoint(os.path.join(self.output_dir, BATCH_REIMBURSE_CONFIG['checkpoint_name']))
+        self._extractor = extractor
+        self._extractor_lock = threading.Lock()
+
+    @property
+    def extractor(self) -> BatchInvoiceExtractor:
+        """批量提取引擎在第一次需要识别发票文件时创建，所有单元共用同一个限流器"""
+        if self._extractor is None:
+            with self._extractor_lock:
+                if self._extractor is None:
+                    self._extractor = BatchInvoiceExtractor()
+        return self._extractor
+
+    def discover_units(self) -> List[Dict[str, Any]]:
+        """查找报销单元
+
+        Returns:
+            List[Dict]: 每个单元包含unit（相对输入目录的路径）、path、files（发票文件名）、fingerprint
+        """
+        units = []
+        for dir_path, dir_names, file_names in os.walk(self.input_dir):
+            # 输出目录位于输入目录内时不作为输入处理，隐藏目录一并跳过
+            dir_names[:] = sorted(name for name in dir_names
+                                  if not name.startswith('.')
+                                  and os.path.abspath(os.path.join(dir_path, name)) != self.output_dir)
+            invoice_files = sorted(name for name in file_names
+                                   if name.rsplit('.', 1)[-1].lower() in self.file_types and '.' in name)
+            if not invoice_files and INVOICES_FILE not in file_names:
+                continue
+            helper_files = [name for name in (INVOICES_FILE, TRIPS_FILE, PROFILE_FILE) if name in file_names]
+            units.append({
+                'unit': os.path.relpath(dir_path, self.input_dir).replace(os.sep, '/'),
+                'path': dir_path,
+                'files': invoice_files,
+                'fingerprint': self._fingerprint(dir_path, invoice_files + helper_files)
+            })
+        return units
+
+    def _fingerprint(self, dir_path: str, file_names: List[str]) -> str:
+        """按文件名、大小和修改时间计算单元指纹，文件增删或修改后重新处理"""
+        digest = hashlib.sha1()
+        for name in file_names:
+            stat = os.stat(os.path.join(dir_path, name))
+            digest.update(f"{name}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def run(self, on_progress: Optional[Callable[[Dict[str, Any], int, int], None]] = None) -> Dict[str, Any]:
+        """处理所有报销单元并生成汇总报告
+
+        Args:
+            on_progress: 每完成一个单元时的回调，参数为(汇总行, 已完成数, 待处理总数)
+
+        Returns:
+            Dict: units为单元总数，processed为本次处理的单元数，skipped为从断点跳过的单元数，
+                  counts为各状态的单元数，summary_path为汇总报告路径
+        """
+        units = self.discover_units()
+        pending = [unit for unit in units if not self.checkpoint.is_done(unit['unit'], unit['fingerprint'])]
+        skipped = len(units) - len(pending)
+        print(f"批量报销: 共{len(units)}个报销目录，断点中已完成{skipped}个，本次处理{len(pending)}个，并发数: {self.workers}")
+
+        batch_start = time.perf_counter()
+        finished = 0
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+                futures = [executor.submit(self.process_unit, unit) for unit in pending]
+                for future in as_completed(futures):
+                    row = future.result()
+                    self.checkpoint.record(row)
+                    finished += 1
+                    print(f"[{finished}/{len(pending)}] {row['unit']}: {row['status']}, {row['message']}")
+                    if on_progress:
+                        on_progress(row, finished, len(pending))
+
+        rows = [self.checkpoint.entries[unit['unit']] for unit in units if unit['unit'] in self.checkpoint.entries]
+        summary_path = self.write_summary(rows)
+        counts = {}
+        for row in rows:
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+        print(f"批量报销完成，本次处理{len(pending)}个目录，总耗时: {time.perf_counter() - batch_start:.2f}秒，"
+              f"汇总报告: {summary_path}")
+        return {
+            'units': len(units),
+            'processed': len(pending),
+            'skipped': skipped,
+            'counts': counts,
+            'summary_path': summary_path
+        }
+
+    def process_unit(self, unit: Dict[str, Any]) -> Dict[str, Any]:
+        """处理单个报销单元，任何异常都记录为该单元的错误，不影响其他单元
+
+        Returns:
+            Dict: 汇总行，同时作为断点记录
+        """
+        start = time.perf_counter()
+        result_path = os.path.join(self.output_dir, *_unit_parts(unit['unit']), 'reimbursement.json')
+        try:
+            result = self._build_result(unit)
+            _write_json_atomic(result_path, result)
+            row = self._summary_row(unit, result, result_path)
+        except Exception as e:
+            print(f"处理报销目录{unit['unit']}失败: {str(e)}")
+            row = {column: '' for column in SUMMARY_COLUMNS}
+            row.update({'unit': unit['unit'], 'status': 'error', 'message': f'批量报销失败: {str(e)}'})
+        row['fingerprint'] = unit['fingerprint']
+        row['elapsed'] = round(time.perf_counter() - start, 2)
+        return row
+
+    def _build_result(self, unit: Dict[str, Any]) -> Dict[str, Any]:
+        profile = self._load_profile(unit)
+        invoices, extraction_errors = self._collect_invoices(unit)
+
+        trips_path = os.path.join(unit['path'], TRIPS_FILE)
+        itinerary = None
+        if os.path.exists(trips_path):
+            trips = _read_json(trips_path)
+        else:
+            itinerary = ItineraryBuilder(home_city=profile.get('常驻地') or self.home_city).build(invoices)
+            trips = itinerary['trip_records']
+
+        generation_params = {key: value for key, value in profile.items() if key != '常驻地'}
+        generation_params.update({'trips': trips, 'invoices': invoices})
+        response = json.loads(ReimbursementGenerator().call(
+            json.dumps({'generation_params': generation_params}, ensure_ascii=False)))
+
+        # 报销单生成工具拒绝生成（缺少行程或发票、发票重复报销等）取决于目录内容，重新运行结果相同，
+        # 记为rejected，与需要重试的异常区分
+        status = response.get('status', 'error')
+        if status == 'error':
+            status = 'rejected'
+        message = response.get('message', '')
+        if extraction_errors and status == 'success':
+            status = 'warning'
+            message = f"{message}，{len(extraction_errors)}个文件未能识别，需人工补录"
+        return {
+            'unit': unit['unit'],
+            'status': status,
+            'message': message,
+            'profile': profile,
+            'invoices': invoices,
+            'trips': trips,
+            'itinerary': itinerary,
+            'extraction_errors': extraction_errors,
+            'reimbursement': response
+        }
+
+    def _load_profile(self, unit: Dict[str, Any]) -> Dict[str, Any]:
+        """从输入目录到单元目录逐级合并profile.json，下级覆盖上级；未指定报销人时使用第一级目录名"""
+        profile = {}
+        parts = _unit_parts(unit['unit'])
+        for depth in range(len(parts) + 1):
+            profile_path = os.path.join(self.input_dir, *parts[:depth], PROFILE_FILE)
+            if os.path.exists(profile_path):
+                profile.update(_read_json(profile_path))
+        if not profile.get('报销人') and parts:
+            profile['报销人'] = parts[0]
+        return profile
+
+    def _collect_invoices(self, unit: Dict[str, Any]):
+        """读取invoices.json中已提取的发票并识别目录中的发票文件，同一张发票只保留一条
+
+        Returns:
+            (发票列表, 识别失败的文件列表)
+        """
+        invoices = []
+        invoices_path = os.path.join(unit['path'], INVOICES_FILE)
+        if os.path.exists(invoices_path):
+            invoices.extend(_read_json(invoices_path))
+
+        extraction_errors = []
+        if unit['files']:
+            registry = get_file_registry()
+            session_id = f"batch-{hashlib.sha1(unit['unit'].encode('utf-8')).hexdigest()[:16]}"
+            jobs = []
+            try:
+                for filename in unit['files']:
+                    with open(os.path.join(unit['path'], filename), 'rb') as f:
+                        file_type = filename.rsplit('.', 1)[-1].lower()
+                        file_id = registry.register(f.read(), filename, file_type, session_id=session_id)
+                    jobs.append({
+                        'filename': filename,
+                        'file_id': file_id,
+                        'file_type': file_type,
+                        'invoice_type': next((type_name for type_name in INVOICE_TYPES if type_name in filename), None)
+                    })
+                for job, batch_result in zip(jobs, self.extractor.extract_batch(jobs)):
+                    file_invoices = batch_result.get('invoices') or []
+                    if batch_result.get('status') != 'success' or not file_invoices:
+                        extraction_errors.append({'filename': job['filename'],
+                                                  'message': batch_result.get('message', '未识别到发票')})
+                        continue
+                    for invoice_info in file_invoices:
+                        invoice_info['filename'] = job['filename']
+                        invoice_info['file_type'] = job['file_type']
+                        invoices.append(invoice_info)
+            finally:
+                registry.release(session_id)
+
+        unique_invoices = []
+        seen_keys = set()
+        for invoice in invoices:
+            invoice_key = make_invoice_key(invoice)
+            if invoice_key and invoice_key in seen_keys:
+                print(f"报销目录{unit['unit']}中的发票{invoice.get('invoice_id', '')}重复，跳过")
+                continue
+            if invoice_key:
+                seen_keys.add(invoice_key)
+            unique_invoices.append(invoice)
+        return unique_invoices, extraction_errors
+
+    def _summary_row(self, unit: Dict[str, Any], result: Dict[str, Any], result_path: str) -> Dict[str, Any]:
+        response = result['reimbursement']
+        form = response.get('reimbursement_form') or {}
+        validation = response.get('validation_results') or {}
+        return {
+            'unit': unit['unit'],
+            'status': result['status'],
+            'message': result['message'],
+            'claim_id': response.get('claim_id', ''),
+            '报销人': result['profile'].get('报销人', ''),
+            '报销类型': form.get('报销类型', ''),
+            '报销总金额': form.get('报销总金额', 0),
+            '发票数': len(result['invoices']),
+            '行程数': len(result['trips']),
+            '住宿晚数': form.get('住宿晚数', 0),
+            '问题数': len(validation.get('issues', [])) + len(response.get('duplicate_issues', [])),
+            '提醒数': len(validation.get('warnings', [])),
+            '提取失败文件数': len(result['extraction_errors']),
+            'result_path': os.path.relpath(result_path, self.output_dir).replace(os.sep, '/')
+        }
+
+    def write_summary(self, rows: List[Dict[str, Any]]) -> str:
+        """写入汇总报告，json供程序读取，csv（带BOM）可直接用Excel打开
+
+        Returns:
+            str: json汇总报告路径
+        """
+        rows = sorted(rows, key=lambda row: row['unit'])
+        summary_base = os.path.join(self.output_dir, BATCH_REIMBURSE_CONFIG['summary_name'])
+        total_amount = sum(float(row.get('报销总金额') or 0) for row in rows if row['status'] in ('success', 'warning'))
+        _write_json_atomic(f"{summary_base}.json", {
+            'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'input_dir': self.input_dir,
+            'units': len(rows),
+            'total_amount': round(total_amount, 2),
+            'rows': [{column: row.get(column, '') for column in SUMMARY_COLUMNS} for row in rows]
+        })
+        with open(f"{summary_base}.csv", 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        return f"{summary_base}.json"
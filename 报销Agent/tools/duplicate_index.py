@@ -0,0 +1,321 @@
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional
+from PIL import Image
+from config import DUPLICATE_INDEX_CONFIG
+
+# 感知哈希分为4段，每段16位；汉明距离不超过3的两个哈希至少有一段完全相同，
+# 因此按段建立索引即可找到所有近似图像，无需全表比较
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 16
+
+
+def make_invoice_key(invoice_info: Dict[str, Any]) -> Optional[str]:
+    """由发票号码、金额和开票日期生成去重键，缺少号码或金额时返回None"""
+    invoice_id = re.sub(r'\s', '', str(invoice_info.get('invoice_id') or '')).upper()
+    if not invoice_id or invoice_id.startswith('AUTO'):
+        return None
+    try:
+        amount = float(invoice_info.get('amount') or 0)
+    except (TypeError, ValueError):
+        return None
+    if amount <= 0:
+        return None
+    date = ''.join(re.findall(r'\d+', str(invoice_info.get('date') or '')))
+    return f"{invoice_id}|{amount:.2f}|{date}"
+
+
+def content_digest(file_bytes: bytes) -> str:
+    """文件内容的SHA-256"""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def compute_phash(image_bytes: bytes) -> Optional[int]:
+    """计算图像的64位差值哈希（dHash），无法解码时返回None"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft('L', (64, 64))
+            pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except Exception as e:
+        print(f"计算图像感知哈希失败: {str(e)}")
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | int(pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _to_signed(value: int) -> int:
+    """SQLite整数为有符号64位，存储前转换"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _bands(phash: int) -> List[int]:
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(phash >> (band * PHASH_BAND_BITS)) & mask for band in range(PHASH_BANDS)]
+
+
+class DuplicateInvoiceIndex:
+    """跨会话的发票去重索引
+
+    以(发票号码, 金额, 开票日期)为主键记录识别过的发票及其报销状态，
+    另按文件SHA-256和渲染图像的感知哈希记录见过的文件。
+    数据保存在SQLite中，所有查询都走主键或索引，数十万张发票时单次查询仍在毫秒以内。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, phash_max_distance: Optional[int] = None):
+        self.db_path = db_path or DUPLICATE_INDEX_CONFIG['db_path']
+        self.phash_max_distance = (phash_max_distance if phash_max_distance is not None
+                                   else DUPLICATE_INDEX_CONFIG['phash_max_distance'])
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS invoices ('
+            'invoice_key TEXT PRIMARY KEY, '
+            'invoice_info TEXT NOT NULL, '
+            'claim_id TEXT, '
+            'created_at REAL NOT NULL, '
+            'claimed_at REAL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS known_files ('
+            'content_sha256 TEXT PRIMARY KEY, '
+            'invoice_key TEXT NOT NULL, '
+            'phash INTEGER, '
+            'band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER, '
+            'prompt_version TEXT)'
+        )
+        # 早期的索引没有记录提示词版本，补充该列；这些文件的记录不再直接复用，重新识别后更新
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(known_files)')]
+        if 'prompt_version' not in columns:
+            self._conn.execute('ALTER TABLE known_files ADD COLUMN prompt_version TEXT')
+        for band in range(PHASH_BANDS):
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_band{band} ON known_files(band{band})')
+        self._conn.commit()
+
+    def lookup_file(self, content_sha256: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """按文件内容查找已识别过的发票
+
+        只返回用相同提示词版本识别的记录，提示词升级后旧的识别结果不再直接复用。
+
+        Args:
+            content_sha256: 文件内容的SHA-256
+            prompt_version: 当前的提示词版本
+
+        Returns:
+            Dict: 包含invoice_key、invoice_info、claim_id，未见过该文件时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT i.invoice_key, i.invoice_info, i.claim_id FROM known_files f '
+                'JOIN invoices i ON i.invoice_key = f.invoice_key '
+                'WHERE f.content_sha256 = ? AND f.prompt_version = ?',
+                (content_sha256, prompt_version)
+            ).fetchone()
+        return self._to_record(row)
+
+    def find_similar(self, phash: Optional[int]) -> List[Dict[str, Any]]:
+        """查找感知哈希相近的已知发票
+
+        同一模板打印的不同发票哈希也很接近，调用方需要再用发票号码等字段确认。
+
+        Returns:
+            List[Dict]: 每项包含invoice_key、invoice_info、claim_id和distance
+        """
+        if phash is None:
+            return []
+        bands = _bands(phash)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT DISTINCT f.phash, i.invoice_key, i.invoice_info, i.claim_id FROM known_files f '
+                'JOIN invoices i ON i.invoice_key = f.invoice_key '
+                'WHERE f.band0 = ? OR f.band1 = ? OR f.band2 = ? OR f.band3 = ?',
+                bands
+            ).fetchall()
+        similar = []
+        for stored_phash, *record_row in rows:
+            distance = bin((stored_phash & ((1 << 64) - 1)) ^ phash).count('1')
+            if distance <= self.phash_max_distance:
+                record = self._to_record(record_row)
+                record['distance'] = distance
+                similar.append(record)
+        return sorted(similar, key=lambda record: record['distance'])
+
+    def lookup_invoice(self, invoice_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """按发票号码、金额和日期查找已登记的发票"""
+        invoice_key = make_invoice_key(invoice_info)
+        if not invoice_key:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT invoice_key, invoice_info, claim_id FROM invoices WHERE invoice_key = ?',
+                (invoice_key,)
+            ).fetchone()
+        return self._to_record(row)
+
+    def add(self, invoice_info: Dict[str, Any], content_sha256: Optional[str] = None,
+            phash: Optional[int] = None, prompt_version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """登记识别出的发票及其来源文件，已登记的发票以最新的识别结果为准，报销状态不变
+
+        Args:
+            invoice_info: 标准化的发票信息
+            content_sha256: 来源文件内容的SHA-256
+            phash: 渲染图像的感知哈希
+            prompt_version: 识别该文件时使用的提示词版本
+
+        Returns:
+            Dict: 该发票此前已登记时返回原记录（可据此判断重复），否则返回None
+        """
+        invoice_key = make_invoice_key(invoice_info)
+        if not invoice_key:
+            return None
+        stored_info = {key: value for key, value in invoice_info.items() if key != 'raw_extracted_info'}
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT invoice_key, invoice_info, claim_id FROM invoices WHERE invoice_key = ?',
+                (invoice_key,)
+            ).fetchone()
+            if row is None:
+                self._conn.execute(
+                    'INSERT INTO invoices (invoice_key, invoice_info, created_at) VALUES (?, ?, ?)',
+                    (invoice_key, json.dumps(stored_info, ensure_ascii=False), time.time())
+                )
+            else:
+                self._conn.execute(
+                    'UPDATE invoices SET invoice_info = ? WHERE invoice_key = ?',
+                    (json.dumps(stored_info, ensure_ascii=False), invoice_key)
+                )
+            if content_sha256:
+                bands = _bands(phash) if phash is not None else [None] * PHASH_BANDS
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO known_files '
+                    '(content_sha256, invoice_key, phash, band0, band1, band2, band3, prompt_version) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (content_sha256, invoice_key, _to_signed(phash) if phash is not None else None, *bands,
+                     prompt_version)
+                )
+            self._conn.commit()
+        return self._to_record(row)
+
+    def check_claimable(self, invoices: List[Dict[str, Any]], claim_id: Optional[str] = None) -> List[str]:
+        """检查一组发票能否报销：同一批中不能重复，也不能已在其他报销单中报销
+
+        Args:
+            invoices: 标准化的发票信息列表
+            claim_id: 当前报销单编号，同一报销单重新生成时不视为重复
+
+        Returns:
+            List[str]: 发现的问题，为空表示可以报销
+        """
+        issues = []
+        seen_keys = set()
+        for invoice in invoices:
+            invoice_key = make_invoice_key(invoice)
+            if not invoice_key:
+                continue
+            label = f"发票{invoice.get('invoice_id')}（金额{invoice.get('amount')}）"
+            if invoice_key in seen_keys:
+                issues.append(f"{label}在本次报销中重复出现")
+                continue
+            seen_keys.add(invoice_key)
+            record = self.lookup_invoice(invoice)
+            if record and record['claim_id'] and record['claim_id'] != claim_id:
+                issues.append(f"{label}已在报销单{record['claim_id']}中报销")
+        return issues
+
+    def claim(self, invoices: List[Dict[str, Any]], claim_id: str) -> Dict[str, Any]:
+        """在同一个事务中检查并登记一组发票的报销状态
+
+        同一批中重复出现的发票，或已登记在其他报销单（claim_id既不为空也不是当前报销单）中的发票都视为冲突，
+        有冲突时整批不登记。检查和登记之间持有写锁，两个会话同时确认同一张发票时只有一个能成功。
+
+        Args:
+            invoices: 标准化的发票信息列表
+            claim_id: 当前报销单编号
+
+        Returns:
+            Dict: issues为发现的冲突（为空表示登记成功），marked为本次新登记的发票数
+        """
+        issues = []
+        seen_keys = set()
+        now = time.time()
+        marked = 0
+        with self._lock:
+            # IMMEDIATE事务在开始时即取得数据库写锁，其他进程的登记要等本事务结束
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for invoice in invoices:
+                    invoice_key = make_invoice_key(invoice)
+                    if not invoice_key:
+                        continue
+                    label = f"发票{invoice.get('invoice_id')}（金额{invoice.get('amount')}）"
+                    if invoice_key in seen_keys:
+                        issues.append(f"{label}在本次报销中重复出现")
+                        continue
+                    seen_keys.add(invoice_key)
+                    stored_info = {key: value for key, value in invoice.items() if key != 'raw_extracted_info'}
+                    self._conn.execute(
+                        'INSERT OR IGNORE INTO invoices (invoice_key, invoice_info, created_at) VALUES (?, ?, ?)',
+                        (invoice_key, json.dumps(stored_info, ensure_ascii=False), now)
+                    )
+                    row = self._conn.execute(
+                        'SELECT claim_id FROM invoices WHERE invoice_key = ?', (invoice_key,)
+                    ).fetchone()
+                    if row[0] is not None and row[0] != claim_id:
+                        issues.append(f"{label}已在报销单{row[0]}中报销")
+                        continue
+                    cursor = self._conn.execute(
+                        'UPDATE invoices SET claim_id = ?, claimed_at = ? WHERE invoice_key = ? AND claim_id IS NULL',
+                        (claim_id, now, invoice_key)
+                    )
+                    marked += cursor.rowcount
+                if issues:
+                    self._conn.rollback()
+                    return {'issues': issues, 'marked': 0}
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return {'issues': issues, 'marked': marked}
+
+    def stats(self) -> Dict[str, Any]:
+        """返回索引规模"""
+        with self._lock:
+            invoice_count, claimed_count = self._conn.execute(
+                'SELECT COUNT(*), COUNT(claim_id) FROM invoices'
+            ).fetchone()
+            file_count = self._conn.execute('SELECT COUNT(*) FROM known_files').fetchone()[0]
+        return {'invoices': invoice_count, 'claimed': claimed_count, 'files': file_count}
+
+    def _to_record(self, row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        return {'invoice_key': row[0], 'invoice_info': json.loads(row[1]), 'claim_id': row[2]}
+
+
+_duplicate_index = None
+_duplicate_index_lock = threading.Lock()
+
+
+def get_duplicate_index() -> Optional[DuplicateInvoiceIndex]:
+    """获取进程内共享的去重索引，未启用时返回None"""
+    global _duplicate_index
+    if not DUPLICATE_INDEX_CONFIG['enabled']:
+        return None
+    if _duplicate_index is None:
+        with _duplicate_index_lock:
+            if _duplicate_index is None:
+                _duplicate_index = DuplicateInvoiceIndex()
+    return _duplicate_index
@@ -0,0 +1,192 @@
+import io
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Any, Optional
+from tools.pdf_text_extractor import KIND_TO_INVOICE_TYPE, detect_invoice_kind, parse_stay_period
+
+# 数电票XML及OFD自定义标签中各字段可能使用的标签名
+FIELD_TAGS = {
+    '发票号码': ['InvoiceNumber', 'InvoiceNo', 'EIid'],
+    '发票代码': ['InvoiceCode'],
+    '开票时间': ['IssueTime', 'IssueDate', 'RequestTime'],
+    '金额': ['TotalTax-includedAmount', 'TaxInclusiveTotalAmount', 'TotalTaxIncludedAmount'],
+    '不含税金额': ['TotalAmWithoutTax', 'TaxExclusiveTotalAmount'],
+    '税额': ['TotalTaxAm', 'TaxTotalAmount'],
+    '购买方名称': ['BuyerName'],
+    '销售方名称': ['SellerName'],
+    '备注': ['Remark', 'Note'],
+    '项目名称': ['ItemName'],
+    '税率/征收率': ['TaxRate'],
+    '起始站': ['DepartureStation', 'StartStation', 'Departure', 'TravelStartPlace', 'Origin'],
+    '到站': ['ArrivalStation', 'DestinationStation', 'Destination', 'TravelEndPlace'],
+    '车次': ['TrainNumber', 'TrainNo'],
+    '航班号': ['FlightNumber', 'FlightNo'],
+    '乘坐日期': ['TravelDate', 'DepartureDate'],
+    '乘客姓名': ['Traveler', 'PassengerName', 'TravelerName'],
+    '座位等级': ['SeatLevel', 'SeatClass', 'SeatType'],
+    '电子客票号': ['ElectronicTicketNumber', 'ETicketNo', 'TicketNumber'],
+}
+
+# OFD文档属性（OFD.xml的CustomData）中的中文字段名
+OFD_CUSTOM_DATA_FIELDS = {
+    '发票号码': '发票号码',
+    '发票代码': '发票代码',
+    '开票日期': '开票时间',
+    '合计金额': '不含税金额',
+    '合计税额': '税额',
+    '价税合计': '金额',
+}
+
+
+def _local_name(tag: str) -> str:
+    """去掉XML命名空间前缀"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _normalize_date(text: str) -> str:
+    """把2025-04-25、20250425、2025年4月25日等格式统一为YYYY年MM月DD日"""
+    match = re.search(r'(\d{4})\D?(\d{1,2})\D?(\d{1,2})', text or '')
+    if not match:
+        return ''
+    year, month, day = match.groups()
+    return f'{year}年{int(month):02d}月{int(day):02d}日'
+
+
+class EInvoiceParser:
+    """OFD与XML格式电子发票解析器
+
+    直接读取文件中的结构化字段，不需要渲染或调用模型，
+    输出与多模态模型相同的中文字段，由MMInvoiceProcessor转换为系统格式。
+    """
+
+    def parse(self, file_bytes: bytes, file_type: str) -> Optional[Dict[str, Any]]:
+        """解析OFD或XML电子发票
+
+        Args:
+            file_bytes: 文件原始字节
+            file_type: 文件类型，ofd或xml
+
+        Returns:
+            Dict: 提取的发票信息（中文字段），无法解析时返回None
+        """
+        try:
+            if file_type.lower() == 'ofd':
+                fields = self._parse_ofd(file_bytes)
+            else:
+                fields = self._resolve_fields(self._collect_tags(ET.fromstring(file_bytes)))
+        except (zipfile.BadZipFile, ET.ParseError, KeyError) as e:
+            print(f"电子发票解析失败: {str(e)}")
+            return None
+
+        info = self._build_info(fields)
+        if not info.get('发票号码') or not info.get('金额'):
+            print(f"电子发票缺少发票号码或金额，无法使用: {fields}")
+            return None
+        return info
+
+    def _parse_ofd(self, file_bytes: bytes) -> Dict[str, str]:
+        """解析OFD压缩包：优先使用附带的数电票XML，否则读取自定义标签和文档属性"""
+        with zipfile.ZipFile(io.BytesIO(file_bytes)) as archive:
+            names = archive.namelist()
+
+            # 数电票OFD通常在附件中携带完整的结构化XML
+            for name in names:
+                if name.lower().endswith('.xml') and '/attachs/' in name.lower():
+                    root = ET.fromstring(archive.read(name))
+                    if _local_name(root.tag) == 'EInvoice':
+                        return self._resolve_fields(self._collect_tags(root))
+
+            tags = {}
+            # 自定义标签把字段名映射到页面上的文字对象ID
+            tag_names = [n for n in names if n.endswith('CustomTag.xml')]
+            if tag_names:
+                text_objects = self._collect_text_objects(archive, names)
+                for tag_name in tag_names:
+                    for element in ET.fromstring(archive.read(tag_name)).iter():
+                        refs = [child.text.strip() for child in element
+                                if _local_name(child.tag) == 'ObjectRef' and child.text]
+                        value = ''.join(text_objects.get(ref, '') for ref in refs).strip()
+                        if value:
+                            tags.setdefault(_local_name(element.tag), value)
+            fields = self._resolve_fields(tags)
+
+            # 文档属性中的字段作为补充
+            if 'OFD.xml' in names:
+                for element in ET.fromstring(archive.read('OFD.xml')).iter():
+                    if _local_name(element.tag) == 'CustomData':
+                        field = OFD_CUSTOM_DATA_FIELDS.get(element.get('Name', ''))
+                        if field and element.text:
+                            fields.setdefault(field, element.text.strip())
+            return fields
+
+    def _collect_text_objects(self, archive: zipfile.ZipFile, names: List[str]) -> Dict[str, str]:
+        """读取页面和模板中的文字对象，返回{对象ID: 文字}"""
+        text_objects = {}
+        for name in names:
+            if not name.endswith('Content.xml'):
+                continue
+            for element in ET.fromstring(archive.read(name)).iter():
+                if _local_name(element.tag) == 'TextObject' and element.get('ID'):
+                    text_objects[element.get('ID')] = ''.join(
+                        child.text or '' for child in element if _local_name(child.tag) == 'TextCode'
+                    )
+        return text_objects
+
+    def _collect_tags(self, root: ET.Element) -> Dict[str, str]:
+        """收集XML中各标签的第一个非空文本，返回{标签名: 文本}"""
+        tags = {}
+        for element in root.iter():
+            if element.text and element.text.strip():
+                tags.setdefault(_local_name(element.tag), element.text.strip())
+        return tags
+
+    def _resolve_fields(self, tags: Dict[str, str]) -> Dict[str, str]:
+        """按FIELD_TAGS中的优先顺序把标签映射为中文字段"""
+        fields = {}
+        for field, candidates in FIELD_TAGS.items():
+            for tag in candidates:
+                if tags.get(tag):
+                    fields[field] = tags[tag]
+                    break
+        return fields
+
+    def _build_info(self, fields: Dict[str, str]) -> Dict[str, Any]:
+        """把收集到的字段整理为与多模态模型输出一致的发票信息"""
+        issue_date = _normalize_date(fields.get('开票时间', ''))
+        amount = re.sub(r'[^0-9.]', '', fields.get('金额', ''))
+        if not amount and fields.get('不含税金额'):
+            # 只有不含税金额和税额时自行合计
+            try:
+                amount = f"{float(fields['不含税金额']) + float(fields.get('税额') or 0):.2f}"
+            except ValueError:
+                amount = ''
+
+        info = {
+            '发票号码': fields.get('发票号码', ''),
+            '日期': issue_date,
+            '金额': amount,
+            '购买方名称': fields.get('购买方名称', ''),
+            '销售方名称': fields.get('销售方名称', ''),
+            '提取方式': '电子发票结构化数据',
+        }
+        if fields.get('发票代码'):
+            info['发票代码'] = fields['发票代码']
+        if fields.get('税率/征收率'):
+            info['税率/征收率'] = fields['税率/征收率']
+
+        if fields.get('起始站') and fields.get('到站'):
+            kind = 'flight' if fields.get('航班号') else 'train'
+            for field in ('起始站', '到站', '车次', '航班号', '乘客姓名', '座位等级', '电子客票号'):
+                if fields.get(field):
+                    info[field] = fields[field]
+            info['乘坐日期'] = _normalize_date(fields.get('乘坐日期', ''))
+            info['票价'] = amount
+        else:
+            kind = detect_invoice_kind(' '.join([fields.get('项目名称', ''), fields.get('备注', '')]))
+            if kind == 'hotel':
+                info['酒店名称'] = fields.get('销售方名称', '')
+                info.update(parse_stay_period(fields.get('备注', ''), issue_date))
+
+        info['发票类型'] = KIND_TO_INVOICE_TYPE.get(kind, '其他票据')
+        return info
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+from config import CACHE_CONFIG
+
+
+class ExtractionCache:
+    """按文件内容寻址的发票提取结果缓存
+
+    缓存键由解码后文件字节的SHA-256、发票类型提示和提示词版本组成，
+    缓存值为MMInvoiceProcessor._convert_to_system_format的标准化输出。
+    数据保存在SQLite中，跨会话、跨进程重启有效，并按TTL和条目数上限（LRU）淘汰。
+    """
+
+    def __init__(self,
+                 db_path: Optional[str] = None,
+                 max_entries: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None):
+        self.db_path = db_path or CACHE_CONFIG['db_path']
+        self.max_entries = max_entries if max_entries is not None else CACHE_CONFIG['max_entries']
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else CACHE_CONFIG['ttl_seconds']
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS extraction_cache ('
+            'cache_key TEXT PRIMARY KEY, '
+            'invoice_info TEXT NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON extraction_cache(last_access)')
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(file_bytes: bytes, invoice_type: Optional[str], prompt_version: str) -> str:
+        """根据文件字节、发票类型提示和提示词版本生成缓存键"""
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        return f"{digest}:{invoice_type or ''}:{prompt_version}"
+
+    def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT invoice_info, created_at FROM extraction_cache WHERE cache_key = ?',
+                (cache_key,)
+            ).fetchone()
+
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute('DELETE FROM extraction_cache WHERE cache_key = ?', (cache_key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE extraction_cache SET last_access = ? WHERE cache_key = ?', (now, cache_key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, cache_key: str, invoice_info: Dict[str, Any]) -> None:
+        """写入缓存，并按TTL和容量上限淘汰旧条目"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO extraction_cache (cache_key, invoice_info, created_at, last_access) '
+                'VALUES (?, ?, ?, ?)',
+                (cache_key, json.dumps(invoice_info, ensure_ascii=False), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """删除过期条目，并在超出容量时淘汰最久未访问的条目"""
+        if self.ttl_seconds:
+            self._conn.execute('DELETE FROM extraction_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+        if self.max_entries:
+            count = self._conn.execute('SELECT COUNT(*) FROM extraction_cache').fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM extraction_cache WHERE cache_key IN ('
+                    'SELECT cache_key FROM extraction_cache ORDER BY last_access ASC LIMIT ?)',
+                    (overflow,)
+                )
+
+    def clear(self) -> None:
+        """清空缓存并重置计数器"""
+        with self._lock:
+            self._conn.execute('DELETE FROM extraction_cache')
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中统计"""
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM extraction_cache').fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': size
+            }
+
+
+_extraction_cache: Optional[ExtractionCache] = None
+_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """获取进程内共享的提取缓存，缓存被禁用时返回None"""
+    global _extraction_cache
+    if not CACHE_CONFIG['enabled']:
+        return None
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            _extraction_cache = ExtractionCache()
+        return _extraction_cache
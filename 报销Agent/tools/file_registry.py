@@ -0,0 +1,273 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Union
+from config import FILE_REGISTRY_CONFIG
+
+FILE_ID_PREFIX = 'file_'
+
+
+class FileRegistry:
+    """上传文件登记表
+
+    上传的文件按内容哈希保存在磁盘上，同一文件只保存一份。聊天消息、工具参数、发票记录和会话状态中
+    只传递不透明的文件ID，工具在需要时再按ID读取字节，预览时通过内存映射读取，不占用进程堆内存。
+
+    每个会话对自己上传的文件持有引用，并受单会话配额限制；会话重置时释放引用，
+    超过保存时长的引用视为已失效。磁盘占用超过上限时，从最久未使用且无引用的文件开始淘汰。
+    文件元数据和引用关系保存在SQLite中，进程重启后仍然有效。
+    """
+
+    def __init__(self,
+                 root: Optional[str] = None,
+                 max_bytes: Optional[int] = None,
+                 session_quota_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        self.root = root or FILE_REGISTRY_CONFIG['root']
+        self.max_bytes = max_bytes or FILE_REGISTRY_CONFIG['max_bytes']
+        self.session_quota_bytes = session_quota_bytes or FILE_REGISTRY_CONFIG['session_quota_bytes']
+        self.ttl_seconds = ttl_seconds or FILE_REGISTRY_CONFIG['ttl_seconds']
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, 'registry.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            'file_id TEXT PRIMARY KEY, '
+            'file_name TEXT, '
+            'file_type TEXT, '
+            'size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'last_used REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS refs ('
+            'session_id TEXT NOT NULL, '
+            'file_id TEXT NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'PRIMARY KEY (session_id, file_id))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_refs_file ON refs(file_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs(last_used)')
+        self._conn.commit()
+
+    def register(self, file_bytes: bytes, file_name: str = '', file_type: Optional[str] = None,
+                 session_id: Optional[str] = None) -> str:
+        """保存一个文件并返回文件ID，指定会话时为该会话记录一个引用
+
+        Args:
+            file_bytes: 文件的原始字节
+            file_name: 原始文件名
+            file_type: 文件类型，未提供时取文件扩展名
+            session_id: 上传文件的会话
+
+        Returns:
+            str: 文件ID
+
+        Raises:
+            ValueError: 会话引用的文件总大小超过配额
+        """
+        file_id = FILE_ID_PREFIX + hashlib.sha256(file_bytes).hexdigest()[:24]
+        if not file_type:
+            file_type = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+        now = time.time()
+        with self._lock:
+            if session_id:
+                already_referenced = self._conn.execute(
+                    'SELECT 1 FROM refs WHERE session_id = ? AND file_id = ?', (session_id, file_id)
+                ).fetchone()
+                if not already_referenced and self._session_usage(session_id) + len(file_bytes) > self.session_quota_bytes:
+                    raise ValueError(f'本会话上传的文件已超过{self.session_quota_bytes // (1024 * 1024)}MB上限，'
+                                     f'请先清除已处理的文件')
+
+            path = self._blob_path(file_id)
+            if not os.path.exists(path):
+                self._write_blob(path, file_bytes)
+                print(f"已保存文件 {file_name}，文件ID: {file_id}，大小: {len(file_bytes)}字节")
+            self._conn.execute(
+                'INSERT INTO blobs (file_id, file_name, file_type, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(file_id) DO UPDATE SET last_used = excluded.last_used, '
+                'file_name = COALESCE(NULLIF(excluded.file_name, \'\'), blobs.file_name)',
+                (file_id, file_name, file_type, len(file_bytes), now, now)
+            )
+            if session_id:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO refs (session_id, file_id, created_at) VALUES (?, ?, ?)',
+                    (session_id, file_id, now)
+                )
+            self._conn.commit()
+            self._evict(keep=file_id)
+        return file_id
+
+    def get_bytes(self, file_id: str) -> Optional[bytes]:
+        """按文件ID读取原始字节，文件不存在或已被淘汰时返回None"""
+        if not self._touch(file_id):
+            return None
+        try:
+            with open(self._blob_path(file_id), 'rb') as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            self._forget(file_id)
+            return None
+
+    @contextmanager
+    def open_view(self, file_id: str) -> Iterator[Optional[Union[mmap.mmap, bytes]]]:
+        """以只读内存映射的方式打开文件，用于预览等只需读取部分内容的场景
+
+        返回的对象支持切片、read和seek，可以直接交给PIL.Image.open，
+        数据由操作系统按需从页缓存读取，不复制到进程堆内存。
+
+        Yields:
+            mmap.mmap: 文件的只读映射，空文件时为b''，文件不存在时为None
+        """
+        if not self._touch(file_id):
+            yield None
+            return
+        try:
+            blob_file = open(self._blob_path(file_id), 'rb')
+        except FileNotFoundError:
+            self._forget(file_id)
+            yield None
+            return
+        with blob_file:
+            if os.fstat(blob_file.fileno()).st_size == 0:
+                yield b''
+                return
+            with mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+    def describe(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """返回文件的元数据（不含内容），文件不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT file_id, file_name, file_type, size, created_at, last_used FROM blobs WHERE file_id = ?',
+                (file_id or '',)
+            ).fetchone()
+        if row is None or not os.path.exists(self._blob_path(row[0])):
+            return None
+        keys = ('file_id', 'file_name', 'file_type', 'size', 'created_at', 'last_used')
+        return dict(zip(keys, row))
+
+    def release(self, session_id: str, file_id: Optional[str] = None) -> int:
+        """释放会话对文件的引用，不指定文件时释放该会话的全部引用
+
+        Returns:
+            int: 释放的引用数
+        """
+        with self._lock:
+            if file_id:
+                cursor = self._conn.execute('DELETE FROM refs WHERE session_id = ? AND file_id = ?', (session_id, file_id))
+            else:
+                cursor = self._conn.execute('DELETE FROM refs WHERE session_id = ?', (session_id,))
+            self._conn.commit()
+            released = cursor.rowcount
+            self._evict()
+        return released
+
+    def remove(self, file_id: str) -> bool:
+        """删除一个文件及其所有引用，返回是否存在该文件"""
+        with self._lock:
+            existed = self._conn.execute('SELECT 1 FROM blobs WHERE file_id = ?', (file_id,)).fetchone() is not None
+            self._delete_blob(file_id)
+            self._conn.commit()
+        return existed
+
+    def session_usage(self, session_id: str) -> int:
+        """返回会话引用的文件总字节数"""
+        with self._lock:
+            return self._session_usage(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        """返回保存的文件数、总字节数和被会话引用的文件数"""
+        with self._lock:
+            file_count, total_bytes = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            referenced = self._conn.execute('SELECT COUNT(DISTINCT file_id) FROM refs').fetchone()[0]
+        return {'files': file_count, 'bytes': total_bytes, 'referenced': referenced}
+
+    def _blob_path(self, file_id: str) -> str:
+        """文件按ID的前两位哈希字符分目录保存，避免单个目录下文件过多"""
+        digest = file_id[len(FILE_ID_PREFIX):]
+        return os.path.join(self.root, digest[:2], file_id)
+
+    def _write_blob(self, path: str, file_bytes: bytes) -> None:
+        """先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(file_bytes)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def _touch(self, file_id: str) -> bool:
+        """更新文件的最近使用时间，返回文件是否已登记"""
+        with self._lock:
+            cursor = self._conn.execute('UPDATE blobs SET last_used = ? WHERE file_id = ?', (time.time(), file_id or ''))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def _forget(self, file_id: str) -> None:
+        """磁盘上的文件已不存在时，删除其登记记录"""
+        with self._lock:
+            self._delete_blob(file_id)
+            self._conn.commit()
+
+    def _session_usage(self, session_id: str) -> int:
+        return self._conn.execute(
+            'SELECT COALESCE(SUM(b.size), 0) FROM refs r JOIN blobs b ON b.file_id = r.file_id WHERE r.session_id = ?',
+            (session_id,)
+        ).fetchone()[0]
+
+    def _delete_blob(self, file_id: str) -> None:
+        self._conn.execute('DELETE FROM refs WHERE file_id = ?', (file_id,))
+        self._conn.execute('DELETE FROM blobs WHERE file_id = ?', (file_id,))
+        try:
+            os.unlink(self._blob_path(file_id))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """清理过期引用，磁盘占用超过上限时按最近使用时间淘汰无引用的文件（调用方持有锁）"""
+        self._conn.execute('DELETE FROM refs WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+        total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        if total_bytes > self.max_bytes:
+            candidates = self._conn.execute(
+                'SELECT file_id, file_name, size FROM blobs '
+                'WHERE file_id NOT IN (SELECT file_id FROM refs) AND file_id != ? ORDER BY last_used',
+                (keep or '',)
+            ).fetchall()
+            for file_id, file_name, size in candidates:
+                if total_bytes <= self.max_bytes:
+                    break
+                self._delete_blob(file_id)
+                total_bytes -= size
+                print(f"上传文件存储超出容量，已淘汰文件 {file_name}（{file_id}）")
+        self._conn.commit()
+
+
+def is_file_id(value: Any) -> bool:
+    """判断字符串是否为文件登记表生成的文件ID"""
+    return isinstance(value, str) and value.startswith(FILE_ID_PREFIX)
+
+
+_file_registry = None
+_file_registry_lock = threading.Lock()
+
+
+def get_file_registry() -> FileRegistry:
+    """获取进程内共享的文件登记表"""
+    global _file_registry
+    if _file_registry is None:
+        with _file_registry_lock:
+            if _file_registry is None:
+                _file_registry = FileRegistry()
+    return _file_registry
@@ -0,0 +1,113 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.tsv')
+
+# 站名、机场名中表示站点类型的后缀，按长度从长到短去除
+PLACE_SUFFIXES = ['国际机场', '机场', '汽车站', '客运站', '东站', '西站', '南站', '北站', '站', '市', '省']
+
+# 字典树节点中保存匹配结果的键，汉字不会与之冲突
+_TERMINAL = ''
+
+
+def normalize_place(place: str) -> str:
+    """去掉空白和站点类型后缀，例如“福州南站”得到“福州”，“上海市”得到“上海”"""
+    name = ''.join((place or '').split())
+    for suffix in PLACE_SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix) + 1:
+            return name[:-len(suffix)]
+    return name
+
+
+class Gazetteer:
+    """站名、机场名到城市的对照表
+
+    对照表中的城市名、“城市+市”和别名编译为字典树，查找时从地名的每个位置开始沿字典树取最长匹配，
+    耗时只与地名长度有关，与对照表大小无关。以城市名开头的站名（福州南、上海虹桥、深圳北）
+    按最长前缀自动归入该城市，不以城市名开头的（虹桥、宝安机场、义乌）由别名归入所属城市。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or GAZETTEER_PATH
+        self.provinces: Dict[str, str] = {}
+        self._trie: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self) -> None:
+        with open(self.path, 'r', encoding='utf-8') as gazetteer_file:
+            for line in gazetteer_file:
+                line = line.rstrip('\n')
+                if not line or line.startswith('#'):
+                    continue
+                columns = line.split('\t')
+                city = columns[0]
+                self.provinces[city] = columns[1] if len(columns) > 1 else ''
+                aliases = columns[2].split(',') if len(columns) > 2 and columns[2] else []
+                for name in [city, city + '市'] + aliases:
+                    self._insert(name.strip(), city)
+
+    def _insert(self, name: str, city: str) -> None:
+        node = self._trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node.setdefault(_TERMINAL, city)
+
+    def _longest_match(self, text: str, start: int) -> Tuple[Optional[str], int]:
+        """从start位置沿字典树查找最长的地名，返回(城市, 匹配长度)"""
+        node = self._trie
+        city, length = None, 0
+        for offset in range(start, len(text)):
+            node = node.get(text[offset])
+            if node is None:
+                break
+            if _TERMINAL in node:
+                city, length = node[_TERMINAL], offset - start + 1
+        return city, length
+
+    def lookup(self, place: str) -> Optional[str]:
+        """返回地名所属的城市，找不到时返回None
+
+        从左到右取第一个位置上的最长匹配，例如“福州南站”得到福州，“上海虹桥国际机场”得到上海，
+        “深圳宝安国际机场”得到深圳，“浦东国际机场”得到上海。
+
+        Args:
+            place: 车站、机场、酒店等地名
+
+        Returns:
+            Optional[str]: 城市名
+        """
+        text = ''.join((place or '').split())
+        for start in range(len(text)):
+            city, _ = self._longest_match(text, start)
+            if city:
+                return city
+        return None
+
+    def province_of(self, city: str) -> str:
+        """返回城市所属的省份，未收录的城市返回空字符串"""
+        return self.provinces.get(city, '')
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """获取进程内共享的地名对照表，首次使用时加载"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer()
+    return _gazetteer
+
+
+def resolve_city(place: str) -> Optional[str]:
+    """返回地名所属的城市，找不到时返回None"""
+    return get_gazetteer().lookup(place)
+
+
+def canonical_place(place: str) -> str:
+    """返回地名所属的城市，对照表中没有时返回去掉站点类型后缀的地名"""
+    return resolve_city(place) or normalize_place(place)
@@ -0,0 +1,203 @@
+import bisect
+import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from tools.invoice_validator import parse_invoice_date
+
+HOTEL_INVOICE_TYPES = ['酒店住宿发票']
+
+
+def _stay_of(invoice: Dict[str, Any]) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """解析住宿发票的入住、退房日期，缺少退房日期时按入住日期加晚数推算，无法解析时返回None"""
+    raw = invoice.get('raw_extracted_info') or {}
+    check_in = parse_invoice_date(invoice.get('check_in_date') or raw.get('入住日期'))
+    check_out = parse_invoice_date(invoice.get('check_out_date') or raw.get('退房日期'))
+    if check_in and not check_out:
+        try:
+            nights = int(invoice.get('nights') or 0)
+        except (TypeError, ValueError):
+            nights = 0
+        if nights > 0:
+            check_out = check_in + datetime.timedelta(days=nights)
+    if not check_in or not check_out or check_out <= check_in:
+        return None
+    return check_in, check_out
+
+
+def _format_nights(nights: List[datetime.date]) -> str:
+    """把晚数列表压缩为日期区间，例如“2025-03-24至2025-03-26、2025-03-29”"""
+    ranges = []
+    for night in nights:
+        if ranges and (night - ranges[-1][1]).days == 1:
+            ranges[-1][1] = night
+        else:
+            ranges.append([night, night])
+    return '、'.join(start.isoformat() if start == end else f'{start.isoformat()}至{end.isoformat()}'
+                     for start, end in ranges)
+
+
+class HotelCoverageIndex:
+    """住宿发票的区间索引
+
+    每张住宿发票对应入住日到退房日的半开区间[入住, 退房)，区间内的每一天代表住了一晚。
+    建立索引时对所有区间的起止点做一次扫描线，得到互不重叠的基本区间及每段上的发票，
+    查询某个日期范围时二分定位起点，只遍历与之相交的基本区间，可以精确得到
+    已覆盖、未覆盖和被多张发票重复覆盖的晚数。
+    """
+
+    def __init__(self, invoices: List[Dict[str, Any]]):
+        self.stays: Dict[int, Tuple[datetime.date, datetime.date]] = {}
+        self.unparsed: List[int] = []
+        for index, invoice in enumerate(invoices):
+            if invoice.get('invoice_type') not in HOTEL_INVOICE_TYPES:
+                continue
+            stay = _stay_of(invoice)
+            if stay is None:
+                self.unparsed.append(index)
+            else:
+                self.stays[index] = stay
+
+        # 扫描线：按日期处理入住和退房事件，相邻两个事件日期之间的发票集合不变
+        events = sorted({date for stay in self.stays.values() for date in stay})
+        starts_at = {}
+        ends_at = {}
+        for index, (check_in, check_out) in self.stays.items():
+            starts_at.setdefault(check_in, []).append(index)
+            ends_at.setdefault(check_out, []).append(index)
+        self._segments: List[Tuple[datetime.date, datetime.date, Tuple[int, ...]]] = []
+        active = set()
+        for position, date in enumerate(events[:-1]):
+            active.difference_update(ends_at.get(date, []))
+            active.update(starts_at.get(date, []))
+            if active:
+                self._segments.append((date, events[position + 1], tuple(sorted(active))))
+        self._segment_starts = [segment[0] for segment in self._segments]
+
+    def query(self, start: datetime.date, end: datetime.date) -> Dict[str, Any]:
+        """查询[start, end)范围内每一晚的住宿覆盖情况
+
+        Args:
+            start: 第一晚的日期（出发日期）
+            end: 最后一晚的次日（返回日期）
+
+        Returns:
+            Dict: expected_nights为应住宿晚数，covered_nights为有住宿发票的晚数，
+                  uncovered为没有住宿发票的日期，double_booked为{日期: 重叠的发票序号}
+        """
+        expected = max(0, (end - start).days)
+        covered = 0
+        uncovered = []
+        double_booked = {}
+        cursor = start
+        position = max(0, bisect.bisect_right(self._segment_starts, start) - 1)
+        for segment_start, segment_end, indexes in self._segments[position:]:
+            if segment_start >= end:
+                break
+            if segment_end <= start:
+                continue
+            overlap_start, overlap_end = max(segment_start, start), min(segment_end, end)
+            uncovered.extend(cursor + datetime.timedelta(days=offset)
+                             for offset in range((overlap_start - cursor).days))
+            covered += (overlap_end - overlap_start).days
+            if len(indexes) > 1:
+                for offset in range((overlap_end - overlap_start).days):
+                    double_booked[overlap_start + datetime.timedelta(days=offset)] = list(indexes)
+            cursor = overlap_end
+        uncovered.extend(cursor + datetime.timedelta(days=offset) for offset in range(max(0, (end - cursor).days)))
+        return {
+            'expected_nights': expected,
+            'covered_nights': covered,
+            'uncovered': uncovered,
+            'double_booked': double_booked
+        }
+
+    def nights_within(self, windows: List[Tuple[datetime.date, datetime.date]]) -> Dict[int, Tuple[int, int]]:
+        """返回每张可解析的住宿发票落在日期范围内的晚数
+
+        Returns:
+            Dict: {发票序号: (在日期范围内的晚数, 发票的总晚数)}
+        """
+        merged = merge_windows(windows)
+        merged_starts = [window[0] for window in merged]
+        result = {}
+        for index, (check_in, check_out) in self.stays.items():
+            inside = 0
+            position = max(0, bisect.bisect_right(merged_starts, check_in) - 1)
+            for window_start, window_end in merged[position:]:
+                if window_start >= check_out:
+                    break
+                inside += max(0, (min(window_end, check_out) - max(window_start, check_in)).days)
+            result[index] = (inside, (check_out - check_in).days)
+        return result
+
+    def invoices_outside(self, windows: List[Tuple[datetime.date, datetime.date]]) -> List[int]:
+        """返回与所有日期范围都不相交的住宿发票序号"""
+        merged = merge_windows(windows)
+        merged_starts = [window[0] for window in merged]
+        outside = []
+        for index, (check_in, check_out) in self.stays.items():
+            position = bisect.bisect_right(merged_starts, check_in) - 1
+            candidates = merged[max(0, position):position + 2]
+            if not any(check_in < window_end and window_start < check_out for window_start, window_end in candidates):
+                outside.append(index)
+        return sorted(outside)
+
+
+def merge_windows(windows: List[Tuple[datetime.date, datetime.date]]) -> List[Tuple[datetime.date, datetime.date]]:
+    """合并相互重叠的日期范围，嵌套的行程（如出差途中的往返）只计算一次"""
+    merged = []
+    for start, end in sorted(window for window in windows if window[1] > window[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def trip_window(trip: Dict[str, Any]) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """行程需要住宿的日期范围[出发日期, 返回日期)，日期无法解析时返回None"""
+    start = parse_invoice_date(trip.get('departure_date'))
+    end = parse_invoice_date(trip.get('arrival_date'))
+    if not start or not end or end < start:
+        return None
+    return start, end
+
+
+def check_hotel_coverage(trips: List[Dict[str, Any]], invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """检查住宿发票对行程的覆盖情况
+
+    Args:
+        trips: 行程信息，使用departure_date、arrival_date
+        invoices: 发票信息，只处理住宿发票，使用check_in_date、check_out_date、nights
+
+    Returns:
+        Dict: trips为每个行程的应住宿晚数、已覆盖晚数、未覆盖日期和重复覆盖日期；
+              total_nights为所有行程（重叠部分只计一次）内有住宿发票的晚数，可作为住宿费标准的计算依据；
+              invoice_nights为{发票序号: (在行程日期内的晚数, 总晚数)}，只包含日期可解析的住宿发票；
+              outside_invoices为不在任何行程日期内的住宿发票序号，unparsed_invoices为日期无法解析的住宿发票序号
+    """
+    index = HotelCoverageIndex(invoices)
+    trip_results = []
+    windows = []
+    for trip_index, trip in enumerate(trips):
+        window = trip_window(trip)
+        if window is None:
+            continue
+        windows.append(window)
+        coverage = index.query(*window)
+        trip_results.append({
+            'trip_index': trip_index,
+            'expected_nights': coverage['expected_nights'],
+            'covered_nights': coverage['covered_nights'],
+            'uncovered_nights': [night.isoformat() for night in coverage['uncovered']],
+            'double_booked_nights': {night.isoformat(): indexes for night, indexes in coverage['double_booked'].items()},
+            'uncovered_text': _format_nights(coverage['uncovered']),
+            'double_booked_text': _format_nights(sorted(coverage['double_booked']))
+        })
+    total_nights = sum(index.query(*window)['covered_nights'] for window in merge_windows(windows))
+    return {
+        'trips': trip_results,
+        'total_nights': total_nights,
+        'invoice_nights': index.nights_within(windows),
+        'outside_invoices': index.invoices_outside(windows),
+        'unparsed_invoices': index.unparsed
+    }
@@ -0,0 +1,117 @@
+import io
+from typing import Dict, Any, Optional, Tuple
+from PIL import Image, ImageChops, ImageOps
+from qwen_agent.utils.utils import resize_image
+from config import IMAGE_PREPROCESS_CONFIG
+
+# 灰度值高于该阈值的像素视为空白背景
+BORDER_THRESHOLD = 245
+# 裁剪后保留的边距（像素）
+BORDER_PADDING = 16
+
+
+class ImagePreprocessor:
+    """多模态模型输入图像预处理器
+
+    按EXIF方向摆正图像，裁掉空白边框，把过大的图像等比缩小到配置的短边，
+    并去掉元数据重新压缩为JPEG/WebP，以减小请求体积和模型预填充耗时。
+    """
+
+    def __init__(self,
+                 short_side: Optional[int] = None,
+                 max_long_side: Optional[int] = None,
+                 image_format: Optional[str] = None,
+                 quality: Optional[int] = None,
+                 crop_border: Optional[bool] = None):
+        self.short_side = short_side or IMAGE_PREPROCESS_CONFIG['short_side']
+        self.max_long_side = max_long_side or IMAGE_PREPROCESS_CONFIG['max_long_side']
+        self.image_format = (image_format or IMAGE_PREPROCESS_CONFIG['format']).upper()
+        self.quality = quality or IMAGE_PREPROCESS_CONFIG['quality']
+        self.crop_border = IMAGE_PREPROCESS_CONFIG['crop_border'] if crop_border is None else crop_border
+
+    def process(self, image_bytes: bytes) -> Tuple[bytes, str, Dict[str, Any]]:
+        """预处理图像字节
+
+        Args:
+            image_bytes: 原始图像字节
+
+        Returns:
+            Tuple[bytes, str, Dict]: 处理后的图像字节、MIME类型，以及包含原始/处理后尺寸和字节数的统计信息
+        """
+        with Image.open(io.BytesIO(image_bytes)) as original:
+            original_format = original.format
+            original_size = original.size
+            img = ImageOps.exif_transpose(original)
+            img = self._to_rgb(img)
+
+        changed = img.size != original_size or original_format not in ('JPEG', 'PNG', 'WEBP')
+        if self.crop_border:
+            cropped = self._crop_whitespace(img)
+            changed = changed or cropped.size != img.size
+            img = cropped
+
+        resized = self._downscale(img)
+        changed = changed or resized.size != img.size
+        img = resized
+
+        buffer = io.BytesIO()
+        if self.image_format == 'WEBP':
+            img.save(buffer, 'WEBP', quality=self.quality, method=4)
+            mime_type = 'image/webp'
+        else:
+            img.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+            mime_type = 'image/jpeg'
+        output = buffer.getvalue()
+
+        # 图像无需缩放裁剪且重新编码没有变小时，直接使用原始字节
+        if not changed and len(output) >= len(image_bytes):
+            output = image_bytes
+            mime_type = Image.MIME.get(original_format, 'image/jpeg')
+
+        stats = {
+            'original_size': original_size,
+            'output_size': img.size,
+            'original_bytes': len(image_bytes),
+            'output_bytes': len(output)
+        }
+        print(f"图像预处理: {original_size} -> {img.size}, {len(image_bytes)} -> {len(output)}字节")
+        return output, mime_type, stats
+
+    def _to_rgb(self, img: Image.Image) -> Image.Image:
+        """转换为RGB，透明背景填充为白色"""
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            return background
+        if img.mode != 'RGB':
+            return img.convert('RGB')
+        return img
+
+    def _crop_whitespace(self, img: Image.Image) -> Image.Image:
+        """裁掉四周接近白色的空白边框"""
+        gray = img.convert('L')
+        # 反相后非空白内容为非零像素，getbbox即内容区域
+        mask = ImageChops.invert(gray.point(lambda value: 255 if value > BORDER_THRESHOLD else 0))
+        bbox = mask.getbbox()
+        if not bbox:
+            return img
+
+        left = max(0, bbox[0] - BORDER_PADDING)
+        top = max(0, bbox[1] - BORDER_PADDING)
+        right = min(img.width, bbox[2] + BORDER_PADDING)
+        bottom = min(img.height, bbox[3] + BORDER_PADDING)
+        # 可裁剪区域很小时不裁剪，避免无意义的重新编码
+        if (right - left) * (bottom - top) > 0.95 * img.width * img.height:
+            return img
+        return img.crop((left, top, right, bottom))
+
+    def _downscale(self, img: Image.Image) -> Image.Image:
+        """等比缩小到目标短边，并限制长边，只缩小不放大"""
+        short_side = min(self.short_side, min(img.size))
+        long_side = max(img.size) * short_side / min(img.size)
+        if long_side > self.max_long_side:
+            short_side = int(short_side * self.max_long_side / long_side)
+        if short_side >= min(img.size):
+            return img
+        return resize_image(img, short_side_length=short_side)
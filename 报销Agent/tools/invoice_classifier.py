@@ -0,0 +1,169 @@
+import io
+import os
+import re
+from typing import Dict, Any, Optional, Tuple
+from PIL import Image
+from config import EXTRACTION_CONFIG
+from tools.pdf_text_extractor import detect_invoice_kind
+
+# 票据类别对应的发票类型提示（与INVOICE_TYPES一致），用于选择专用提取结构
+KIND_TO_HINT = {
+    'transport': '火车票',
+    'hotel': '酒店住宿发票',
+    'meal': '餐票',
+    'taxi': '打车票',
+    'toll': '高速通行票',
+}
+
+# 文本层识别出的票据类别归并到提取结构的类别
+TEXT_KIND_MAP = {
+    'train': 'transport',
+    'flight': 'transport',
+    'hotel': 'hotel',
+    'meal': 'meal',
+    'taxi': 'taxi',
+    'toll': 'toll',
+}
+
+# 二维码中的发票种类代码：51为铁路电子客票，61为航空运输电子客票行程单
+QR_TYPE_KINDS = {
+    '51': 'transport',
+    '61': 'transport',
+}
+
+# 文件名或类型提示中的关键词，按顺序匹配
+FILENAME_KEYWORDS = [
+    ('hotel', ['酒店', '住宿', '宾馆', '房费']),
+    ('taxi', ['打车', '出租', '滴滴', '网约车', '的士']),
+    ('meal', ['餐', '饭', '食']),
+    ('toll', ['通行费', '过路费', '高速']),
+    ('transport', ['火车', '高铁', '动车', '车票', '机票', '行程单', '客票', '航班', '交通']),
+]
+
+# 形如"上海到杭州"、"福州-深圳"的文件名视为交通票据
+ROUTE_FILENAME_PATTERN = re.compile(r'[一-龥]{2,}(?:到|至|->|→|—|-)[一-龥]{2,}')
+
+# 各信号来源的置信度
+SOURCE_CONFIDENCE = {
+    'hint': 1.0,
+    'qr': 0.95,
+    'text_layer': 0.9,
+    'filename': 0.8,
+    'layout': 0.6,
+}
+
+
+class InvoiceClassifier:
+    """调用模型前的本地发票类型预分类器
+
+    依次参考调用方提供的类型、二维码种类代码、PDF文本、文件名和图像版式，
+    给出票据类别及置信度，据此选择专用提示词和模型规格，无需调用模型。
+    """
+
+    def __init__(self,
+                 min_confidence: Optional[float] = None,
+                 fast_model_min_confidence: Optional[float] = None):
+        self.min_confidence = min_confidence or EXTRACTION_CONFIG['classifier_min_confidence']
+        self.fast_model_min_confidence = fast_model_min_confidence or EXTRACTION_CONFIG['fast_model_min_confidence']
+
+    def classify(self,
+                 invoice_type: Optional[str] = None,
+                 qr_info: Optional[Dict[str, Any]] = None,
+                 text: Optional[str] = None,
+                 file_name: Optional[str] = None,
+                 image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+        """根据本地可得的信号判断票据类别，返回第一个给出结论的信号
+
+        Args:
+            invoice_type: 调用方提供的发票类型提示
+            qr_info: 二维码解析结果
+            text: PDF文本层文字
+            file_name: 原始文件名
+            image_bytes: 待识别的图像字节
+
+        Returns:
+            Dict: 包含kind（无法判断时为None）、confidence和source
+        """
+        if invoice_type:
+            kind = self._kind_from_keywords(invoice_type)
+            if kind:
+                return self._result(kind, 'hint')
+
+        if qr_info and qr_info.get('发票种类代码') in QR_TYPE_KINDS:
+            return self._result(QR_TYPE_KINDS[qr_info['发票种类代码']], 'qr')
+
+        if text:
+            kind = TEXT_KIND_MAP.get(detect_invoice_kind(text))
+            if kind:
+                return self._result(kind, 'text_layer')
+
+        if file_name:
+            stem = os.path.splitext(os.path.basename(file_name))[0]
+            kind = self._kind_from_keywords(stem)
+            if kind:
+                return self._result(kind, 'filename')
+            if ROUTE_FILENAME_PATTERN.search(stem):
+                return self._result('transport', 'filename')
+
+        if image_bytes:
+            kind = self._kind_from_layout(image_bytes)
+            if kind:
+                return self._result(kind, 'layout')
+
+        return {'kind': None, 'confidence': 0.0, 'source': None}
+
+    def route(self, classification: Dict[str, Any], invoice_type: Optional[str] = None) -> Dict[str, Any]:
+        """根据分类结果选择提取使用的发票类型提示和级联模型
+
+        置信度足够时使用该类别的专用提示词；置信度高且属于简单类别时从小模型开始级联，
+        否则直接使用最后一级（最大的）模型。
+
+        Args:
+            classification: classify的返回结果
+            invoice_type: 调用方提供的发票类型提示，优先使用
+
+        Returns:
+            Dict: 包含invoice_type（发票类型提示）、models（依次尝试的模型）和start_tier（第一个模型的级别）
+        """
+        kind = classification.get('kind')
+        confidence = classification.get('confidence', 0.0)
+        if not invoice_type and kind and confidence >= self.min_confidence:
+            invoice_type = KIND_TO_HINT.get(kind)
+
+        tiers = EXTRACTION_CONFIG['model_tiers']
+        start_tier = len(tiers) - 1
+        if kind in EXTRACTION_CONFIG['fast_model_kinds'] and confidence >= self.fast_model_min_confidence:
+            start_tier = 0
+        return {'invoice_type': invoice_type, 'models': tiers[start_tier:], 'start_tier': start_tier}
+
+    def _result(self, kind: str, source: str) -> Dict[str, Any]:
+        return {'kind': kind, 'confidence': SOURCE_CONFIDENCE[source], 'source': source}
+
+    def _kind_from_keywords(self, text: str) -> Optional[str]:
+        for kind, keywords in FILENAME_KEYWORDS:
+            if any(keyword in text for keyword in keywords):
+                return kind
+        return None
+
+    def _kind_from_layout(self, image_bytes: bytes) -> Optional[str]:
+        """根据图像版式粗略判断：细长的机打小票多为出租车票，蓝色卡片状的多为纸质火车票"""
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                width, height = img.size
+                if not width or not height:
+                    return None
+                if height / width >= 2.2:
+                    return 'taxi'
+                if 1.45 <= width / height <= 1.75:
+                    img.draft('RGB', (64, 64))
+                    red, green, blue = self._mean_color(img)
+                    if blue > red + 20 and blue > green:
+                        return 'transport'
+        except Exception as e:
+            print(f"版式预分类失败: {str(e)}")
+        return None
+
+    def _mean_color(self, img: Image.Image) -> Tuple[float, float, float]:
+        thumbnail = img.convert('RGB').resize((32, 32))
+        pixels = list(thumbnail.getdata())
+        return tuple(sum(pixel[channel] for pixel in pixels) / len(pixels) for channel in range(3))
@@ -21,6 +21,10 @@ except ImportError:
         '出差境内其他地市': []  # 默认类型
     }
 
+# 站名、机场名到城市的对照表
+from tools.gazetteer import canonical_place, resolve_city, get_gazetteer
+from tools.itinerary_builder import ItineraryBuilder
+
 # 导入报销类型匹配函数
 try:
     # 尝试从tools目录导入
@@ -35,6 +39,15 @@ except ImportError:
             """导入失败时的默认实现"""
             return "001/出差北上"  # 默认返回
 
+# 报销类型对应的编码
+REIMBURSEMENT_TYPE_CODES = {
+    '出差北上': "001",
+    '出差广深': "00101",
+    '出差杭厦': "00102",
+    '出差港澳台': "002",
+    '出差境内其他地市': "003"
+}
+
 def get_reimbursement_type_by_location(location):
     """
     根据地点匹配报销类型编码
@@ -47,21 +60,21 @@ def get_reimbursement_type_by_location(location):
     
     location = location.strip()
     
-    # 遍历REIMBURSEMENT_TYPE_MAPPING寻找匹配的地区
+    # 先通过地名对照表确定所属城市，按城市或所在省份匹配报销类型
+    city = resolve_city(location)
+    if city:
+        province = get_gazetteer().province_of(city)
+        for type_key, locations in REIMBURSEMENT_TYPE_MAPPING.items():
+            if city in locations or province in locations:
+                return REIMBURSEMENT_TYPE_CODES.get(type_key, "003")
+        return "003"
+    
+    # 对照表中没有的地名，遍历REIMBURSEMENT_TYPE_MAPPING寻找匹配的地区
     for type_key, locations in REIMBURSEMENT_TYPE_MAPPING.items():
         for mapped_location in locations:
             if mapped_location in location or location in mapped_location:
                 # 根据映射规则返回对应的编码
-                if type_key == '出差北上':
-                    return "001"
-                elif type_key == '出差广深':
-                    return "00101"
-                elif type_key == '出差杭厦':
-                    return "00102"
-                elif type_key == '出差港澳台':
-                    return "002"
-                elif type_key == '出差境内其他地市':
-                    return "003"
+                return REIMBURSEMENT_TYPE_CODES.get(type_key, "003")
     
     # 如果没有匹配的地区，根据城市名尝试进一步匹配
     if any(city in location for city in ['北京', '上海']):
@@ -187,8 +200,8 @@ def convert_transportation_invoice(invoice_data, trip_days=""):
     travel_date = convert_date_format(travel_date)
     
     # 提取出发地和到达地
-    departure = raw_data.get("起始站", "").replace("站", "")
-    destination = raw_data.get("到站", "").replace("站", "")
+    departure = canonical_place(raw_data.get("起始站", ""))
+    destination = canonical_place(raw_data.get("到站", ""))
     
     # 确定交通工具类型
     transport_type = "飞机"
@@ -241,57 +254,34 @@ def generate_filename(invoice_data):
         hotel_name = raw_data.get("酒店名称", raw_data.get("销售方名称", "hotel"))
         return f"{hotel_name}_{invoice_id}.json"
     else:
-        departure = raw_data.get("起始站", "").replace("站", "")
-        destination = raw_data.get("到站", "").replace("站", "")
+        departure = canonical_place(raw_data.get("起始站", ""))
+        destination = canonical_place(raw_data.get("到站", ""))
         return f"{departure}2{destination}_{invoice_id}.json"
 
 def find_trip_routes(invoices):
     """
-    从所有交通发票中查找往返行程，计算出差天数
+    从所有交通发票中重建出差行程，计算每次出差的天数
+    
+    :return: 第一次出差的出发日期、返回日期和天数（YYYYMMDD格式），
+             trips为全部出差，trip_days_by_invoice为每张交通发票所属出差的天数
     """
-    # 收集所有交通发票信息
-    transportation_invoices = []
-    for invoice in invoices:
-        if any(transport in invoice.get("invoice_type", "") for transport in ["火车", "飞机", "出租车", "汽车"]):
-            transportation_invoices.append(invoice)
-    
-    # 尝试找到往返行程
-    trip_routes = {}
-    for invoice in transportation_invoices:
-        raw_data = invoice.get("raw_extracted_info", {})
-        departure = raw_data.get("起始站", "").replace("站", "")
-        destination = raw_data.get("到站", "").replace("站", "")
-        travel_date = convert_date_format(raw_data.get("乘坐日期", ""))
-        
-        if not departure or not destination or not travel_date:
-            continue
-        
-        route_key = f"{departure}-{destination}"
-        reverse_route_key = f"{destination}-{departure}"
-        
-        if route_key not in trip_routes:
-            trip_routes[route_key] = {"date": travel_date, "invoice_id": invoice.get("invoice_id")}
-        
-        # 检查是否有返程
-        if reverse_route_key in trip_routes:
-            # 找到往返行程，计算出差天数
-            outbound_date = trip_routes[reverse_route_key]["date"]
-            return_date = travel_date
-            
-            # 确保出发日期在返程日期之前
-            if outbound_date > return_date:
-                outbound_date, return_date = return_date, outbound_date
-            
-            trip_days = calculate_trip_days(outbound_date, return_date)
-            
-            # 返回包含往返行程信息的字典
-            return {
-                "outbound_date": outbound_date,
-                "return_date": return_date,
-                "trip_days": trip_days
-            }
-    
-    # 如果找不到完整的往返行程，尝试从酒店发票中提取信息
+    itinerary = ItineraryBuilder().build(invoices)
+    trips = itinerary["trips"]
+    trip_days_by_invoice = {}
+    for trip in trips:
+        for invoice_index in trip["invoice_indexes"]:
+            trip_days_by_invoice[invoice_index] = str(trip["days"])
+    
+    if trips:
+        return {
+            "outbound_date": trips[0]["start_date"].replace("-", ""),
+            "return_date": trips[0]["end_date"].replace("-", ""),
+            "trip_days": str(trips[0]["days"]),
+            "trips": trips,
+            "trip_days_by_invoice": trip_days_by_invoice
+        }
+    
+    # 如果没有可用的交通发票，尝试从酒店发票中提取信息
     for invoice in invoices:
         if "酒店" in invoice.get("invoice_type", "") or "住宿" in invoice.get("invoice_type", ""):
             raw_data = invoice.get("raw_extracted_info", {})
@@ -303,10 +293,22 @@ def find_trip_routes(invoices):
                 return {
                     "outbound_date": check_in_date,
                     "return_date": check_out_date,
-                    "trip_days": trip_days
+                    "trip_days": trip_days,
+                    "trips": [],
+                    "trip_days_by_invoice": {}
                 }
     
-    return {"outbound_date": "", "return_date": "", "trip_days": ""}
+    return {"outbound_date": "", "return_date": "", "trip_days": "", "trips": [], "trip_days_by_invoice": {}}
+
+def trip_days_for_hotel(invoice, trips, default_days):
+    """
+    返回酒店发票入住日期所在出差的天数，找不到时返回默认值
+    """
+    check_in_date = convert_date_format(invoice.get("raw_extracted_info", {}).get("入住日期", ""))
+    for trip in trips:
+        if trip["start_date"].replace("-", "") <= check_in_date <= trip["end_date"].replace("-", ""):
+            return str(trip["days"])
+    return default_days
 
 def main():
     # 获取当前脚本所在目录的绝对路径
@@ -357,19 +359,21 @@ def main():
         print("未能从任何文件中提取到发票数据")
         return
     
-    # 查找往返行程，计算出差天数
+    # 重建出差行程，计算每次出差的天数
     trip_info = find_trip_routes(all_invoices)
     trip_days = trip_info["trip_days"]
     
     print(f"出差信息: 出发日期={trip_info['outbound_date']}, 返回日期={trip_info['return_date']}, 出差天数={trip_days}")
+    for trip in trip_info["trips"]:
+        print(f"  {trip['start_date']} 至 {trip['end_date']}，{trip['days']}天，途经{'、'.join(trip['cities'])}")
     
     # 处理每个发票
-    for invoice in all_invoices:
+    for index, invoice in enumerate(all_invoices):
         invoice_type = invoice.get("invoice_type", "")
         
         if "酒店" in invoice_type or "住宿" in invoice_type:
             # 转换酒店发票
-            converted_data = convert_hotel_invoice(invoice, trip_days)
+            converted_data = convert_hotel_invoice(invoice, trip_days_for_hotel(invoice, trip_info["trips"], trip_days))
             filename = generate_filename(invoice)
             output_path = os.path.join(hotel_dir, filename)
             
@@ -380,7 +384,7 @@ def main():
             
         elif any(transport in invoice_type for transport in ["火车", "飞机", "出租车", "汽车"]):
             # 转换交通发票
-            converted_data = convert_transportation_invoice(invoice, trip_days)
+            converted_data = convert_transportation_invoice(invoice, trip_info["trip_days_by_invoice"].get(index, trip_days))
             filename = generate_filename(invoice)
             output_path = os.path.join(transportation_dir, filename)
             
@@ -1,16 +1,30 @@
 import os
+import io
+import asyncio
 import base64
 import json
 import re
-import tempfile
-from typing import Dict, Any, Optional, Union
-from openai import OpenAI
+from typing import Dict, Any, Optional, Union, Iterator
+from qwen_agent.llm.client_pool import get_async_openai_client, get_openai_client
 from PIL import Image
 import datetime
+from config import IMAGE_PREPROCESS_CONFIG, EXTRACTION_CONFIG
+from tools.image_preprocessor import ImagePreprocessor
+from tools.streaming_json import IncrementalJSONParser
+from tools.invoice_schemas import INVOICE_SCHEMAS, build_schema_prompt, expand_field, expand_fields, required_fields_for, schema_kind_for
+
+# 多模态模型服务地址（DashScope的OpenAI兼容接口）
+MODEL_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# 提示词版本，修改提取提示词或输出格式时需要同步更新，使旧的缓存结果失效
+PROMPT_VERSION = 'v2'
 
 class InvoiceExtractor:
     def __init__(self, api_key=None):
         self.api_key = api_key or "sk-b3858a69da01473f915c9d07c1ff6fe5"
+        self.preprocessor = ImagePreprocessor() if IMAGE_PREPROCESS_CONFIG['enabled'] else None
+        self.json_mode = EXTRACTION_CONFIG['json_mode']
+        self.model = EXTRACTION_CONFIG['model_tiers'][-1]
     
     def encode_image(self, image_path):
         """将图片转换为base64编码"""
@@ -56,208 +70,65 @@ class InvoiceExtractor:
         
         return {"error": "未找到JSON数据", "raw_content": markdown_text}
 
+    def prepare_image_bytes(self, image_bytes):
+        """校验内存中的图像数据，启用预处理时缩放、裁边并重新压缩，否则仅在必要时转换为RGB JPEG
+
+        Args:
+            image_bytes: 图像的原始字节
+
+        Returns:
+            Tuple[bytes, str]: 可直接发送给模型的图像字节及其MIME类型
+        """
+        if self.preprocessor is not None:
+            image_bytes, mime_type, _ = self.preprocessor.process(image_bytes)
+            return image_bytes, mime_type
+
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            # 检查图像格式并转换为RGB以确保兼容性
+            if img.mode != 'RGB':
+                buffer = io.BytesIO()
+                img.convert('RGB').save(buffer, 'JPEG')
+                print(f"已在内存中将图像从{img.mode}转换为RGB JPEG")
+                return buffer.getvalue(), 'image/jpeg'
+            mime_type = Image.MIME.get(img.format, 'image/jpeg')
+        return image_bytes, mime_type
+
     def extract_info(self, image_path, invoice_type=None):
-        """从发票图片中提取信息"""
+        """从发票图片文件中提取信息"""
+        print(f"invoice_extractor.extract_info被调用, 图片路径: {image_path}, 发票类型: {invoice_type}")
+        
+        # 验证图像文件是否存在且可读
+        if not os.path.exists(image_path):
+            return {"error": f"图像文件不存在: {image_path}"}
+        
+        with open(image_path, "rb") as image_file:
+            return self.extract_info_from_bytes(image_file.read(), invoice_type)
+
+    def extract_info_from_bytes(self, image_bytes, invoice_type=None, model=None):
+        """从内存中的发票图片字节中提取信息，全程不落盘，model为空时使用默认模型"""
         try:
-            print(f"invoice_extractor.extract_info被调用, 图片路径: {image_path}, 发票类型: {invoice_type}")
+            print(f"invoice_extractor.extract_info_from_bytes被调用, 图像大小: {len(image_bytes)}字节, 发票类型: {invoice_type}")
             
-            # 验证图像文件是否存在且可读
-            if not os.path.exists(image_path):
-                return {"error": f"图像文件不存在: {image_path}"}
-                
-            try:
-                # 尝试验证图像是否有效
-                try:
-                    with Image.open(image_path) as img:
-                        # 检查图像格式并转换为RGB以确保兼容性
-                        if img.mode != 'RGB':
-                            rgb_img = img.convert('RGB')
-                            # 保存为临时JPEG文件
-                            temp_path = image_path + ".jpg"
-                            rgb_img.save(temp_path, 'JPEG')
-                            print(f"已将图像转换为RGB格式并保存为: {temp_path}")
-                            image_path = temp_path
-                except Exception as img_err:
-                    print(f"图像验证失败: {str(img_err)}")
-                    return {"error": f"图像验证失败: {str(img_err)}"}
-            except ImportError:
-                print("PIL库未安装，跳过图像验证")
+            request = self._build_image_request(image_bytes, invoice_type)
+            if "error" in request:
+                return request
             
-            # 编码图像为base64
-            try:
-                base64_image = self.encode_image(image_path)
-                print(f"成功将图片编码为base64, 长度: {len(base64_image)}")
-                
-                # 检查base64编码是否有效
-                if len(base64_image) < 100:
-                    print(f"警告: base64编码长度过短，可能是空图像或编码错误: {len(base64_image)}")
-                    return {"error": "图像编码异常，长度过短"}
-            except Exception as encode_err:
-                print(f"图像编码失败: {str(encode_err)}")
-                return {"error": f"图像编码失败: {str(encode_err)}"}
-
-            # 创建OpenAI客户端
+            # 获取进程内共享的OpenAI客户端，复用长连接避免每次请求重新握手
             try:
-                client = OpenAI(
-                    api_key=self.api_key,
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                )
-                print("成功创建OpenAI客户端")
+                client = get_openai_client(base_url=MODEL_BASE_URL, api_key=self.api_key)
+                print("成功获取OpenAI客户端")
             except Exception as client_err:
-                print(f"创建OpenAI客户端失败: {str(client_err)}")
+                print(f"获取OpenAI客户端失败: {str(client_err)}")
                 return {"error": f"创建API客户端失败: {str(client_err)}"}
             
-            # 根据发票类型调整提示词
-            prompt = """
-            提取图片中的发票信息，返回JSON格式。
-            如果是交通发票，需要提取的字段为[乘客姓名,发票号码,起始站,到站,燃油费,票价,乘坐日期,电子客票号,开车时间,车次,座号,日期,金额,销售方名称]。
-            如果是住宿发票，需要提取的字段为[酒店名称,销售方名称,入住日期,退房日期,住宿天数,票价,发票号码,房间号,开票日期（记为"日期"字段）,金额,税率/征收率,住宿人姓名,住宿地址]。
-            如果是餐饮发票，需要提取的字段为[商家名称,销售方名称,消费日期,消费项目,金额,发票号码,就餐人数,消费地址]。
-            如果是打车发票，需要提取的字段为[起点,终点,上车时间,下车时间,里程,金额,发票号码,车牌号,出租车公司]。
-            
-            请识别所有可见的文字信息，包括：
-            - 销售方名称（开票方、商家名称、酒店名称等）
-            - 购买方信息（如果有）
-            - 所有日期信息
-            - 金额信息
-            - 发票代码、发票号码
-            - 税务相关信息
-            - 地址信息
-            - 其他关键业务信息
-            
-            确保不遗漏任何可见的字段信息。
-            若内容被遮挡或无法识别，请勿将其他字段内容填入。
-            请直接以JSON格式返回，不要有任何其他文字说明。
-            """
-            
-            if invoice_type:
-                prompt = f"""
-                这是一张{invoice_type}，请提取其中的关键信息，以JSON格式返回。
-                请识别所有可见的日期信息和金额信息，确保不遗漏任何重要字段。
-                请直接以JSON格式返回，不要有任何其他文字说明。
-                """
-            
-            print(f"使用提示词: {prompt}")
-            
             # 调用大模型API
             try:
                 print("开始调用OpenAI API...")
-                
-                # 构建图片URL（避免直接在代码中输出完整的base64编码）
-                image_url_with_prefix = f"data:image/jpeg;base64,{base64_image}"
-                if len(image_url_with_prefix) > 100:
-                    display_url = image_url_with_prefix[:50] + "..." + image_url_with_prefix[-20:]
-                else:
-                    display_url = image_url_with_prefix
-                print(f"图片URL(部分): {display_url}")
-                
-                # 重试机制
-                max_retries = 2
-                for retry in range(max_retries + 1):
-                    try:
-                        completion = client.chat.completions.create(
-                            model="qwen2.5-vl-72b-instruct",  # 使用通义千问大模型
-                            messages=[{"role": "user", "content": [
-                                {"type": "text", "text": prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                            ]}],
-                            temperature=0,  # 降低温度以获得更确定性的结果
-                            max_tokens=1000  # 限制token数量提高响应速度
-                        )
-                        break  # 如果成功则跳出重试循环
-                    except Exception as api_err:
-                        if retry < max_retries:
-                            wait_time = (retry + 1) * 2  # 逐渐增加等待时间
-                            print(f"API调用失败，第{retry+1}次重试，等待{wait_time}秒: {str(api_err)}")
-                            import time
-                            time.sleep(wait_time)
-                        else:
-                            raise  # 最后一次重试仍失败，抛出异常
-                
-                print(f"API调用成功，开始处理响应...")
-                response_str = completion.model_dump_json()
-                response_dict = json.loads(response_str)
-                content = response_dict["choices"][0]["message"]["content"]
-                print(f"获取到响应内容: {content[:100]}...")
-                
-                # 解析JSON数据
-                extracted_info = self.extract_json_from_markdown(content)
-                print(f"从响应中提取JSON数据: {extracted_info}")
-                
-                # 检查是否有错误
-                if isinstance(extracted_info, dict) and "error" in extracted_info:
-                    return extracted_info
-                
-                # 增加发票类型识别
-                if isinstance(extracted_info, dict):
-                    # 交通票据识别：检查是否有明确的交通相关属性
-                    is_transport = False
-                    
-                    # 检查关键字段
-                    if extracted_info.get('起始站') and extracted_info.get('到站'):
-                        is_transport = True
-                    # 检查是否有其他交通相关字段
-                    elif any(key in extracted_info for key in ['车次', '乘车日期', '开车时间', '座号', '列车号', '航班号', '车牌号']):
-                        is_transport = True
-                    # 检查是否有交通相关关键词
-                    elif any(keyword in str(extracted_info) for keyword in ['火车', '高铁', '动车', '汽车', '客车', '飞机', '航班', '出租车', '公交']):
-                        is_transport = True
-                    
-                    if is_transport:
-                        extracted_info['发票类型'] = '交通票据'
-                        # 如果缺少起始站或到站信息，添加警告
-                        if not extracted_info.get('起始站'):
-                            extracted_info['警告'] = extracted_info.get('警告', [])
-                            if isinstance(extracted_info['警告'], list):
-                                extracted_info['警告'].append('缺少起始站信息')
-                            else:
-                                extracted_info['警告'] = ['缺少起始站信息']
-                        if not extracted_info.get('到站'):
-                            extracted_info['警告'] = extracted_info.get('警告', [])
-                            if isinstance(extracted_info['警告'], list):
-                                extracted_info['警告'].append('缺少到站信息')
-                            else:
-                                extracted_info['警告'] = ['缺少到站信息']
-                    # 住宿票据识别逻辑
-                    elif extracted_info.get('入住日期') or extracted_info.get('退房日期') or (extracted_info.get('日期') and ('酒店' in str(extracted_info) or '住宿' in str(extracted_info))):
-                        extracted_info['发票类型'] = '住宿票据'
-                        
-                        # 确保住宿票据有日期字段
-                        if not extracted_info.get('日期') and (extracted_info.get('入住日期') or extracted_info.get('退房日期')):
-                            # 如果没有日期字段但有入住日期，将入住日期作为日期
-                            extracted_info['日期'] = extracted_info.get('入住日期', '')
-                    else:
-                        extracted_info['发票类型'] = '其他票据'
-                
-                # 清理临时文件
-                if image_path.endswith(".jpg") and image_path != os.path.splitext(image_path)[0]:
-                    try:
-                        os.remove(image_path)
-                        print(f"已删除临时转换文件: {image_path}")
-                    except Exception as del_err:
-                        print(f"删除临时文件失败: {str(del_err)}")
-                
-                return extracted_info
-            
+                completion = self._chat_with_image(client, request["prompt"], request["image_url"],
+                                                   max_tokens=request["max_tokens"], json_output=True, model=model)
+                return self._parse_completion(completion, request["schema"])
             except Exception as api_error:
-                print(f"API调用过程中出错: {str(api_error)}")
-                import traceback
-                traceback.print_exc()
-                
-                # 尝试使用备用方法提取信息
-                try:
-                    print("API调用失败，尝试使用本地备用方法提取信息...")
-                    
-                    # 使用OCR或其他备用方法提取文本
-                    # 这里可以实现简单的备用提取逻辑
-                    extracted_info = self._backup_extract_info(image_path, invoice_type)
-                    if extracted_info:
-                        print("成功使用备用方法提取信息")
-                        return extracted_info
-                except Exception as backup_err:
-                    print(f"备用方法也失败: {str(backup_err)}")
-                
-                return {"error": f"API调用失败: {str(api_error)}"}
+                return self._handle_api_error(api_error, invoice_type)
             
         except Exception as e:
             print(f"提取信息总体出错: {str(e)}")
@@ -265,90 +136,368 @@ class InvoiceExtractor:
             traceback.print_exc()
             return {"error": f"提取信息时出错: {str(e)}"}
     
-    def _get_prompt_by_invoice_type(self, invoice_type=None):
-        """根据发票类型获取对应的提示语
+    async def extract_info_async(self, image_bytes, invoice_type=None, model=None):
+        """extract_info_from_bytes的异步版本，等待模型响应期间不占用线程
+        
+        图像预处理等CPU操作在线程池中执行，模型调用使用异步客户端。
         
         Args:
-            invoice_type: 发票类型，如"火车票"、"机票"、"酒店住宿发票"等
+            image_bytes: 图像的原始字节
+            invoice_type: 发票类型提示
+            model: 使用的模型名称，为空时使用默认模型
             
         Returns:
-            str: 提示语
+            Dict: 提取的发票信息，失败时包含error字段
         """
-        # 基础提示
-        base_prompt = """
-        请仔细分析图像中的发票或票据信息，以JSON格式返回关键数据。
-        请识别所有可见的日期信息和金额信息，确保不遗漏任何重要字段。
-        若内容被遮挡或模糊不清，请勿猜测，将对应字段留空。
-        请直接以JSON格式返回，不要有任何其他文字说明。
+        try:
+            print(f"invoice_extractor.extract_info_async被调用, 图像大小: {len(image_bytes)}字节, 发票类型: {invoice_type}")
+            
+            request = await asyncio.to_thread(self._build_image_request, image_bytes, invoice_type)
+            if "error" in request:
+                return request
+            
+            try:
+                client = get_async_openai_client(base_url=MODEL_BASE_URL, api_key=self.api_key)
+                completion = await self._achat_with_image(client, request["prompt"], request["image_url"],
+                                                          max_tokens=request["max_tokens"], json_output=True, model=model)
+                return self._parse_completion(completion, request["schema"])
+            except Exception as api_error:
+                return self._handle_api_error(api_error, invoice_type)
+            
+        except Exception as e:
+            print(f"异步提取信息出错: {str(e)}")
+            return {"error": f"提取信息时出错: {str(e)}"}
+    
+    def extract_info_stream(self, image_bytes, invoice_type=None, stop_when_complete=True, model=None) -> Iterator[Dict[str, Any]]:
+        """流式提取发票信息，模型每写完一个字段就立即返回该字段
+        
+        Args:
+            image_bytes: 图像的原始字节
+            invoice_type: 发票类型提示
+            stop_when_complete: 所属类型的必需字段全部生成后是否提前结束生成
+            model: 使用的模型名称，为空时使用默认模型
+            
+        Yields:
+            Dict: {'type': 'field', 'key': 字段名, 'value': 值}，
+                最后一个为{'type': 'done', 'extracted_info': 完整提取结果}
         """
+        print(f"invoice_extractor.extract_info_stream被调用, 图像大小: {len(image_bytes)}字节, 发票类型: {invoice_type}")
+        request = self._build_image_request(image_bytes, invoice_type)
+        if "error" in request:
+            yield {'type': 'done', 'extracted_info': request}
+            return
         
-        if not invoice_type or invoice_type in ["火车票", "机票", "汽车票"]:
-            return f"""
-            {base_prompt}
-            这是一张交通票据（可能是火车票/机票/汽车票）。
-            请提取以下关键字段：
-            - 发票号码/电子客票号
-            - 日期（票据开具日期）
-            - 乘车/乘机日期
-            - 起始站/出发地
-            - 到站/目的地
-            - 票价/金额
-            - 乘客姓名/旅客信息
-            - 车次/航班号
-            - 座位信息
-            - 时间信息（出发时间/到达时间）
-            """
-        elif invoice_type == "酒店住宿发票":
-            return f"""
-            {base_prompt}
-            这是一张酒店住宿发票。
-            请提取以下关键字段：
-            - 发票号码
-            - 日期（开票日期）
-            - 酒店名称
-            - 入住日期
-            - 退房日期
-            - 住宿天数
-            - 房间号/房型
-            - 住宿人姓名
-            - 金额/票价
-            """
-        elif invoice_type == "打车票":
-            return f"""
-            {base_prompt}
-            这是一张打车票/出租车发票。
-            请提取以下关键字段：
-            - 发票号码
-            - 日期
-            - 金额/票价
-            - 上车地点/起点
-            - 下车地点/终点
-            - 车牌号
-            - 里程数
-            """
-        elif invoice_type == "餐票":
-            return f"""
-            {base_prompt}
-            这是一张餐饮发票/餐票。
-            请提取以下关键字段：
-            - 发票号码
-            - 日期
-            - 金额/票价
-            - 商家名称/餐厅名称
-            - 消费项目
-            - 人数（如有）
-            """
+        kind = request["schema"]
+        parser = IncrementalJSONParser()
+        fields = {}
+        content = ''
+        stream = None
+        try:
+            client = get_openai_client(base_url=MODEL_BASE_URL, api_key=self.api_key)
+            stream = self._create_chat(client, request["prompt"], request["image_url"],
+                                       max_tokens=request["max_tokens"], json_output=True, stream=True, model=model)
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                content += delta
+                for key, value in parser.feed(delta):
+                    if value in (None, ''):
+                        continue
+                    key, value = expand_field(kind, key, value)
+                    fields[key] = value
+                    yield {'type': 'field', 'key': key, 'value': value}
+                if parser.done:
+                    break
+                required = required_fields_for(kind, fields)
+                if stop_when_complete and required and all(f in fields for f in required):
+                    print(f"必需字段已全部生成，提前结束生成: {required}")
+                    break
+        except Exception as api_error:
+            yield {'type': 'done', 'extracted_info': self._handle_api_error(api_error, invoice_type)}
+            return
+        finally:
+            if stream is not None:
+                stream.close()
+        
+        print(f"流式响应内容: {content[:100]}...")
+        extracted_info = expand_fields(kind, parser.fields if parser.fields else self.extract_json_from_markdown(content))
+        if not (isinstance(extracted_info, dict) and "error" in extracted_info):
+            extracted_info = self._classify_extracted_info(extracted_info)
+        yield {'type': 'done', 'extracted_info': extracted_info}
+    
+    def _build_image_request(self, image_bytes, invoice_type=None):
+        """预处理图像并构造提示词和图片URL
+        
+        Args:
+            image_bytes: 图像的原始字节
+            invoice_type: 发票类型提示
+            
+        Returns:
+            Dict: 包含prompt、image_url、提取结构名称schema和max_tokens，失败时包含error字段
+        """
+        try:
+            # 验证图像是否有效，并在内存中完成必要的格式转换
+            image_bytes, mime_type = self.prepare_image_bytes(image_bytes)
+        except Exception as img_err:
+            print(f"图像验证失败: {str(img_err)}")
+            return {"error": f"图像验证失败: {str(img_err)}"}
+        
+        # 编码图像为base64，整个请求只编码这一次
+        try:
+            base64_image = self.encode_image_from_bytes(image_bytes)
+            print(f"成功将图片编码为base64, 长度: {len(base64_image)}")
+            
+            # 检查base64编码是否有效
+            if len(base64_image) < 100:
+                print(f"警告: base64编码长度过短，可能是空图像或编码错误: {len(base64_image)}")
+                return {"error": "图像编码异常，长度过短"}
+        except Exception as encode_err:
+            print(f"图像编码失败: {str(encode_err)}")
+            return {"error": f"图像编码失败: {str(encode_err)}"}
+        
+        # 按发票类型选择专用的提取结构和输出token预算
+        kind = schema_kind_for(invoice_type)
+        prompt = self._get_prompt_by_invoice_type(invoice_type)
+
+        print(f"使用提示词: {prompt}")
+        
+        # 构建图片URL（避免直接在代码中输出完整的base64编码）
+        image_url_with_prefix = f"data:{mime_type};base64,{base64_image}"
+        if len(image_url_with_prefix) > 100:
+            display_url = image_url_with_prefix[:50] + "..." + image_url_with_prefix[-20:]
         else:
-            return f"""
-            {base_prompt}
-            请识别这张发票/票据的类型，并提取关键信息，包括但不限于：
-            - 发票类型
-            - 发票号码
-            - 日期
-            - 金额/票价
-            - 发票内容/项目描述
-            - 其他关键信息
+            display_url = image_url_with_prefix
+        print(f"图片URL(部分): {display_url}")
+        
+        return {
+            "prompt": prompt,
+            "image_url": image_url_with_prefix,
+            "schema": kind,
+            "max_tokens": INVOICE_SCHEMAS[kind]['max_tokens']
+        }
+    
+    def _parse_completion(self, completion, kind='generic'):
+        """解析模型响应，提取JSON、还原中文字段并识别发票类型"""
+        print(f"API调用成功，开始处理响应...")
+        response_str = completion.model_dump_json()
+        response_dict = json.loads(response_str)
+        content = response_dict["choices"][0]["message"]["content"]
+        print(f"获取到响应内容: {content[:100]}...")
+        
+        # 解析JSON数据
+        extracted_info = expand_fields(kind, self.extract_json_from_markdown(content))
+        print(f"从响应中提取JSON数据: {extracted_info}")
+        
+        # 检查是否有错误
+        if isinstance(extracted_info, dict) and "error" in extracted_info:
+            return extracted_info
+        
+        return self._classify_extracted_info(extracted_info)
+    
+    def _classify_extracted_info(self, extracted_info):
+        """根据提取到的字段识别发票类型，写入发票类型字段"""
+        if isinstance(extracted_info, dict):
+            # 按专用结构提取的餐饮、打车、通行费票据已确定类型，交通和住宿票据仍需补充检查
+            if extracted_info.get('发票类型') in ('餐饮票据', '出租车票据', '高速通行费'):
+                return extracted_info
+
+            # 交通票据识别：检查是否有明确的交通相关属性
+            is_transport = False
+
+            # 交通结构的提取结果
+            if extracted_info.get('发票类型') == '交通票据':
+                is_transport = True
+            # 检查关键字段
+            elif extracted_info.get('起始站') and extracted_info.get('到站'):
+                is_transport = True
+            # 检查是否有其他交通相关字段
+            elif any(key in extracted_info for key in ['车次', '乘车日期', '开车时间', '座号', '列车号', '航班号', '车牌号']):
+                is_transport = True
+            # 检查是否有交通相关关键词
+            elif any(keyword in str(extracted_info) for keyword in ['火车', '高铁', '动车', '汽车', '客车', '飞机', '航班', '出租车', '公交']):
+                is_transport = True
+
+            if is_transport:
+                extracted_info['发票类型'] = '交通票据'
+                # 如果缺少起始站或到站信息，添加警告
+                if not extracted_info.get('起始站'):
+                    extracted_info['警告'] = extracted_info.get('警告', [])
+                    if isinstance(extracted_info['警告'], list):
+                        extracted_info['警告'].append('缺少起始站信息')
+                    else:
+                        extracted_info['警告'] = ['缺少起始站信息']
+                if not extracted_info.get('到站'):
+                    extracted_info['警告'] = extracted_info.get('警告', [])
+                    if isinstance(extracted_info['警告'], list):
+                        extracted_info['警告'].append('缺少到站信息')
+                    else:
+                        extracted_info['警告'] = ['缺少到站信息']
+            # 住宿票据识别逻辑
+            elif extracted_info.get('发票类型') == '住宿票据' or extracted_info.get('入住日期') or extracted_info.get('退房日期') or (extracted_info.get('日期') and ('酒店' in str(extracted_info) or '住宿' in str(extracted_info))):
+                extracted_info['发票类型'] = '住宿票据'
+
+                # 确保住宿票据有日期字段
+                if not extracted_info.get('日期') and (extracted_info.get('入住日期') or extracted_info.get('退房日期')):
+                    # 如果没有日期字段但有入住日期，将入住日期作为日期
+                    extracted_info['日期'] = extracted_info.get('入住日期', '')
+            else:
+                extracted_info['发票类型'] = '其他票据'
+
+        return extracted_info
+    
+    def _handle_api_error(self, api_error, invoice_type=None):
+        """模型调用失败时尝试使用备用方法提取信息"""
+        print(f"API调用过程中出错: {str(api_error)}")
+        import traceback
+        traceback.print_exc()
+        
+        # 尝试使用备用方法提取信息
+        try:
+            print("API调用失败，尝试使用本地备用方法提取信息...")
+            
+            # 使用OCR或其他备用方法提取文本
+            # 这里可以实现简单的备用提取逻辑
+            extracted_info = self._backup_extract_info(None, invoice_type)
+            if extracted_info:
+                print("成功使用备用方法提取信息")
+                return extracted_info
+        except Exception as backup_err:
+            print(f"备用方法也失败: {str(backup_err)}")
+        
+        return {"error": f"API调用失败: {str(api_error)}"}
+    
+    def _chat_kwargs(self, prompt, image_url, max_tokens, json_output, model=None):
+        """构造携带图像的模型调用参数，开启JSON模式时要求模型只输出JSON对象"""
+        kwargs = {
+            "model": model or self.model,  # 未指定时使用默认的通义千问大模型
+            "messages": [{"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]}],
+            "temperature": 0,  # 降低温度以获得更确定性的结果
+            "max_tokens": max_tokens  # 按发票类型限制输出token数，提高响应速度
+        }
+        if json_output and self.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+    
+    def _json_mode_rejected(self, kwargs, api_err):
+        """判断是否为服务端不支持response_format导致的错误，是则关闭JSON模式"""
+        message = str(api_err).lower()
+        if "response_format" not in kwargs or getattr(api_err, "status_code", None) != 400:
+            return False
+        if "response_format" not in message and "json" not in message:
+            return False
+        print(f"模型服务不支持JSON模式，改为普通输出: {str(api_err)}")
+        self.json_mode = False
+        kwargs.pop("response_format")
+        return True
+    
+    def _create_chat(self, client, prompt, image_url, max_tokens=1000, json_output=False, stream=False, model=None):
+        """发起一次携带图像的模型调用，服务端不支持JSON模式时去掉response_format重发"""
+        kwargs = self._chat_kwargs(prompt, image_url, max_tokens, json_output, model)
+        if stream:
+            kwargs["stream"] = True
+        try:
+            return client.chat.completions.create(**kwargs)
+        except Exception as api_err:
+            if not self._json_mode_rejected(kwargs, api_err):
+                raise
+            return client.chat.completions.create(**kwargs)
+    
+    async def _acreate_chat(self, client, prompt, image_url, max_tokens=1000, json_output=False, model=None):
+        """_create_chat的异步版本"""
+        kwargs = self._chat_kwargs(prompt, image_url, max_tokens, json_output, model)
+        try:
+            return await client.chat.completions.create(**kwargs)
+        except Exception as api_err:
+            if not self._json_mode_rejected(kwargs, api_err):
+                raise
+            return await client.chat.completions.create(**kwargs)
+    
+    def _chat_with_image(self, client, prompt, image_url, max_tokens=1000, json_output=False, model=None):
+        """携带图像调用多模态模型，网络错误时有限重试
+        
+        Args:
+            client: OpenAI客户端
+            prompt: 提示词
+            image_url: data URL格式的图像
+            max_tokens: 最大输出token数
+            json_output: 是否通过response_format要求模型只输出JSON
+            model: 使用的模型名称，为空时使用默认模型
+            
+        Returns:
+            模型返回的completion对象
+        """
+        max_retries = 2
+        for retry in range(max_retries + 1):
+            try:
+                return self._create_chat(client, prompt, image_url, max_tokens, json_output, model=model)
+            except Exception as api_err:
+                if retry < max_retries:
+                    wait_time = (retry + 1) * 2  # 逐渐增加等待时间
+                    print(f"API调用失败，第{retry+1}次重试，等待{wait_time}秒: {str(api_err)}")
+                    import time
+                    time.sleep(wait_time)
+                else:
+                    raise  # 最后一次重试仍失败，抛出异常
+    
+    async def _achat_with_image(self, client, prompt, image_url, max_tokens=1000, json_output=False, model=None):
+        """_chat_with_image的异步版本，重试等待不阻塞事件循环"""
+        max_retries = 2
+        for retry in range(max_retries + 1):
+            try:
+                return await self._acreate_chat(client, prompt, image_url, max_tokens, json_output, model=model)
+            except Exception as api_err:
+                if retry < max_retries:
+                    wait_time = (retry + 1) * 2
+                    print(f"API调用失败，第{retry+1}次重试，等待{wait_time}秒: {str(api_err)}")
+                    await asyncio.sleep(wait_time)
+                else:
+                    raise
+    
+    def recheck_fields(self, image_bytes, field_hints):
+        """只针对指定字段重新询问模型，用于与二维码等可靠来源不一致时的复核
+        
+        Args:
+            image_bytes: 图像的原始字节
+            field_hints: {字段名: 参考值或说明}，提示模型重点核对的字段
+            
+        Returns:
+            Dict: 模型复核后的字段值，失败时返回包含error的字典
+        """
+        try:
+            image_bytes, mime_type = self.prepare_image_bytes(image_bytes)
+            image_url = f"data:{mime_type};base64,{self.encode_image_from_bytes(image_bytes)}"
+            client = get_openai_client(base_url=MODEL_BASE_URL, api_key=self.api_key)
+            hints = "\n".join(f"- {field}: {hint}" for field, hint in field_hints.items())
+            prompt = f"""
+            请仔细核对图片中发票的以下字段，只读取票面上实际印刷的内容：
+            {hints}
+            请直接以JSON格式返回这些字段的票面值，不要有任何其他文字说明。
             """
+            completion = self._chat_with_image(client, prompt, image_url, max_tokens=200, json_output=True)
+            content = completion.choices[0].message.content
+            print(f"字段复核结果: {content}")
+            return self.extract_json_from_markdown(content)
+        except Exception as e:
+            print(f"字段复核失败: {str(e)}")
+            return {"error": f"字段复核失败: {str(e)}"}
+    
+    def _get_prompt_by_invoice_type(self, invoice_type=None):
+        """根据发票类型获取对应的提示语
+        
+        有明确类型时只要求输出该类型的字段，使用紧凑字段名以缩短输出；
+        没有类型提示时使用通用结构，由模型在kind字段中给出类型。
+        
+        Args:
+            invoice_type: 发票类型，如"火车票"、"机票"、"酒店住宿发票"等
+            
+        Returns:
+            str: 提示语
+        """
+        return build_schema_prompt(schema_kind_for(invoice_type))
     
     def _standardize_invoice_info(self, extracted_info, invoice_type=None):
         """标准化发票信息以符合系统需求
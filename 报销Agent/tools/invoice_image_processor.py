@@ -1,17 +1,58 @@
 import json
 import base64
-import tempfile
+import io
 import os
 import platform
-from typing import Dict, List, Any, Optional, Union
+from typing import Dict, List, Any, Optional, Tuple, Union
 # 确保CV2使用headless模式
 os.environ['OPENCV_HEADLESS'] = '1'
 import cv2
 import numpy as np
 from qwen_agent.tools.base import BaseTool, register_tool
-from config import OCR_CONFIG
+from config import OCR_CONFIG, PDF_CONFIG
+from tools.image_enhancer import enhance_image, enhance_images
+from tools.pdf_rasterizer import rasterize_pdf
 import fitz  # PyMuPDF
-from utils.helpers import validate_pdf_file
+from utils.helpers import decode_base64_data
+
+# 全电发票（数电票）及电子客票的二维码金额为价税合计，其余发票为不含税金额
+QR_TAX_INCLUSIVE_TYPES = {'31', '32', '51', '61', '83', '84', '85', '86', '87', '88'}
+
+
+def parse_invoice_qr_payload(payload: str) -> Optional[Dict[str, Any]]:
+    """解析发票二维码内容
+    
+    二维码格式: 01,发票种类代码,发票代码,发票号码,金额,开票日期(YYYYMMDD),校验码,随机码
+    
+    Args:
+        payload: 二维码解码得到的文本
+        
+    Returns:
+        Dict: 二维码中的发票字段（中文字段），格式不符时返回None
+    """
+    parts = [part.strip() for part in (payload or '').split(',')]
+    if len(parts) < 6 or parts[0] != '01':
+        return None
+    type_code, invoice_code, invoice_number, amount, issue_date = parts[1:6]
+    if not invoice_number.isdigit() or len(issue_date) != 8 or not issue_date.isdigit():
+        return None
+    try:
+        amount_value = float(amount)
+    except ValueError:
+        return None
+    
+    return {
+        '发票种类代码': type_code,
+        '发票代码': invoice_code,
+        '发票号码': invoice_number,
+        '金额': f'{amount_value:.2f}',
+        '金额含税': type_code in QR_TAX_INCLUSIVE_TYPES,
+        '日期': f'{issue_date[:4]}年{issue_date[4:6]}月{issue_date[6:]}日',
+        '校验码': parts[6] if len(parts) > 6 else ''
+    }
+
+# 作用于已解码图像数组的操作，可以用逗号连接依次执行，共用一次解码和一次编码
+IMAGE_OPERATIONS = {'rotate', 'enhance', 'detect_edges'}
 
 # 检测是否在Streamlit Cloud环境中运行
 is_streamlit_cloud = os.environ.get('STREAMLIT_RUNTIME_ENV') == 'cloud'
@@ -31,7 +72,9 @@ class InvoiceImageProcessor(BaseTool):
             'image_data': {'type': 'string', 'description': '图像的Base64编码或示例图像数据'},
             'file_type': {'type': 'string', 'description': '文件类型，如pdf、jpg、jpeg、png'},
             'invoice_type': {'type': 'string', 'description': '发票类型，如火车票、机票、酒店住宿发票等'},
-            'operation': {'type': 'string', 'description': '要执行的操作，如ocr、rotate、enhance、pdf_to_image、extract_info等'}
+            'operation': {'type': 'string', 'description': '要执行的操作，如ocr、rotate、enhance、detect_edges、enhance_batch、pdf_to_image、decode_qr、extract_info等；rotate、enhance、detect_edges可用逗号连接依次执行，如rotate,enhance'},
+            'enhance_mode': {'type': 'string', 'description': '图像增强方式：auto（默认，按图像质量自动选择）、none、fast或quality'},
+            'images': {'type': 'array', 'items': {'type': 'string'}, 'description': 'enhance_batch操作的图像Base64编码列表'}
         },
         'required': ['operation']
     }]
@@ -55,16 +98,17 @@ class InvoiceImageProcessor(BaseTool):
                 }, ensure_ascii=False)
             
             # 根据操作类型执行不同的图像处理
-            if operation == 'ocr':
+            operations = [op.strip() for op in operation.split(',') if op.strip()]
+            if operations and all(op in IMAGE_OPERATIONS for op in operations):
+                return self._process_image_operations(image_data, operations, image_params)
+            elif operation == 'ocr':
                 return self._process_ocr(image_data)
-            elif operation == 'rotate':
-                return self._process_rotate(image_data, image_params.get('angle', 90))
-            elif operation == 'enhance':
-                return self._process_enhance(image_data)
-            elif operation == 'detect_edges':
-                return self._process_detect_edges(image_data)
+            elif operation == 'enhance_batch':
+                return self._process_enhance_batch(image_params.get('images', []), image_params.get('enhance_mode'))
             elif operation == 'pdf_to_image':
                 return self._convert_pdf_to_image(image_data)
+            elif operation == 'decode_qr':
+                return self._process_decode_qr(image_data)
             elif operation == 'extract_info':
                 return self._extract_invoice_info(image_data, file_type, invoice_type)
             else:
@@ -104,7 +148,11 @@ class InvoiceImageProcessor(BaseTool):
         }, ensure_ascii=False)
     
     def _convert_pdf_to_image(self, pdf_data: str) -> str:
-        """将PDF文件转换为图像"""
+        """将PDF文件转换为图像
+        
+        PDF直接从内存打开，由渲染进程池按页面尺寸选择倍数渲染，
+        图像字节直接由pix.tobytes()得到，不经过临时文件。
+        """
         if not pdf_data:
             return json.dumps({
                 'status': 'error',
@@ -112,173 +160,66 @@ class InvoiceImageProcessor(BaseTool):
             }, ensure_ascii=False)
         
         try:
-            # 解码PDF数据
-            if ',' in pdf_data:
-                pdf_data = pdf_data.split(',')[1]
-            
-            # 修复Base64 padding问题
-            pdf_data = self._fix_base64_padding(pdf_data)
-            
-            try:
-                # 添加错误处理以验证base64数据是否有效
-                pdf_bytes = base64.b64decode(pdf_data)
-                print(f"成功解码PDF数据，大小: {len(pdf_bytes)} 字节")
-            except Exception as decode_err:
-                print(f"Base64解码PDF数据失败: {str(decode_err)}")
-                return json.dumps({
-                    'status': 'error',
-                    'message': f'Base64解码PDF数据失败: {str(decode_err)}'
-                }, ensure_ascii=False)
-            
-            # 创建临时PDF文件
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-                    temp_pdf.write(pdf_bytes)
-                    pdf_path = temp_pdf.name
-                print(f"已创建临时PDF文件: {pdf_path}")
-            except Exception as temp_err:
-                print(f"创建临时PDF文件失败: {str(temp_err)}")
-                return json.dumps({
-                    'status': 'error',
-                    'message': f'创建临时PDF文件失败: {str(temp_err)}'
-                }, ensure_ascii=False)
-            
-            # 验证PDF文件是否有效
-            if not validate_pdf_file(pdf_path):
-                print(f"无效的PDF文件: {pdf_path}")
-                return json.dumps({
-                    'status': 'error',
-                    'message': '无效的PDF文件，无法转换为图像'
-                }, ensure_ascii=False)
-            
-            # 尝试使用PyMuPDF打开PDF
-            try:
-                doc = fitz.open(pdf_path)
+            pdf_bytes = decode_base64_data(pdf_data)
+            print(f"成功解码PDF数据，大小: {len(pdf_bytes)} 字节")
+        except Exception as decode_err:
+            print(f"Base64解码PDF数据失败: {str(decode_err)}")
+            return json.dumps({
+                'status': 'error',
+                'message': f'Base64解码PDF数据失败: {str(decode_err)}'
+            }, ensure_ascii=False)
+        
+        try:
+            with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
                 page_count = len(doc)
-                print(f"成功打开PDF文件，页数: {page_count}")
-                
-                images = []
-                # 遍历每一页，转换为图像
-                for page_num in range(page_count):
-                    try:
-                        page = doc.load_page(page_num)
-                        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 使用2x缩放以获得更好的质量
-                        print(f"成功渲染第 {page_num+1} 页，尺寸: {pix.width}x{pix.height}")
-                        
-                        # 创建临时图像文件
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_img:
-                            temp_img_path = temp_img.name
-                        
-                        # 保存为图像文件
-                        pix.save(temp_img_path)
-                        print(f"成功保存第 {page_num+1} 页为临时图像: {temp_img_path}")
-                        
-                        # 读取图像并编码为Base64
-                        with open(temp_img_path, 'rb') as f:
-                            img_data = f.read()
-                            img_base64 = base64.b64encode(img_data).decode('utf-8')
-                            image_size = len(img_data)
-                            print(f"成功读取并编码图像，大小: {image_size} 字节")
-                            images.append(img_base64)
-                        
-                        # 删除临时图像文件
-                        os.unlink(temp_img_path)
-                        print(f"已删除临时图像文件: {temp_img_path}")
-                        
-                    except Exception as page_err:
-                        print(f"处理PDF第 {page_num+1} 页失败: {str(page_err)}")
-                        continue  # 继续处理下一页
-                
-                # 关闭PDF文档
-                doc.close()
-                
-                # 如果PyMuPDF方法没有生成任何图像，尝试使用pdf2image作为备选方案
-                if not images:
-                    print("PyMuPDF未能生成任何图像，尝试使用pdf2image...")
-                    images = self._convert_with_pdf2image(pdf_path)
-                
-                # 删除临时PDF文件
-                os.unlink(pdf_path)
-                print(f"已删除临时PDF文件: {pdf_path}")
-                
-                if not images:
-                    return json.dumps({
-                        'status': 'error',
-                        'message': '未能从PDF中提取任何图像'
-                    }, ensure_ascii=False)
-                
-                return json.dumps({
-                    'status': 'success',
-                    'message': f'成功将PDF转换为{len(images)}张图像',
-                    'images': images
-                }, ensure_ascii=False)
-                
-            except Exception as fitz_err:
-                print(f"使用PyMuPDF处理PDF失败，尝试使用pdf2image作为备选方案: {str(fitz_err)}")
-                
-                # 尝试使用pdf2image作为备选方案
-                images = self._convert_with_pdf2image(pdf_path)
-                
-                # 删除临时PDF文件
-                os.unlink(pdf_path)
-                print(f"已删除临时PDF文件: {pdf_path}")
-                
-                if not images:
-                    return json.dumps({
-                        'status': 'error',
-                        'message': '未能使用备选方法从PDF中提取任何图像'
-                    }, ensure_ascii=False)
-                
-                return json.dumps({
-                    'status': 'success',
-                    'message': f'使用备选方法成功将PDF转换为{len(images)}张图像',
-                    'images': images
-                }, ensure_ascii=False)
-            
-        except Exception as e:
-            print(f"PDF转换为图像的详细错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception as open_err:
+            print(f"PDF文件验证失败: {str(open_err)}")
+            page_count = 0
+        if not page_count:
+            return json.dumps({
+                'status': 'error',
+                'message': '无效的PDF文件，无法转换为图像'
+            }, ensure_ascii=False)
+        print(f"成功打开PDF文件，页数: {page_count}")
+        
+        try:
+            page_images = rasterize_pdf(pdf_bytes)
+            message = f'成功将PDF转换为{len(page_images)}张图像'
+        except Exception as fitz_err:
+            print(f"使用PyMuPDF处理PDF失败，尝试使用pdf2image作为备选方案: {str(fitz_err)}")
+            page_images = self._convert_with_pdf2image(pdf_bytes)
+            message = f'使用备选方法成功将PDF转换为{len(page_images)}张图像'
+        
+        if not page_images:
             return json.dumps({
                 'status': 'error',
-                'message': f'PDF转换为图像失败: {str(e)}'
+                'message': '未能从PDF中提取任何图像'
             }, ensure_ascii=False)
+        
+        images = [base64.b64encode(image_bytes).decode('utf-8') for image_bytes in page_images]
+        print(f"PDF已渲染为{len(images)}张图像，共{sum(len(image_bytes) for image_bytes in page_images)}字节")
+        return json.dumps({
+            'status': 'success',
+            'message': message,
+            'images': images
+        }, ensure_ascii=False)
     
-    def _convert_with_pdf2image(self, pdf_path: str) -> List[str]:
+    def _convert_with_pdf2image(self, pdf_bytes: bytes) -> List[bytes]:
         """使用pdf2image作为备选方案转换PDF为图像"""
         try:
-            from pdf2image import convert_from_path
-            
-            print(f"使用pdf2image处理: {pdf_path}")
-            images = []
+            from pdf2image import convert_from_bytes
             
-            # 将PDF转换为PIL图像
-            pil_images = convert_from_path(pdf_path, dpi=200)
+            # PyMuPDF无法读取页面尺寸时按配置的倍数渲染，未配置固定倍数时使用200dpi
+            dpi = int(72 * PDF_CONFIG['render_zoom']) if PDF_CONFIG['render_zoom'] > 0 else 200
+            pil_images = convert_from_bytes(pdf_bytes, dpi=dpi, last_page=PDF_CONFIG['max_pages'])
             print(f"pdf2image成功转换了{len(pil_images)}页")
             
-            # 将PIL图像转换为Base64
+            images = []
             for i, pil_image in enumerate(pil_images):
                 try:
-                    # 创建临时图像文件
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_img:
-                        temp_img_path = temp_img.name
-                    
-                    # 保存PIL图像
-                    pil_image.save(temp_img_path, format='PNG')
-                    print(f"成功保存第 {i+1} 页为临时图像: {temp_img_path}")
-                    
-                    # 读取图像并编码为Base64
-                    with open(temp_img_path, 'rb') as f:
-                        img_data = f.read()
-                        img_base64 = base64.b64encode(img_data).decode('utf-8')
-                        image_size = len(img_data)
-                        print(f"成功读取并编码图像，大小: {image_size} 字节")
-                        images.append(img_base64)
-                    
-                    # 删除临时图像文件
-                    os.unlink(temp_img_path)
-                    print(f"已删除临时图像文件: {temp_img_path}")
-                    
+                    buffer = io.BytesIO()
+                    pil_image.save(buffer, format=PDF_CONFIG['render_format'].upper().replace('JPG', 'JPEG'))
+                    images.append(buffer.getvalue())
                 except Exception as img_err:
                     print(f"处理pdf2image生成的第 {i+1} 页图像失败: {str(img_err)}")
                     continue
@@ -318,7 +259,7 @@ class InvoiceImageProcessor(BaseTool):
                 }, ensure_ascii=False)
             
             # 图像增强（可选）
-            # enhanced_image = self._enhance_image(image)
+            # enhanced_image, _ = enhance_image(image)
             
             # 这里需要实现自定义的发票识别逻辑
             # 为不同类型的发票提供不同的信息抽取实现
@@ -416,267 +357,222 @@ class InvoiceImageProcessor(BaseTool):
         import random
         return ''.join([str(random.randint(0, 9)) for _ in range(8)])
     
-    def _process_rotate(self, image_data: str, angle: int) -> str:
-        """旋转图像"""
+    def _process_image_operations(self, image_data: str, operations: List[str], image_params: Dict[str, Any]) -> str:
+        """在同一个解码后的图像数组上依次执行旋转、增强、边缘检测等操作，最后只编码一次"""
+        labels = {'rotate': '图像旋转', 'enhance': '图像增强', 'detect_edges': '边缘检测'}
+        first_label = labels[operations[0]]
         if not image_data:
             return json.dumps({
                 'status': 'error',
-                'message': '图像旋转失败：未提供图像数据'
+                'message': f'{first_label}失败：未提供图像数据'
             }, ensure_ascii=False)
         
-        try:
-            image = self._decode_image(image_data)
-            if image is None:
+        image = self._decode_image(image_data)
+        if image is None:
+            return json.dumps({
+                'status': 'error',
+                'message': '图像解码失败'
+            }, ensure_ascii=False)
+        
+        messages = []
+        result = {'status': 'success'}
+        for op in operations:
+            try:
+                if op == 'rotate':
+                    image, message = self._process_rotate(image, image_params.get('angle', 90))
+                elif op == 'enhance':
+                    image, message, result['enhance_mode'] = self._process_enhance(image, image_params.get('enhance_mode'))
+                else:
+                    image, message = self._process_detect_edges(image)
+            except Exception as e:
                 return json.dumps({
                     'status': 'error',
-                    'message': '图像解码失败'
+                    'message': f'{labels[op]}失败: {str(e)}'
                 }, ensure_ascii=False)
-            
-            # 定义旋转方式
-            if angle == 90:
-                rotated = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-            elif angle == 180:
-                rotated = cv2.rotate(image, cv2.ROTATE_180)
-            elif angle == 270:
-                rotated = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-            else:
-                # 对于非90度的倍数，使用更复杂的旋转方法
-                h, w = image.shape[:2]
-                center = (w // 2, h // 2)
-                M = cv2.getRotationMatrix2D(center, angle, 1.0)
-                rotated = cv2.warpAffine(image, M, (w, h))
-                
-            rotated_encoded = self._encode_image(rotated)
-            
-            return json.dumps({
-                'status': 'success',
-                'message': f'图像已旋转 {angle} 度',
-                'image_data': rotated_encoded
-            }, ensure_ascii=False)
-            
-        except Exception as e:
+            messages.append(message)
+        
+        result['message'] = '；'.join(messages)
+        result['image_data'] = self._encode_image(image)
+        return json.dumps(result, ensure_ascii=False)
+    
+    def _process_rotate(self, image: np.ndarray, angle: int) -> Tuple[np.ndarray, str]:
+        """旋转图像"""
+        # 定义旋转方式
+        if angle == 90:
+            rotated = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+        elif angle == 180:
+            rotated = cv2.rotate(image, cv2.ROTATE_180)
+        elif angle == 270:
+            rotated = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        else:
+            # 对于非90度的倍数，使用更复杂的旋转方法
+            h, w = image.shape[:2]
+            center = (w // 2, h // 2)
+            M = cv2.getRotationMatrix2D(center, angle, 1.0)
+            rotated = cv2.warpAffine(image, M, (w, h))
+        
+        return rotated, f'图像已旋转 {angle} 度'
+    
+    def _process_enhance(self, image: np.ndarray, mode: Optional[str] = None) -> Tuple[np.ndarray, str, str]:
+        """增强图像质量，返回增强后的图像、提示和实际使用的增强方式"""
+        enhanced, used_mode = enhance_image(image, mode)
+        if used_mode == 'none':
+            return enhanced, '图像质量良好，无需增强', used_mode
+        return enhanced, f'图像增强处理完成（{used_mode}），提高了对比度和清晰度', used_mode
+    
+    def _process_detect_edges(self, image: np.ndarray) -> Tuple[np.ndarray, str]:
+        """检测图像边缘"""
+        # 转换为灰度图
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        # 应用边缘检测
+        edges = cv2.Canny(gray, 100, 200)
+        
+        # 转回彩色以便显示
+        edges_color = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+        return edges_color, '图像边缘检测完成，有助于识别发票轮廓'
+    
+    def _process_enhance_batch(self, images_data: List[str], mode: Optional[str] = None) -> str:
+        """批量增强图像，多张图像分发到进程池并行处理"""
+        if not images_data:
             return json.dumps({
                 'status': 'error',
-                'message': f'图像旋转失败: {str(e)}'
+                'message': '批量图像增强失败：未提供图像数据'
             }, ensure_ascii=False)
-    
-    def _process_enhance(self, image_data: str) -> str:
-        """增强图像质量"""
-        if not image_data:
+        
+        images = [self._decode_image(image_data) for image_data in images_data]
+        valid_indexes = [index for index, image in enumerate(images) if image is not None]
+        if not valid_indexes:
             return json.dumps({
                 'status': 'error',
-                'message': '图像增强失败：未提供图像数据'
+                'message': '图像解码失败'
             }, ensure_ascii=False)
         
         try:
-            image = self._decode_image(image_data)
-            if image is None:
-                return json.dumps({
-                    'status': 'error',
-                    'message': '图像解码失败'
-                }, ensure_ascii=False)
-            
-            enhanced = self._enhance_image(image)
-            enhanced_encoded = self._encode_image(enhanced)
-            
-            return json.dumps({
-                'status': 'success',
-                'message': '图像增强处理完成，提高了对比度和清晰度',
-                'image_data': enhanced_encoded
-            }, ensure_ascii=False)
-            
+            enhanced = enhance_images([images[index] for index in valid_indexes], mode)
         except Exception as e:
             return json.dumps({
                 'status': 'error',
-                'message': f'图像增强失败: {str(e)}'
+                'message': f'批量图像增强失败: {str(e)}'
             }, ensure_ascii=False)
+        
+        results = [{'status': 'error', 'message': '图像解码失败'} for _ in images_data]
+        for index, (image, used_mode) in zip(valid_indexes, enhanced):
+            results[index] = {
+                'status': 'success',
+                'enhance_mode': used_mode,
+                'image_data': self._encode_image(image)
+            }
+        return json.dumps({
+            'status': 'success',
+            'message': f'成功增强{len(valid_indexes)}/{len(images_data)}张图像',
+            'results': results
+        }, ensure_ascii=False)
     
-    def _process_detect_edges(self, image_data: str) -> str:
-        """检测图像边缘"""
-        if not image_data:
+    def _process_decode_qr(self, image_data: str) -> str:
+        """识别发票二维码并返回其中的发票字段"""
+        image = self._decode_image(image_data)
+        if image is None:
             return json.dumps({
                 'status': 'error',
-                'message': '边缘检测失败：未提供图像数据'
+                'message': '图像解码失败'
             }, ensure_ascii=False)
         
-        try:
-            image = self._decode_image(image_data)
-            if image is None:
-                return json.dumps({
-                    'status': 'error',
-                    'message': '图像解码失败'
-                }, ensure_ascii=False)
-            
-            # 转换为灰度图
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # 应用边缘检测
-            edges = cv2.Canny(gray, 100, 200)
-            
-            # 转回彩色以便显示
-            edges_color = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-            edges_encoded = self._encode_image(edges_color)
-            
-            return json.dumps({
-                'status': 'success',
-                'message': '图像边缘检测完成，有助于识别发票轮廓',
-                'image_data': edges_encoded
-            }, ensure_ascii=False)
-            
-        except Exception as e:
+        qr_info = self.decode_invoice_qr(image)
+        if qr_info is None:
             return json.dumps({
                 'status': 'error',
-                'message': f'边缘检测失败: {str(e)}'
+                'message': '未识别到发票二维码'
             }, ensure_ascii=False)
+        return json.dumps({
+            'status': 'success',
+            'message': '成功识别发票二维码',
+            'qr_info': qr_info
+        }, ensure_ascii=False)
+    
+    def decode_invoice_qr(self, image: np.ndarray) -> Optional[Dict[str, Any]]:
+        """在已解码的图像数组上识别发票二维码
+        
+        先用标准检测器识别，失败时依次尝试Aruco检测器和放大后的图像，
+        小尺寸渲染图中的二维码模块过细时放大通常即可识别。
+        
+        Args:
+            image: OpenCV图像数组
+            
+        Returns:
+            Dict: 二维码中的发票字段，未识别到时返回None
+        """
+        detectors = [cv2.QRCodeDetector()]
+        if hasattr(cv2, 'QRCodeDetectorAruco'):
+            detectors.append(cv2.QRCodeDetectorAruco())
+        
+        candidates = [image]
+        if min(image.shape[:2]) < 1600:
+            candidates.append(cv2.resize(image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC))
+        
+        for candidate in candidates:
+            for detector in detectors:
+                try:
+                    payload, _, _ = detector.detectAndDecode(candidate)
+                except cv2.error as cv_err:
+                    print(f"二维码检测失败: {str(cv_err)}")
+                    continue
+                qr_info = parse_invoice_qr_payload(payload)
+                if qr_info:
+                    print(f"识别到发票二维码: 发票号码={qr_info['发票号码']}, 金额={qr_info['金额']}, 日期={qr_info['日期']}")
+                    return qr_info
+        return None
+    
+    def decode_invoice_qr_from_bytes(self, image_bytes: bytes) -> Optional[Dict[str, Any]]:
+        """从图像字节中识别发票二维码"""
+        image = self._decode_image_bytes(image_bytes)
+        if image is None:
+            return None
+        return self.decode_invoice_qr(image)
     
     def _decode_image(self, image_data: str) -> Optional[np.ndarray]:
         """解码Base64图像数据"""
+        # 检查输入数据
+        if not image_data:
+            print("图像解码失败: 未提供图像数据")
+            return None
+        
         try:
-            # 检查输入数据
-            if not image_data:
-                print("图像解码失败: 未提供图像数据")
-                return None
-                
-            # 移除可能的前缀，如 "data:image/jpeg;base64,"
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # 修复Base64 padding问题
-            image_data = self._fix_base64_padding(image_data)
-                
-            # 解码Base64
-            try:
-                image_bytes = base64.b64decode(image_data)
-                print(f"成功解码图像数据，大小: {len(image_bytes)} 字节")
-            except Exception as decode_err:
-                print(f"Base64解码图像数据失败: {str(decode_err)}")
-                return None
-            
-            # 创建临时文件
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                    temp_file.write(image_bytes)
-                    temp_path = temp_file.name
-                print(f"已创建临时图像文件: {temp_path}")
-            except Exception as temp_err:
-                print(f"创建临时图像文件失败: {str(temp_err)}")
-                return None
-            
-            # 检查临时文件是否存在且有效
-            if not os.path.exists(temp_path):
-                print(f"临时图像文件不存在: {temp_path}")
-                return None
-                
-            file_size = os.path.getsize(temp_path)
-            if file_size == 0:
-                print(f"临时图像文件为空: {temp_path}")
-                os.unlink(temp_path)
-                return None
-            
-            # 读取图像
-            try:
-                image = cv2.imread(temp_path)
-                
-                if image is None:
-                    print(f"OpenCV无法读取图像文件: {temp_path}")
-                    # 打印文件的前几个字节以帮助诊断
-                    with open(temp_path, 'rb') as f:
-                        header = f.read(20)
-                    print(f"文件头部字节: {header}")
-                else:
-                    print(f"成功读取图像，尺寸: {image.shape}")
-            except Exception as cv_err:
-                print(f"OpenCV读取图像失败: {str(cv_err)}")
-                os.unlink(temp_path)
-                return None
-            
-            # 删除临时文件
-            os.unlink(temp_path)
-            print(f"已删除临时图像文件: {temp_path}")
-            
-            return image
-        except Exception as e:
-            print(f"图像解码过程中发生未知错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            image_bytes = decode_base64_data(image_data)
+            print(f"成功解码图像数据，大小: {len(image_bytes)} 字节")
+        except Exception as decode_err:
+            print(f"Base64解码图像数据失败: {str(decode_err)}")
             return None
+        
+        return self._decode_image_bytes(image_bytes)
     
-    def _log_base64_debug_info(self, data: str) -> None:
-        """打印Base64编码的调试信息，帮助诊断问题"""
-        try:
-            # 打印长度
-            length = len(data)
-            print(f"Base64字符串长度: {length}")
-            print(f"除以4的余数: {length % 4}")
-            
-            # 检查是否包含非法字符
-            allowed_chars = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=')
-            illegal_chars = set(data) - allowed_chars
-            if illegal_chars:
-                print(f"发现非法字符: {illegal_chars}")
-            
-            # 检查填充情况
-            padding_count = data.count('=')
-            print(f"填充符数量: {padding_count}")
-            
-            # 打印前20个字符和后20个字符作为参考
-            print(f"前20个字符: {data[:20]}")
-            print(f"后20个字符: {data[-20:] if len(data) > 20 else data}")
-        except Exception as e:
-            print(f"打印Base64调试信息时出错: {str(e)}")
-            
-    def _fix_base64_padding(self, data: str) -> str:
-        """修复Base64编码的padding问题
+    def _decode_image_bytes(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """直接在内存中将图像字节解码为OpenCV数组"""
+        if not image_bytes:
+            print("图像解码失败: 图像数据为空")
+            return None
         
-        Base64编码的字符串长度应该是4的倍数，如果不是，需要添加=号作为填充
-        """
-        # 打印调试信息
-        self._log_base64_debug_info(data)
+        try:
+            # np.frombuffer不复制数据，cv2.imdecode直接从内存缓冲区解码
+            image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except Exception as cv_err:
+            print(f"OpenCV解码图像失败: {str(cv_err)}")
+            return None
         
-        # 修复padding
-        missing_padding = len(data) % 4
-        if missing_padding:
-            data += '=' * (4 - missing_padding)
-            print(f"已添加{4 - missing_padding}个'='字符作为填充")
-        return data
+        if image is None:
+            print(f"OpenCV无法解码图像数据，头部字节: {bytes(image_bytes[:20])}")
+        else:
+            print(f"成功读取图像，尺寸: {image.shape}")
+        return image
     
     def _encode_image(self, image: np.ndarray) -> str:
         """将图像编码为Base64"""
         try:
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                cv2.imwrite(temp_file.name, image)
-                temp_path = temp_file.name
-                
-            # 读取文件并编码为Base64
-            with open(temp_path, 'rb') as f:
-                encoded = base64.b64encode(f.read()).decode('utf-8')
-                
-            # 删除临时文件
-            os.unlink(temp_path)
-            
-            return encoded
+            success, buffer = cv2.imencode('.jpg', image)
+            if not success:
+                print("图像编码失败: OpenCV无法编码图像")
+                return ""
+            return base64.b64encode(buffer).decode('utf-8')
         except Exception as e:
             print(f"图像编码失败: {str(e)}")
             return ""
-    
-    def _enhance_image(self, image: np.ndarray) -> np.ndarray:
-        """增强图像质量"""
-        try:
-            # 转换为灰度图
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # 自适应直方图均衡
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(gray)
-            
-            # 去噪
-            denoised = cv2.fastNlMeansDenoising(enhanced, None, 10, 7, 21)
-            
-            # 转换回彩色
-            result = cv2.cvtColor(denoised, cv2.COLOR_GRAY2BGR)
-            
-            return result
-        except Exception as e:
-            print(f"图像增强失败: {str(e)}")
-            return image 
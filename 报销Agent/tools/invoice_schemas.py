@@ -0,0 +1,216 @@
+import json
+from typing import Dict, Any, List, Optional
+
+# 各类发票的提取结构：模型按紧凑字段名输出，解析后还原为中文字段名，
+# 供MMInvoiceProcessor._convert_to_system_format使用。
+# max_tokens按字段数量设定，足够输出完整JSON又避免模型生成多余内容。
+INVOICE_SCHEMAS = {
+    'transport': {
+        'description': '交通票据（火车票、机票或汽车票）',
+        'invoice_type': '交通票据',
+        'max_tokens': 320,
+        'fields': {
+            'no': '发票号码',
+            'dt': '日期',
+            'amt': '金额',
+            'from': '起始站',
+            'to': '到站',
+            'tdate': '乘坐日期',
+            'name': '乘客姓名',
+            'train': '车次',
+            'seat': '座号',
+            'tkt': '电子客票号',
+            'seller': '销售方名称',
+        },
+        'required': ['发票号码', '日期', '金额', '起始站', '到站', '乘坐日期'],
+    },
+    'hotel': {
+        'description': '酒店住宿发票',
+        'invoice_type': '住宿票据',
+        'max_tokens': 320,
+        'fields': {
+            'no': '发票号码',
+            'dt': '日期',
+            'amt': '金额',
+            'hotel': '酒店名称',
+            'seller': '销售方名称',
+            'cin': '入住日期',
+            'cout': '退房日期',
+            'nights': '住宿天数',
+            'guest': '住宿人姓名',
+            'room': '房间号',
+            'addr': '住宿地址',
+            'rate': '税率/征收率',
+        },
+        'required': ['发票号码', '日期', '金额', '酒店名称', '入住日期', '退房日期'],
+    },
+    'meal': {
+        'description': '餐饮发票',
+        'invoice_type': '餐饮票据',
+        'max_tokens': 200,
+        'fields': {
+            'no': '发票号码',
+            'dt': '日期',
+            'amt': '金额',
+            'seller': '销售方名称',
+            'item': '消费项目',
+            'people': '就餐人数',
+            'addr': '消费地址',
+        },
+        'required': ['发票号码', '日期', '金额', '销售方名称'],
+    },
+    'taxi': {
+        'description': '出租车或网约车发票',
+        'invoice_type': '出租车票据',
+        'max_tokens': 200,
+        'fields': {
+            'no': '发票号码',
+            'dt': '日期',
+            'amt': '金额',
+            'start': '起点',
+            'end': '终点',
+            'plate': '车牌号',
+            'km': '里程',
+            'seller': '销售方名称',
+        },
+        'required': ['发票号码', '金额', '起点', '终点'],
+    },
+    'toll': {
+        'description': '高速公路通行费发票',
+        'invoice_type': '高速通行费',
+        'max_tokens': 200,
+        'fields': {
+            'no': '发票号码',
+            'dt': '日期',
+            'amt': '金额',
+            'entry': '入口',
+            'exit': '出口',
+            'plate': '车牌号',
+            'seller': '销售方名称',
+        },
+        'required': ['发票号码', '日期', '金额'],
+    },
+    # 没有类型提示时使用，kind放在第一位，流式输出时可以尽早确定类型
+    'generic': {
+        'description': '发票或票据',
+        'invoice_type': None,
+        'max_tokens': 400,
+        'fields': {
+            'kind': '发票类型',
+            'no': '发票号码',
+            'dt': '日期',
+            'amt': '金额',
+            'seller': '销售方名称',
+            'from': '起始站',
+            'to': '到站',
+            'tdate': '乘坐日期',
+            'name': '乘客姓名',
+            'hotel': '酒店名称',
+            'cin': '入住日期',
+            'cout': '退房日期',
+            'start': '起点',
+            'end': '终点',
+            'item': '消费项目',
+        },
+        'required': None,
+    },
+}
+
+# 需要额外说明填写方式的字段
+FIELD_NOTES = {
+    '发票类型': 'transport/hotel/meal/taxi/toll/other之一',
+    '日期': '开票日期',
+    '金额': '价税合计小写金额，只写数字',
+    '乘坐日期': '乘车或乘机日期',
+    '住宿天数': '只写数字',
+}
+
+# 发票类型提示中的关键词与提取结构的对应关系，按顺序匹配
+SCHEMA_KEYWORDS = [
+    ('hotel', ['住宿', '酒店', 'hotel']),
+    ('taxi', ['打车', '出租', 'taxi']),
+    ('meal', ['餐', 'meal']),
+    ('toll', ['通行', 'toll']),
+    ('transport', ['火车', '机票', '汽车票', '交通', '客票', 'train', 'flight', 'transport']),
+]
+
+
+def schema_kind_for(invoice_type: Optional[str]) -> str:
+    """根据发票类型提示选择提取结构，无法判断时返回generic"""
+    hint = (invoice_type or '').lower()
+    for kind, keywords in SCHEMA_KEYWORDS:
+        if any(keyword in hint for keyword in keywords):
+            return kind
+    return 'generic'
+
+
+def build_schema_prompt(kind: str) -> str:
+    """生成指定提取结构的提示词
+
+    Args:
+        kind: 提取结构名称，见INVOICE_SCHEMAS
+
+    Returns:
+        str: 提示词
+    """
+    schema = INVOICE_SCHEMAS[kind]
+    field_lines = []
+    for key, name in schema['fields'].items():
+        note = FIELD_NOTES.get(name)
+        field_lines.append(f"- {key}: {name}（{note}）" if note else f"- {key}: {name}")
+    skeleton = json.dumps({key: '' for key in schema['fields']}, ensure_ascii=False)
+    fields_text = '\n'.join(field_lines)
+    return (
+        f"这是一张{schema['description']}，请提取票面信息，只输出一个JSON对象，字段名如下：\n"
+        f"{fields_text}\n"
+        "日期统一写成YYYY年MM月DD日。看不清或票面没有的字段填空字符串，不要猜测，不要输出其他文字。\n"
+        f"输出格式：{skeleton}"
+    )
+
+
+def expand_field(kind: str, key: str, value: Any):
+    """把单个紧凑字段还原为中文字段，不属于该结构的字段原样返回
+
+    Returns:
+        Tuple[str, Any]: 中文字段名和值
+    """
+    name = INVOICE_SCHEMAS[kind]['fields'].get(key, key)
+    if name == '发票类型':
+        value = (INVOICE_SCHEMAS.get(str(value).lower()) or {}).get('invoice_type') or '其他票据'
+    return name, value
+
+
+def expand_fields(kind: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """把模型输出的紧凑字段还原为中文字段，去掉空值并补充发票类型
+
+    Args:
+        kind: 提取结构名称
+        data: 模型输出的JSON对象
+
+    Returns:
+        Dict: 中文字段的提取结果
+    """
+    if not isinstance(data, dict) or 'error' in data:
+        return data
+    expanded = {}
+    for key, value in data.items():
+        if value in (None, ''):
+            continue
+        name, value = expand_field(kind, key, value)
+        expanded[name] = value
+    invoice_type = INVOICE_SCHEMAS[kind]['invoice_type']
+    if invoice_type:
+        expanded['发票类型'] = invoice_type
+    return expanded
+
+
+def required_fields_for(kind: str, fields: Dict[str, Any]) -> Optional[List[str]]:
+    """返回流式提取时可以提前结束生成的必需字段，尚无法确定类型时返回None
+
+    Args:
+        kind: 提取结构名称
+        fields: 已生成的中文字段
+    """
+    if kind == 'generic':
+        kind = schema_kind_for(fields.get('发票类型'))
+    return INVOICE_SCHEMAS[kind]['required']
@@ -0,0 +1,115 @@
+import datetime
+import re
+from typing import Dict, Any, Iterable, List, Optional
+from config import EXTRACTION_CONFIG
+from tools.invoice_schemas import INVOICE_SCHEMAS, schema_kind_for
+
+# 发票号码的合法格式：数电票20位，传统发票8位；交通票据还可能是字母数字混合的票号
+INVOICE_NUMBER_PATTERNS = {
+    'default': re.compile(r'^(\d{8}|\d{20})$'),
+    'transport': re.compile(r'^(\d{8}|\d{20}|[A-Z0-9]{7,21})$'),
+}
+
+# 需要检查的日期字段及允许晚于当天的天数（开票日期不能晚于当天，乘车、入住等可以提前开具）
+DATE_FIELDS = {
+    '日期': 1,
+    '乘坐日期': 180,
+    '入住日期': 180,
+    '退房日期': 180,
+}
+
+DATE_PATTERN = re.compile(r'(\d{4})\s*[年\-/.]?\s*(\d{1,2})\s*[月\-/.]?\s*(\d{1,2})')
+
+
+def parse_invoice_date(text: Any) -> Optional[datetime.date]:
+    """解析YYYY年MM月DD日、YYYY-MM-DD、YYYYMMDD等格式的日期，不是真实日期时返回None"""
+    match = DATE_PATTERN.search(str(text or ''))
+    if not match:
+        return None
+    try:
+        return datetime.date(*(int(part) for part in match.groups()))
+    except ValueError:
+        return None
+
+
+def parse_invoice_amount(value: Any) -> Optional[float]:
+    """解析金额，去掉货币符号和千分位，无法解析时返回None"""
+    text = re.sub(r'[^\d.\-]', '', str(value if value is not None else ''))
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+class InvoiceValidator:
+    """模型提取结果校验器
+
+    检查金额为正数、日期真实且在合理范围内、发票号码位数正确、
+    所属类型的必需字段齐全。校验不通过的结果由级联中的下一级模型重新提取。
+    """
+
+    def __init__(self, date_window_days: Optional[int] = None, max_amount: Optional[float] = None):
+        self.date_window_days = date_window_days or EXTRACTION_CONFIG['date_window_days']
+        self.max_amount = max_amount or EXTRACTION_CONFIG['max_amount']
+
+    def validate(self,
+                 extracted_info: Dict[str, Any],
+                 invoice_type: Optional[str] = None,
+                 skip_fields: Iterable[str] = ()) -> List[str]:
+        """校验中文字段的提取结果
+
+        Args:
+            extracted_info: 模型提取结果（中文字段）
+            invoice_type: 发票类型提示，用于确定必需字段
+            skip_fields: 不需要校验的字段，如已由二维码确定的字段
+
+        Returns:
+            List[str]: 发现的问题，为空表示校验通过
+        """
+        if not isinstance(extracted_info, dict):
+            return ['提取结果不是JSON对象']
+        if 'error' in extracted_info:
+            return [str(extracted_info['error'])]
+        if str(extracted_info.get('备注', '')).startswith('由备用方法生成'):
+            return ['模型调用失败，结果由备用方法生成']
+
+        skip_fields = set(skip_fields)
+        kind = schema_kind_for(invoice_type or extracted_info.get('发票类型'))
+        problems = []
+
+        required = INVOICE_SCHEMAS[kind]['required'] or ['发票号码', '日期', '金额']
+        for field in required:
+            if field not in skip_fields and not extracted_info.get(field):
+                problems.append(f'缺少{field}')
+
+        if '金额' not in skip_fields and extracted_info.get('金额'):
+            amount = parse_invoice_amount(extracted_info['金额'])
+            if amount is None:
+                problems.append(f"金额无法解析: {extracted_info['金额']}")
+            elif amount <= 0 or amount > self.max_amount:
+                problems.append(f'金额超出合理范围: {amount}')
+
+        if '发票号码' not in skip_fields and extracted_info.get('发票号码'):
+            number = re.sub(r'\s', '', str(extracted_info['发票号码'])).upper()
+            pattern = INVOICE_NUMBER_PATTERNS.get(kind, INVOICE_NUMBER_PATTERNS['default'])
+            if not pattern.match(number):
+                problems.append(f'发票号码位数不正确: {number}')
+
+        today = datetime.date.today()
+        earliest = today - datetime.timedelta(days=self.date_window_days)
+        dates = {}
+        for field, future_days in DATE_FIELDS.items():
+            if field in skip_fields or not extracted_info.get(field):
+                continue
+            date = parse_invoice_date(extracted_info[field])
+            if date is None:
+                problems.append(f'{field}不是有效日期: {extracted_info[field]}')
+            elif not earliest <= date <= today + datetime.timedelta(days=future_days):
+                problems.append(f'{field}超出合理范围: {date.isoformat()}')
+            else:
+                dates[field] = date
+
+        if '入住日期' in dates and '退房日期' in dates and dates['入住日期'] > dates['退房日期']:
+            problems.append('入住日期晚于退房日期')
+
+        return problems
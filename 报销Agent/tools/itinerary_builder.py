@@ -0,0 +1,206 @@
+import datetime
+import re
+from typing import Dict, Any, List, Optional
+from config import ITINERARY_CONFIG
+from tools.gazetteer import canonical_place
+from tools.invoice_validator import parse_invoice_date
+from tools.trip_matcher import TRANSPORT_INVOICE_TYPES
+
+TRANSPORTATION_NAMES = {'火车票': '火车', '机票': '飞机', '汽车票': '汽车'}
+
+# 原始提取结果中的出发时间字段：火车票文本层和提取提示词使用开车时间，机票为起飞时间
+DEPARTURE_TIME_KEYS = ['开车时间', '发车时间', '起飞时间', '乘坐时间']
+
+TIME_PATTERN = re.compile(r'(\d{1,2})\s*[:：时]\s*(\d{2})')
+
+
+def _raw_info(invoice: Dict[str, Any]) -> Dict[str, Any]:
+    """取出发票的原始提取字段，兼容标准化发票和直接的提取结果"""
+    raw = invoice.get('raw_extracted_info')
+    if not raw and isinstance(invoice.get('extracted_info'), dict):
+        raw = invoice['extracted_info'].get('raw_extracted_info')
+    return raw or {}
+
+
+def extract_legs(invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把交通票据转换为按时间排序的行程段
+
+    出发地、到达地通过地名对照表归一为城市，缺少出发地、到达地或乘车日期的票据不参与行程重建。
+
+    Args:
+        invoices: 发票列表，支持标准化后的发票（departure、destination、travel_date）
+                  和原始提取结果（起始站、到站、乘坐日期）
+
+    Returns:
+        List[Dict]: 行程段，包含invoice_index、departure、destination、date、time、transportation
+    """
+    legs = []
+    for index, invoice in enumerate(invoices):
+        invoice_type = invoice.get('invoice_type', '')
+        if invoice_type not in TRANSPORT_INVOICE_TYPES:
+            continue
+        raw = _raw_info(invoice)
+        departure = canonical_place(invoice.get('departure') or raw.get('起始站', ''))
+        destination = canonical_place(invoice.get('destination') or raw.get('到站', ''))
+        travel_date = parse_invoice_date(invoice.get('travel_date') or raw.get('乘坐日期') or invoice.get('date'))
+        if not departure or not destination or travel_date is None or departure == destination:
+            continue
+        departure_time = invoice.get('departure_time') or next((raw[key] for key in DEPARTURE_TIME_KEYS if raw.get(key)), '')
+        time_match = TIME_PATTERN.search(str(departure_time))
+        legs.append({
+            'invoice_index': index,
+            'departure': departure,
+            'destination': destination,
+            'date': travel_date,
+            'time': f'{int(time_match.group(1)):02d}:{time_match.group(2)}' if time_match else '',
+            'transportation': TRANSPORTATION_NAMES.get(invoice_type, invoice_type)
+        })
+    legs.sort(key=lambda leg: (leg['date'], leg['time'] or '99:99', leg['invoice_index']))
+    return legs
+
+
+def _trip_record(departure_place: str, arrival_place: str,
+                 departure_date: datetime.date, arrival_date: datetime.date,
+                 transportation: str, round_trip: bool) -> Dict[str, Any]:
+    """生成与行程录入工具相同格式的行程记录"""
+    return {
+        'departure_date': departure_date.isoformat(),
+        'arrival_date': arrival_date.isoformat(),
+        'days': (arrival_date - departure_date).days + 1,
+        'departure_place': departure_place,
+        'arrival_place': arrival_place,
+        'transportation': transportation,
+        'trip_purpose': '',
+        'round_trip': round_trip
+    }
+
+
+class ItineraryBuilder:
+    """根据交通票据重建出差行程
+
+    行程段按乘车日期和时间排序后从常驻地出发依次串联，回到常驻地时一次出差结束。
+    途中经过的城市用栈记录：从A到B再回到A形成一条往返行程记录，嵌套的往返（福州→上海→杭州→上海→福州）
+    拆分为福州⇄上海和上海⇄杭州两条记录，与行程匹配器的去程、回程一一对应。
+    下一段的出发地与当前所在城市不同时记为缺口（开口行程，中间换乘未提供票据或自行前往），
+    未回到常驻地或间隔超过配置天数的视为另一次出差。
+    """
+
+    def __init__(self, home_city: Optional[str] = None, max_gap_days: Optional[int] = None):
+        self.home_city = home_city or ITINERARY_CONFIG['home_city']
+        self.max_gap_days = max_gap_days or ITINERARY_CONFIG['max_gap_days']
+
+    def build(self, invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """重建行程
+
+        Args:
+            invoices: 发票列表，格式同extract_legs
+
+        Returns:
+            Dict: home_city为常驻地；trips为每次出差的起止日期、天数、途经城市、
+                  使用的发票序号、是否回到常驻地和缺口；trip_records为可直接作为行程列表使用的行程记录
+        """
+        legs = extract_legs(invoices)
+        if not legs:
+            return {'home_city': self.home_city, 'trips': [], 'trip_records': []}
+        # 未配置常驻地时，以最早一段行程的出发地为常驻地
+        home_city = canonical_place(self.home_city) if self.home_city else legs[0]['departure']
+
+        trips = []
+        current = None
+        pending = list(legs)
+        while pending:
+            location = current['stack'][-1]['city'] if current else home_city
+            leg = self._next_leg(pending, location)
+            pending.remove(leg)
+
+            if current and (leg['date'] - current['legs'][-1]['date']).days > self.max_gap_days:
+                trips.append(self._close_trip(current, home_city))
+                current = None
+            if current is None:
+                current = {'stack': [{'city': home_city}], 'legs': [], 'records': [], 'gaps': []}
+            self._apply_leg(current, leg, home_city)
+            if len(current['stack']) == 1:
+                trips.append(self._close_trip(current, home_city))
+                current = None
+        if current:
+            trips.append(self._close_trip(current, home_city))
+
+        trip_records = [record for trip in trips for record in trip['records']]
+        print(f"行程重建: 常驻地{home_city}，{len(legs)}段行程组成{len(trips)}次出差，"
+              f"生成{len(trip_records)}条行程记录")
+        return {'home_city': home_city, 'trips': trips, 'trip_records': trip_records}
+
+    def _next_leg(self, pending: List[Dict[str, Any]], location: str) -> Dict[str, Any]:
+        """取下一段行程；同一天且没有发车时间的多段行程，优先取从当前所在城市出发的一段"""
+        first = pending[0]
+        if first['time'] or first['departure'] == location:
+            return first
+        for leg in pending[1:]:
+            if leg['date'] != first['date']:
+                break
+            if not leg['time'] and leg['departure'] == location:
+                return leg
+        return first
+
+    def _apply_leg(self, trip: Dict[str, Any], leg: Dict[str, Any], home_city: str) -> None:
+        stack = trip['stack']
+        trip['legs'].append(leg)
+        if leg['departure'] != stack[-1]['city']:
+            trip['gaps'].append({'from': stack[-1]['city'], 'to': leg['departure'], 'date': leg['date'].isoformat()})
+            if len(stack) == 1:
+                # 第一段不是从常驻地出发，去程票据缺失
+                stack.append({'city': leg['departure'], 'arrived': leg['departure'], 'in_leg': None})
+            else:
+                stack[-1]['city'] = leg['departure']
+
+        # 到达栈中已有的城市时，回到该城市，途经的城市依次出栈
+        target = next((position for position in range(len(stack) - 2, -1, -1)
+                       if stack[position]['city'] == leg['destination']), None)
+        if target is None:
+            stack.append({'city': leg['destination'], 'arrived': leg['destination'], 'in_leg': leg})
+            return
+        popped = stack[target + 1:]
+        del stack[target + 1:]
+        parent_city = stack[target]['city']
+        for frame in reversed(popped[1:]):
+            self._add_outbound_record(trip, frame, leg['date'])
+        frame = popped[0]
+        if len(popped) == 1 and frame['in_leg'] and frame['arrived'] == leg['departure']:
+            trip['records'].append(_trip_record(parent_city, frame['arrived'], frame['in_leg']['date'], leg['date'],
+                                                frame['in_leg']['transportation'], True))
+        else:
+            self._add_outbound_record(trip, frame, leg['date'])
+            trip['records'].append(_trip_record(leg['departure'], leg['destination'], leg['date'], leg['date'],
+                                                leg['transportation'], False))
+
+    def _add_outbound_record(self, trip: Dict[str, Any], frame: Dict[str, Any], end_date: datetime.date) -> None:
+        """为没有对应回程的到达段生成单程记录，行程天数计到离开该城市的日期"""
+        in_leg = frame['in_leg']
+        if in_leg is None:
+            return
+        trip['records'].append(_trip_record(in_leg['departure'], frame['arrived'], in_leg['date'], end_date,
+                                            in_leg['transportation'], False))
+
+    def _close_trip(self, trip: Dict[str, Any], home_city: str) -> Dict[str, Any]:
+        """结束一次出差，未回到常驻地的到达段记为单程"""
+        legs = trip['legs']
+        start_date, end_date = legs[0]['date'], legs[-1]['date']
+        closed = len(trip['stack']) == 1
+        for frame in reversed(trip['stack'][1:]):
+            self._add_outbound_record(trip, frame, end_date)
+        cities = []
+        for leg in legs:
+            for city in (leg['departure'], leg['destination']):
+                if city != home_city and city not in cities:
+                    cities.append(city)
+        trip['records'].sort(key=lambda record: record['departure_date'])
+        return {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'days': (end_date - start_date).days + 1,
+            'cities': cities,
+            'invoice_indexes': [leg['invoice_index'] for leg in legs],
+            'returned_home': closed,
+            'gaps': trip['gaps'],
+            'records': trip['records']
+        }
@@ -1,10 +1,45 @@
 import json
-import base64
-import tempfile
+import re
+import asyncio
+import binascii
 import os
-from typing import Dict, List, Any, Optional, Union
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Any, Iterator, Optional, Union
 from qwen_agent.tools.base import BaseTool, register_tool
-from tools.invoice_extractor import InvoiceExtractor
+from tools.invoice_extractor import InvoiceExtractor, PROMPT_VERSION
+from tools.pdf_text_extractor import PDFTextExtractor
+from tools.einvoice_parser import EInvoiceParser
+from tools.invoice_image_processor import InvoiceImageProcessor
+from tools.invoice_classifier import InvoiceClassifier
+from tools.model_cascade import ModelCascade
+from tools.pdf_rasterizer import render_pdf_page
+from tools.extraction_cache import get_extraction_cache
+from tools.duplicate_index import get_duplicate_index, content_digest, compute_phash
+from tools.file_registry import get_file_registry
+from utils.helpers import decode_base64_data
+
+# 流式提取时模型输出的中文字段与系统字段的对应关系
+STREAM_FIELD_MAP = {
+    '发票号码': 'invoice_id',
+    '日期': 'date',
+    '金额': 'amount',
+    '起始站': 'departure',
+    '到站': 'destination',
+    '乘客姓名': 'passenger',
+    '电子客票号': 'ticket_number',
+    '乘坐日期': 'travel_date',
+    '酒店名称': 'hotel_name',
+    '入住日期': 'check_in_date',
+    '退房日期': 'check_out_date',
+    '住宿人姓名': 'guest_name',
+    '住宿地址': 'hotel_address',
+    '房间号': 'room_number',
+    '起点': 'start_location',
+    '终点': 'end_location',
+    '车牌号': 'taxi_number',
+}
+
 
 @register_tool('mm_invoice_processor')
 class MMInvoiceProcessor(BaseTool):
@@ -16,83 +51,116 @@ class MMInvoiceProcessor(BaseTool):
         'type': 'object',
         'description': '发票处理参数',
         'properties': {
-            'image_data': {'type': 'string', 'description': '图像的Base64编码数据'},
-            'file_type': {'type': 'string', 'description': '文件类型，如jpg、jpeg、png'},
+            'file_id': {'type': 'string', 'description': '上传文件的文件ID（如file_3f2a...），由系统在用户消息中提供，优先使用'},
+            'image_data': {'type': 'string', 'description': '图像或PDF文件的Base64编码数据，没有文件ID时使用'},
+            'file_type': {'type': 'string', 'description': '文件类型，如jpg、jpeg、png、pdf、ofd、xml，使用文件ID时可省略'},
             'invoice_type': {'type': 'string', 'description': '发票类型提示，如火车票、机票、酒店住宿发票等'},
+            'file_name': {'type': 'string', 'description': '原始文件名，如上海到杭州.pdf，用于预判发票类型'},
             'operation': {'type': 'string', 'description': '要执行的操作，如extract_info'}
         },
-        'required': ['image_data', 'operation']
+        'required': ['operation']
     }]
     
     def __init__(self, tool_cfg=None):
         super().__init__(tool_cfg)
         self.invoice_extractor = InvoiceExtractor()
+        self.pdf_text_extractor = PDFTextExtractor()
+        self.einvoice_parser = EInvoiceParser()
+        self.image_processor = InvoiceImageProcessor()
+        self.classifier = InvoiceClassifier()
+        self.cascade = ModelCascade(self.invoice_extractor)
+        self.cache = get_extraction_cache()
+        self.duplicate_index = get_duplicate_index()
+        # 可选的模型调用限流器，只在真正调用大模型时占用名额（文本层和缓存命中不占用）
+        self.rate_limiter = None
     
-    def call(self, params: str, **kwargs) -> str:
-        """处理发票图像，提取信息"""
+    def extract_from_bytes(self, file_bytes: bytes, file_type: str, invoice_type: Optional[str] = None,
+                           file_name: Optional[str] = None) -> Dict[str, Any]:
+        """直接从文件字节提取发票信息，省去base64编解码
+        
+        Args:
+            file_bytes: 图像或PDF文件的原始字节
+            file_type: 文件类型
+            invoice_type: 发票类型提示
+            file_name: 原始文件名，用于预判发票类型
+            
+        Returns:
+            Dict: 包含status、message、invoice_info的处理结果
+        """
+        return json.loads(self._extract_invoice_info(file_bytes, file_type, invoice_type, file_name))
+    
+    def extract_stream(self, file_bytes: bytes, file_type: str, invoice_type: Optional[str] = None,
+                       file_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """流式提取发票信息，模型每写完一个字段就返回对应的系统字段，便于界面提前填充
+        
+        结构化电子发票、PDF文本层和缓存命中时不调用模型，一次性返回全部字段。
+        流式返回的字段尚未经过二维码校验，以最后的result事件为准。
+        
+        Args:
+            file_bytes: 图像或PDF文件的原始字节
+            file_type: 文件类型
+            invoice_type: 发票类型提示
+            file_name: 原始文件名，用于预判发票类型
+            
+        Yields:
+            Dict: {'type': 'field', 'key': 系统字段名, 'value': 值}，
+                最后一个为{'type': 'result', 'status': ..., 'message': ..., 'invoice_info': ...}
+        """
         try:
-            # 不打印整个参数，而是打印简短摘要
-            print(f"mm_invoice_processor被调用，正在处理参数...")
-            
-            # 解析参数
-            process_params = json.loads(params)['process_params']
-            operation = process_params.get('operation', '')
-            image_data = process_params.get('image_data', '')
-            file_type = process_params.get('file_type', 'jpg')
-            invoice_type = process_params.get('invoice_type', None)
-            
-            # 打印图像数据长度而不是内容
-            image_data_length = len(image_data) if image_data else 0
-            print(f"操作: {operation}, 文件类型: {file_type}, 发票类型提示: {invoice_type}, 图像数据长度: {image_data_length}字节")
-            
-            if not operation:
-                print("错误: 未指定处理操作")
-                return json.dumps({
-                    'status': 'error',
-                    'message': '未指定处理操作'
-                }, ensure_ascii=False)
-                
-            if not image_data:
-                print("错误: 未提供图像数据")
-                return json.dumps({
-                    'status': 'error',
-                    'message': '未提供图像数据'
-                }, ensure_ascii=False)
+            finished_result, context = self._prepare_extraction(file_bytes, file_type, invoice_type, file_name)
+            if finished_result:
+                result = json.loads(finished_result)
+                for key, value in (result.get('invoice_info') or {}).items():
+                    if key != 'raw_extracted_info':
+                        yield {'type': 'field', 'key': key, 'value': value}
+                yield {'type': 'result', **result}
+                return
             
-            # 验证base64数据的有效性
-            if image_data.startswith("[") and image_data.endswith("]"):
-                print("错误: 收到的似乎是描述文本而不是实际的base64数据")
-                return json.dumps({
-                    'status': 'error',
-                    'message': '图像数据无效，收到的是描述性文本而非base64编码'
-                }, ensure_ascii=False)
-                
-            # 检查是否包含有效的base64字符
-            import re
-            if not re.match(r'^[A-Za-z0-9+/=,]+$', image_data):
-                print("警告: 图像数据包含非标准base64字符")
-                # 打印一些字符用于调试
-                if len(image_data) > 20:
-                    print(f"数据前20个字符: {image_data[:20]}")
-                else:
-                    print(f"数据内容: {image_data}")
+            extracted_info = {'error': '模型未返回提取结果'}
+            models = context['models']
+            with self.rate_limiter.acquire() if self.rate_limiter else nullcontext():
+                # 第一级模型流式输出，未通过校验时由后续级别的模型重新提取
+                start = time.perf_counter()
+                for event in self.invoice_extractor.extract_info_stream(context['image_bytes'], context['invoice_type'],
+                                                                        model=models[0]):
+                    if event['type'] == 'done':
+                        extracted_info = event['extracted_info']
+                        continue
+                    system_key = STREAM_FIELD_MAP.get(event['key'])
+                    if not system_key:
+                        continue
+                    value = event['value']
+                    if system_key == 'amount':
+                        value = self._extract_amount({'金额': value})
+                    yield {'type': 'field', 'key': system_key, 'value': value}
                 
-                return json.dumps({
-                    'status': 'error',
-                    'message': '图像数据包含非标准base64字符，请提供有效的base64编码字符串'
-                }, ensure_ascii=False)
+                problems = self.cascade.check(models[0], context['start_tier'], extracted_info, time.perf_counter() - start,
+                                              context['invoice_type'], context['trusted_fields'])
+                if problems and len(models) > 1:
+                    extracted_info = self.cascade.run(context['image_bytes'], context['invoice_type'], models[1:],
+                                                      context['trusted_fields'], context['start_tier'] + 1)
             
-            # 执行对应操作
-            if operation == 'extract_info':
-                result = self._extract_invoice_info(image_data, file_type, invoice_type)
-                print(f"提取结果状态: {json.loads(result).get('status', 'unknown')}")
-                return result
-            else:
-                print(f"错误: 不支持的操作: {operation}")
-                return json.dumps({
-                    'status': 'error',
-                    'message': f'不支持的操作：{operation}'
-                }, ensure_ascii=False)
+            print(f"流式提取完成，结果: {extracted_info}")
+            result = self._finish_extraction(extracted_info, context, invoice_type)
+        except Exception as e:
+            print(f"流式提取发票信息失败: {str(e)}")
+            result = json.dumps({
+                'status': 'error',
+                'message': f'提取发票信息失败: {str(e)}'
+            }, ensure_ascii=False)
+        yield {'type': 'result', **json.loads(result)}
+    
+    def call(self, params: str, **kwargs) -> str:
+        """处理发票图像，提取信息"""
+        try:
+            error_result, request = self._parse_request(params)
+            if error_result:
+                return error_result
+            
+            result = self._extract_invoice_info(request['image_bytes'], request['file_type'],
+                                                request['invoice_type'], request['file_name'])
+            print(f"提取结果状态: {json.loads(result).get('status', 'unknown')}")
+            return result
                 
         except Exception as e:
             print(f"处理发票图像失败: {str(e)}")
@@ -103,172 +171,390 @@ class MMInvoiceProcessor(BaseTool):
                 'message': f'处理发票图像失败: {str(e)}'
             }, ensure_ascii=False)
     
-    def _extract_invoice_info(self, image_data: str, file_type: str, invoice_type: Optional[str] = None) -> str:
+    async def acall(self, params: str, **kwargs) -> str:
+        """call的异步版本，等待模型响应期间不阻塞事件循环
+        
+        异步路径不使用rate_limiter（其为线程阻塞式），并发上限由调用方控制，
+        如BatchInvoiceExtractor.extract_batch_async。
+        """
+        try:
+            error_result, request = self._parse_request(params)
+            if error_result:
+                return error_result
+            
+            result = await self._aextract_invoice_info(request['image_bytes'], request['file_type'],
+                                                       request['invoice_type'], request['file_name'])
+            print(f"提取结果状态: {json.loads(result).get('status', 'unknown')}")
+            return result
+        
+        except Exception as e:
+            print(f"异步处理发票图像失败: {str(e)}")
+            return json.dumps({
+                'status': 'error',
+                'message': f'处理发票图像失败: {str(e)}'
+            }, ensure_ascii=False)
+    
+    def _parse_request(self, params: str):
+        """解析并校验调用参数，按文件ID从文件登记表取回文件字节，或一次性解码base64数据
+        
+        Returns:
+            Tuple[Optional[str], Dict]: 参数无效时返回错误JSON，否则返回None和包含image_bytes、file_type、invoice_type、file_name的请求
+        """
+        # 不打印整个参数，而是打印简短摘要
+        print(f"mm_invoice_processor被调用，正在处理参数...")
+        
+        # 解析参数
+        process_params = json.loads(params)['process_params']
+        operation = process_params.get('operation', '')
+        file_id = process_params.get('file_id', '')
+        image_data = process_params.get('image_data', '')
+        file_type = process_params.get('file_type', None)
+        invoice_type = process_params.get('invoice_type', None)
+        file_name = process_params.get('file_name', None)
+        
+        # 打印图像数据长度而不是内容
+        image_data_length = len(image_data) if image_data else 0
+        print(f"操作: {operation}, 文件ID: {file_id}, 文件类型: {file_type}, 发票类型提示: {invoice_type}, 图像数据长度: {image_data_length}字节")
+        
+        if not operation:
+            print("错误: 未指定处理操作")
+            return json.dumps({
+                'status': 'error',
+                'message': '未指定处理操作'
+            }, ensure_ascii=False), {}
+        
+        if operation != 'extract_info':
+            print(f"错误: 不支持的操作: {operation}")
+            return json.dumps({
+                'status': 'error',
+                'message': f'不支持的操作：{operation}'
+            }, ensure_ascii=False), {}
+            
+        if file_id:
+            registry = get_file_registry()
+            file_meta = registry.describe(file_id)
+            image_bytes = registry.get_bytes(file_id)
+            if file_meta is None or image_bytes is None:
+                print(f"错误: 文件ID {file_id} 不存在或已过期")
+                return json.dumps({
+                    'status': 'error',
+                    'message': f'文件{file_id}不存在或已过期，请重新上传'
+                }, ensure_ascii=False), {}
+            print(f"按文件ID取回文件 {file_meta['file_name']}，大小: {len(image_bytes)} 字节")
+            return None, {
+                'image_bytes': image_bytes,
+                'file_type': file_type or file_meta['file_type'] or 'jpg',
+                'invoice_type': invoice_type,
+                'file_name': file_name or file_meta['file_name']
+            }
+        
+        if not image_data:
+            print("错误: 未提供文件ID或图像数据")
+            return json.dumps({
+                'status': 'error',
+                'message': '未提供文件ID或图像数据'
+            }, ensure_ascii=False), {}
+        
+        # 验证base64数据的有效性
+        if image_data.startswith("[") and image_data.endswith("]"):
+            print("错误: 收到的似乎是描述文本而不是实际的base64数据")
+            return json.dumps({
+                'status': 'error',
+                'message': '图像数据无效，收到的是描述性文本而非base64编码'
+            }, ensure_ascii=False), {}
+            
+        # 一次性解码base64数据，非法字符由严格模式解码直接报错
+        try:
+            image_bytes = decode_base64_data(image_data)
+        except (binascii.Error, ValueError) as decode_err:
+            print(f"Base64解码失败: {str(decode_err)}, 数据前20个字符: {image_data[:20]}")
+            return json.dumps({
+                'status': 'error',
+                'message': f'图像数据不是有效的base64编码字符串: {str(decode_err)}'
+            }, ensure_ascii=False), {}
+        print(f"解码后的图像大小: {len(image_bytes)} 字节")
+        
+        return None, {'image_bytes': image_bytes, 'file_type': file_type or 'jpg', 'invoice_type': invoice_type, 'file_name': file_name}
+    
+    def _extract_invoice_info(self, image_bytes: bytes, file_type: str, invoice_type: Optional[str] = None,
+                              file_name: Optional[str] = None) -> str:
         """使用多模态模型提取发票信息
         
         Args:
-            image_data: 图像的Base64编码
+            image_bytes: 解码后的图像字节
             file_type: 文件类型
             invoice_type: 发票类型提示
+            file_name: 原始文件名
             
         Returns:
             包含提取信息的JSON字符串
         """
-        temp_path = None
         try:
-            print(f"开始提取发票信息，文件类型: {file_type}, 发票类型提示: {invoice_type}")
-            
-            # 处理输入图像
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_type}') as temp_file:
-                # 处理可能包含前缀的base64字符串
-                print("开始处理base64图像数据...")
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                    print("已移除base64前缀")
-                
-                # 修复Base64 padding问题
-                missing_padding = len(image_data) % 4
-                if missing_padding:
-                    image_data += '=' * (4 - missing_padding)
-                    print(f"已修复Base64 padding，添加了{4 - missing_padding}个=")
-                
-                # 解码并保存到临时文件
-                try:
-                    # 尝试解码前先验证一次
-                    if not all(c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=' for c in image_data):
-                        invalid_chars = [c for c in image_data[:100] if c not in 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=']
-                        print(f"警告: base64字符串包含无效字符: {invalid_chars}")
-                    
-                    image_bytes = base64.b64decode(image_data)
-                    bytes_size = len(image_bytes)
-                    print(f"解码后的图像大小: {bytes_size} 字节")
-                    
-                    # 降低最小大小阈值，并添加更详细的错误信息
-                    if bytes_size < 50:  # 降低到50字节
-                        print(f"警告: 图像数据非常小 ({bytes_size} 字节)，可能不是有效图像")
-                    
-                    temp_file.write(image_bytes)
-                    temp_path = temp_file.name
-                    print(f"已将解码后的图像保存到临时文件: {temp_path}")
-                except Exception as decode_err:
-                    print(f"Base64解码失败: {str(decode_err)}")
-                    print(f"Base64数据长度: {len(image_data)}")
-                    print(f"Base64数据前20个字符: {image_data[:20]}")
-                    
-                    # 尝试读取部分数据
-                    try:
-                        partial_data = image_data[:100] + "..."
-                        partial_bytes = base64.b64decode(partial_data)
-                        print(f"部分数据解码成功，大小: {len(partial_bytes)}字节")
-                    except:
-                        print("部分数据解码也失败")
-                    
-                    return json.dumps({
-                        'status': 'error',
-                        'message': f'Base64解码失败: {str(decode_err)}'
-                    }, ensure_ascii=False)
-            
-            # 验证和处理图像格式
-            # try:
-            #     from PIL import Image
-            #     try:
-            #         with Image.open(temp_path) as img:
-            #             # 检查图像格式并转换为RGB以确保兼容性
-            #             if img.mode != 'RGB':
-            #                 rgb_img = img.convert('RGB')
-            #                 # 保存为临时JPEG文件
-            #                 processed_path = temp_path + ".jpg"
-            #                 rgb_img.save(processed_path, 'JPEG')
-            #                 print(f"已将图像转换为RGB格式并保存为: {processed_path}")
-            #
-            #                 # 使用处理后的图像路径
-            #                 if os.path.exists(processed_path) and os.path.getsize(processed_path) > 0:
-            #                     # 删除原始临时文件
-            #                     os.unlink(temp_path)
-            #                     temp_path = processed_path
-            #                     print(f"将使用处理后的图像: {temp_path}")
-            #     except Exception as img_err:
-            #         print(f"图像验证/处理失败，继续使用原始图像: {str(img_err)}")
-            # except ImportError:
-            #     print("PIL库未安装，跳过图像验证和处理")
-            
-            # 使用多模态抽取器提取信息
+            finished_result, context = self._prepare_extraction(image_bytes, file_type, invoice_type, file_name)
+            if finished_result:
+                return finished_result
+            
+            # 使用多模态抽取器提取信息，图像字节直接在内存中传递
             try:
-                print(f"调用invoice_extractor.extract_info处理: {temp_path}")
-                extracted_info = self.invoice_extractor.extract_info(temp_path, invoice_type)
+                print(f"按级联{context['models']}提取, 大小: {len(context['image_bytes'])}字节")
+                with self.rate_limiter.acquire() if self.rate_limiter else nullcontext():
+                    extracted_info = self.cascade.run(context['image_bytes'], context['invoice_type'], context['models'],
+                                                      context['trusted_fields'], context['start_tier'])
                 print(f"提取信息完成，结果: {extracted_info}")
-                
-                # 删除临时文件
-                if temp_path and os.path.exists(temp_path):
-                    os.unlink(temp_path)
-                    print(f"已删除临时文件: {temp_path}")
-                
-                # 检查是否成功提取信息
-                if 'error' in extracted_info:
-                    print(f"提取过程中发生错误: {extracted_info['error']}")
-                    # 如果有错误但仍然有一些基本信息，尝试使用这些信息
-                    if invoice_type and len(extracted_info) > 1:
-                        print("尽管有错误，但仍尝试使用部分提取的信息")
-                        # 继续处理部分信息
-                    else:
-                        return json.dumps({
-                            'status': 'error',
-                            'message': extracted_info['error']
-                        }, ensure_ascii=False)
-                
-                # 将提取的信息转换为系统所需的发票信息格式
-                invoice_info = self._convert_to_system_format(extracted_info)
-                print(f"已转换为系统格式: {invoice_info}")
-                
-                return json.dumps({
-                    'status': 'success',
-                    'message': '成功提取发票信息',
-                    'invoice_info': invoice_info
-                }, ensure_ascii=False)
-                
+                return self._finish_extraction(extracted_info, context, invoice_type)
             except Exception as extract_err:
-                print(f"提取信息过程中发生异常: {str(extract_err)}")
-                import traceback
-                traceback.print_exc()
-                
-                # 确保删除临时文件
-                if temp_path and os.path.exists(temp_path):
-                    try:
-                        os.unlink(temp_path)
-                        print(f"已删除临时文件: {temp_path}")
-                    except:
-                        pass
-                
-                # 提供备用基本信息
-                if invoice_type:
-                    basic_info = self._generate_basic_invoice_info(invoice_type)
-                    if basic_info:
-                        print("提供备用的基本发票信息")
-                        return json.dumps({
-                            'status': 'warning',
-                            'message': f'无法完全提取发票信息: {str(extract_err)}，提供基本结构',
-                            'invoice_info': basic_info
-                        }, ensure_ascii=False)
-                
-                raise extract_err
+                return self._extraction_fallback(extract_err, invoice_type)
             
         except Exception as e:
             print(f"提取发票信息总体失败: {str(e)}")
             import traceback
             traceback.print_exc()
             
-            # 清理临时文件
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.unlink(temp_path)
-                    print(f"已删除临时文件: {temp_path}")
-                except:
-                    pass
+            return json.dumps({
+                'status': 'error',
+                'message': f'提取发票信息失败: {str(e)}'
+            }, ensure_ascii=False)
+    
+    async def _aextract_invoice_info(self, image_bytes: bytes, file_type: str, invoice_type: Optional[str] = None,
+                                     file_name: Optional[str] = None) -> str:
+        """_extract_invoice_info的异步版本，解析、渲染、二维码识别等CPU步骤在线程池中执行"""
+        try:
+            finished_result, context = await asyncio.to_thread(self._prepare_extraction, image_bytes, file_type, invoice_type, file_name)
+            if finished_result:
+                return finished_result
             
+            try:
+                print(f"按级联{context['models']}异步提取, 大小: {len(context['image_bytes'])}字节")
+                extracted_info = await self.cascade.arun(context['image_bytes'], context['invoice_type'], context['models'],
+                                                         context['trusted_fields'], context['start_tier'])
+                print(f"异步提取信息完成，结果: {extracted_info}")
+                return await asyncio.to_thread(self._finish_extraction, extracted_info, context, invoice_type)
+            except Exception as extract_err:
+                return self._extraction_fallback(extract_err, invoice_type)
+        
+        except Exception as e:
+            print(f"异步提取发票信息失败: {str(e)}")
             return json.dumps({
                 'status': 'error',
                 'message': f'提取发票信息失败: {str(e)}'
             }, ensure_ascii=False)
+    
+    def _prepare_extraction(self, image_bytes: bytes, file_type: str, invoice_type: Optional[str] = None,
+                            file_name: Optional[str] = None):
+        """执行调用模型之前的步骤：电子发票解析、缓存查询、去重索引、PDF文本层、PDF渲染、二维码识别和类型预分类
+        
+        Args:
+            image_bytes: 解码后的文件字节
+            file_type: 文件类型
+            invoice_type: 发票类型提示
+            file_name: 原始文件名
+            
+        Returns:
+            Tuple[Optional[str], Dict]: 无需调用模型时返回结果JSON；否则返回None和调用模型所需的上下文
+                （image_bytes、cache_key、qr_info、由二维码确定的trusted_fields，预分类选定的invoice_type、models和start_tier，
+                以及用于去重登记的content_sha256和phash）
+        """
+        print(f"开始提取发票信息，文件类型: {file_type}, 发票类型提示: {invoice_type}")
+        
+        if len(image_bytes) < 50:
+            print(f"警告: 图像数据非常小 ({len(image_bytes)} 字节)，可能不是有效图像")
+        
+        content_sha256 = content_digest(image_bytes)
+        
+        # OFD和XML电子发票自带结构化字段，直接解析，无需渲染或调用模型
+        if file_type and file_type.lower() in ('ofd', 'xml'):
+            parsed_info = self.einvoice_parser.parse(image_bytes, file_type)
+            if parsed_info is None:
+                return json.dumps({
+                    'status': 'error',
+                    'message': f'无法解析{file_type.upper()}电子发票，请确认文件完整'
+                }, ensure_ascii=False), {}
+            invoice_info = self._convert_to_system_format(parsed_info)
+            print(f"电子发票解析成功，已转换为系统格式: {invoice_info}")
+            duplicate_note = self._register_invoice(invoice_info, content_sha256)
+            return json.dumps({
+                'status': 'success',
+                'message': f'成功提取发票信息（{file_type.upper()}电子发票）{duplicate_note}',
+                'invoice_info': invoice_info
+            }, ensure_ascii=False), {}
+        
+        # 查询提取缓存，相同文件内容无需再次调用大模型
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(image_bytes, invoice_type, PROMPT_VERSION)
+            cached_info = self.cache.get(cache_key)
+            if cached_info is not None:
+                print(f"命中提取缓存: {cache_key[:16]}..., 缓存统计: {self.cache.stats()}")
+                duplicate_note = self._register_invoice(cached_info, content_sha256)
+                return json.dumps({
+                    'status': 'success',
+                    'message': f'成功提取发票信息（缓存）{duplicate_note}',
+                    'invoice_info': cached_info
+                }, ensure_ascii=False), {}
+        
+        # 提取缓存未命中（已过期或发票类型提示不同）时，用相同提示词版本识别过的文件直接返回登记的发票信息
+        if self.duplicate_index is not None:
+            known = self.duplicate_index.lookup_file(content_sha256, PROMPT_VERSION)
+            if known:
+                return self._known_invoice_result(known, '相同文件'), {}
+        
+        # 数电PDF优先读取文本层，文本层缺失或校验失败时再渲染首页交给多模态模型
+        page_text = ''
+        if file_type and file_type.lower() == 'pdf':
+            text_info = self.pdf_text_extractor.extract(image_bytes, invoice_type)
+            if text_info is not None:
+                invoice_info = self._convert_to_system_format(text_info)
+                print(f"PDF文本层提取成功，已转换为系统格式: {invoice_info}")
+                if cache_key:
+                    self.cache.set(cache_key, invoice_info)
+                duplicate_note = self._register_invoice(invoice_info, content_sha256)
+                return json.dumps({
+                    'status': 'success',
+                    'message': f'成功提取发票信息（PDF文本层）{duplicate_note}',
+                    'invoice_info': invoice_info
+                }, ensure_ascii=False), {}
+            # 文本层不足以直接提取时，其中的文字仍可用于判断发票类型
+            page_text = self.pdf_text_extractor.page_text(image_bytes)
+            image_bytes = render_pdf_page(image_bytes, 0)
+            print(f"PDF首页已渲染为图像，大小: {len(image_bytes)}字节")
+        
+        # 调用模型前先识别发票二维码，得到发票号码、金额、日期等精确字段
+        qr_info = self.image_processor.decode_invoice_qr_from_bytes(image_bytes)
+        
+        # 外观相近且二维码中的发票号码一致时，视为同一张发票的另一份扫描件，不再调用模型
+        phash = compute_phash(image_bytes) if self.duplicate_index is not None else None
+        if qr_info and phash is not None:
+            for similar in self.duplicate_index.find_similar(phash):
+                if str(similar['invoice_info'].get('invoice_id', '')) == qr_info['发票号码']:
+                    self.duplicate_index.add(similar['invoice_info'], content_sha256, phash, PROMPT_VERSION)
+                    return self._known_invoice_result(similar, '相同发票的其他扫描件'), {}
+        
+        # 本地预分类，决定使用的专用提示词和模型规格
+        classification = self.classifier.classify(invoice_type, qr_info, page_text, file_name, image_bytes)
+        route = self.classifier.route(classification, invoice_type)
+        print(f"发票类型预分类: {classification}, 提示类型: {route['invoice_type']}, 级联模型: {route['models']}")
+        
+        return None, {
+            'image_bytes': image_bytes,
+            'cache_key': cache_key,
+            'qr_info': qr_info,
+            'trusted_fields': self._qr_trusted_fields(qr_info),
+            'invoice_type': route['invoice_type'],
+            'models': route['models'],
+            'start_tier': route['start_tier'],
+            'content_sha256': content_sha256,
+            'phash': phash
+        }
+    
+    def _finish_extraction(self, extracted_info: Dict[str, Any], context: Dict[str, Any], invoice_type: Optional[str] = None) -> str:
+        """处理模型提取结果：二维码校验、格式转换和写入缓存
+        
+        Args:
+            extracted_info: 模型提取结果
+            context: _prepare_extraction返回的上下文
+            invoice_type: 发票类型提示
+            
+        Returns:
+            包含提取信息的JSON字符串
+        """
+        qr_info = context.get('qr_info')
+        cache_key = context.get('cache_key')
+        
+        # 以二维码为准校正关键字段；模型调用失败时至少保留二维码中的字段
+        if qr_info:
+            if 'error' in extracted_info:
+                print(f"模型提取失败，使用二维码字段: {extracted_info['error']}")
+                extracted_info = self._build_info_from_qr(qr_info, invoice_type)
+            else:
+                extracted_info = self._reconcile_with_qr(extracted_info, qr_info, context['image_bytes'])
+        
+        # 检查是否成功提取信息
+        if 'error' in extracted_info:
+            print(f"提取过程中发生错误: {extracted_info['error']}")
+            # 如果有错误但仍然有一些基本信息，尝试使用这些信息
+            if invoice_type and len(extracted_info) > 1:
+                print("尽管有错误，但仍尝试使用部分提取的信息")
+                # 继续处理部分信息
+            else:
+                return json.dumps({
+                    'status': 'error',
+                    'message': extracted_info['error']
+                }, ensure_ascii=False)
+        
+        # 将提取的信息转换为系统所需的发票信息格式
+        invoice_info = self._convert_to_system_format(extracted_info)
+        print(f"已转换为系统格式: {invoice_info}")
+        
+        # 只缓存完整成功的提取结果，备用方法生成的占位信息和仅含二维码字段的结果不缓存
+        is_backup_result = str(extracted_info.get('备注', '')).startswith('由备用方法生成')
+        is_qr_only = str(extracted_info.get('二维码校验', '')).startswith('仅识别到二维码字段')
+        if cache_key and 'error' not in extracted_info and not is_backup_result and not is_qr_only:
+            self.cache.set(cache_key, invoice_info)
+        
+        # 备用方法生成的占位信息不登记到去重索引
+        duplicate_note = ''
+        if not is_backup_result:
+            duplicate_note = self._register_invoice(invoice_info, context.get('content_sha256'), context.get('phash'))
+        
+        return json.dumps({
+            'status': 'success',
+            'message': f'成功提取发票信息{duplicate_note}',
+            'invoice_info': invoice_info
+        }, ensure_ascii=False)
+    
+    def _register_invoice(self, invoice_info: Dict[str, Any], content_sha256: Optional[str] = None,
+                          phash: Optional[int] = None) -> str:
+        """把识别出的发票登记到去重索引，已在其他报销单中报销时在发票信息中标记并返回提示"""
+        if self.duplicate_index is None:
+            return ''
+        existing = self.duplicate_index.add(invoice_info, content_sha256, phash, PROMPT_VERSION)
+        if existing and existing['claim_id']:
+            print(f"发票{invoice_info.get('invoice_id')}已在报销单{existing['claim_id']}中报销")
+            invoice_info['duplicate_claim_id'] = existing['claim_id']
+            return f"，注意：该发票已在报销单{existing['claim_id']}中报销"
+        return ''
+    
+    def _known_invoice_result(self, record: Dict[str, Any], reason: str) -> str:
+        """根据去重索引中的记录生成提取结果"""
+        invoice_info = dict(record['invoice_info'])
+        message = f'该发票已识别过（{reason}），直接使用登记的信息'
+        if record['claim_id']:
+            invoice_info['duplicate_claim_id'] = record['claim_id']
+            message += f"，注意：该发票已在报销单{record['claim_id']}中报销"
+        print(message)
+        return json.dumps({
+            'status': 'success',
+            'message': message,
+            'invoice_info': invoice_info
+        }, ensure_ascii=False)
+    
+    def _qr_trusted_fields(self, qr_info: Optional[Dict[str, Any]]) -> List[str]:
+        """二维码能够确定的字段，模型结果中这些字段稍后会按二维码校正，不必因其有误而升级模型"""
+        if not qr_info:
+            return []
+        fields = [field for field in ('发票号码', '日期') if qr_info.get(field)]
+        if qr_info.get('金额') and qr_info.get('金额含税'):
+            fields.append('金额')
+        return fields
+    
+    def _extraction_fallback(self, extract_err: Exception, invoice_type: Optional[str] = None) -> str:
+        """提取过程异常时，按发票类型提供基本结构；无法提供时继续抛出异常"""
+        print(f"提取信息过程中发生异常: {str(extract_err)}")
+        import traceback
+        traceback.print_exc()
+        
+        # 提供备用基本信息
+        if invoice_type:
+            basic_info = self._generate_basic_invoice_info(invoice_type)
+            if basic_info:
+                print("提供备用的基本发票信息")
+                return json.dumps({
+                    'status': 'warning',
+                    'message': f'无法完全提取发票信息: {str(extract_err)}，提供基本结构',
+                    'invoice_info': basic_info
+                }, ensure_ascii=False)
+        
+        raise extract_err
             
     def _generate_basic_invoice_info(self, invoice_type: str) -> Dict[str, Any]:
         """根据发票类型生成基本的发票信息结构
@@ -314,6 +600,79 @@ class MMInvoiceProcessor(BaseTool):
         
         return basic_info
     
+    def _build_info_from_qr(self, qr_info: Dict[str, Any], invoice_type: Optional[str] = None) -> Dict[str, Any]:
+        """仅根据二维码字段构造提取结果
+        
+        Args:
+            qr_info: 二维码中的发票字段
+            invoice_type: 发票类型提示
+            
+        Returns:
+            Dict: 中文字段的提取结果
+        """
+        qr_invoice_types = {'51': '火车票', '61': '机票'}
+        return {
+            '发票类型': invoice_type or qr_invoice_types.get(qr_info['发票种类代码'], '其他票据'),
+            '发票号码': qr_info['发票号码'],
+            '发票代码': qr_info['发票代码'],
+            '日期': qr_info['日期'],
+            '金额': qr_info['金额'] if qr_info['金额含税'] else '',
+            '不含税金额': '' if qr_info['金额含税'] else qr_info['金额'],
+            '二维码校验': '仅识别到二维码字段，其余信息需人工补充'
+        }
+    
+    def _reconcile_with_qr(self, extracted_info: Dict[str, Any], qr_info: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
+        """用二维码字段核对模型结果
+        
+        发票号码、发票代码、日期直接以二维码为准；金额在二维码为价税合计时直接校正，
+        为不含税金额时检查价税合计是否在合理范围内，不一致才针对金额重新询问模型。
+        
+        Args:
+            extracted_info: 模型提取结果
+            qr_info: 二维码中的发票字段
+            image_bytes: 图像字节，用于复核
+            
+        Returns:
+            Dict: 校正后的提取结果
+        """
+        corrections = []
+        
+        if str(extracted_info.get('发票号码', '')).strip() != qr_info['发票号码']:
+            corrections.append(f"发票号码 {extracted_info.get('发票号码', '')} -> {qr_info['发票号码']}")
+            extracted_info['发票号码'] = qr_info['发票号码']
+        if qr_info['发票代码']:
+            extracted_info['发票代码'] = qr_info['发票代码']
+        
+        model_date = ''.join(f'{int(part):02d}' for part in re.findall(r'\d+', str(extracted_info.get('日期', ''))))
+        qr_date = ''.join(re.findall(r'\d+', qr_info['日期']))
+        if model_date != qr_date:
+            corrections.append(f"日期 {extracted_info.get('日期', '')} -> {qr_info['日期']}")
+            extracted_info['日期'] = qr_info['日期']
+        
+        qr_amount = float(qr_info['金额'])
+        model_amount = self._extract_amount(extracted_info)
+        if qr_info['金额含税']:
+            if abs(model_amount - qr_amount) > 0.01:
+                corrections.append(f"金额 {model_amount} -> {qr_info['金额']}")
+                extracted_info['金额'] = qr_info['金额']
+        elif not qr_amount - 0.01 <= model_amount <= qr_amount * 1.17 + 0.01:
+            # 二维码只有不含税金额，价税合计超出合理税率范围时请模型复核
+            print(f"金额与二维码不一致（模型: {model_amount}, 二维码不含税金额: {qr_amount}），请求模型复核")
+            with self.rate_limiter.acquire() if self.rate_limiter else nullcontext():
+                rechecked = self.invoice_extractor.recheck_fields(
+                    image_bytes, {'金额': f'价税合计（小写），二维码显示不含税金额为{qr_info["金额"]}'}
+                )
+            rechecked_amount = self._extract_amount(rechecked) if 'error' not in rechecked else 0.0
+            if qr_amount - 0.01 <= rechecked_amount <= qr_amount * 1.17 + 0.01:
+                corrections.append(f"金额 {model_amount} -> {rechecked_amount}（复核）")
+                extracted_info['金额'] = f'{rechecked_amount:.2f}'
+            else:
+                extracted_info['警告'] = f"金额与二维码不含税金额{qr_info['金额']}不一致，请人工核对"
+        
+        extracted_info['二维码校验'] = '；'.join(corrections) if corrections else '一致'
+        print(f"二维码校验结果: {extracted_info['二维码校验']}")
+        return extracted_info
+    
     def _convert_to_system_format(self, extracted_info: Dict[str, Any]) -> Dict[str, Any]:
         """将抽取器的输出转换为系统所需的格式
         
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Iterable, List, Optional
+from config import EXTRACTION_CONFIG
+from tools.invoice_validator import InvoiceValidator
+
+
+class CascadeStats:
+    """级联各级模型的调用统计
+
+    内存中按模型累计调用次数、校验通过次数和最近的耗时样本，用于查看命中率和耗时分位数；
+    配置了日志路径时每次调用追加一行JSON，便于用生产数据离线调整级联配置。
+    """
+
+    def __init__(self, log_path: Optional[str] = None, max_samples: int = 1000):
+        self.log_path = log_path if log_path is not None else EXTRACTION_CONFIG['cascade_log_path']
+        self.max_samples = max_samples
+        self._tiers: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._log_dir_ready = False
+
+    def record(self, model: str, tier: int, accepted: bool, latency: float,
+               problems: List[str], invoice_type: Optional[str] = None) -> None:
+        """记录一次模型调用的结果和耗时"""
+        with self._lock:
+            tier_stats = self._tiers.setdefault(model, {
+                'tier': tier,
+                'attempts': 0,
+                'accepted': 0,
+                'latencies': deque(maxlen=self.max_samples)
+            })
+            tier_stats['attempts'] += 1
+            tier_stats['accepted'] += int(accepted)
+            tier_stats['latencies'].append(latency)
+
+        # 日志在锁外写入，并发提取不会因文件读写互相等待；每条记录一次追加写入一整行
+        if self.log_path:
+            record = {
+                'time': time.time(),
+                'model': model,
+                'tier': tier,
+                'invoice_type': invoice_type,
+                'accepted': accepted,
+                'latency': round(latency, 3),
+                'problems': problems
+            }
+            self._append_log(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def _append_log(self, line: str) -> None:
+        """追加一行日志，首次写入时创建日志目录，写入失败不影响提取"""
+        try:
+            if not self._log_dir_ready:
+                log_dir = os.path.dirname(self.log_path)
+                if log_dir:
+                    os.makedirs(log_dir, exist_ok=True)
+                self._log_dir_ready = True
+            with open(self.log_path, 'a', encoding='utf-8') as log_file:
+                log_file.write(line)
+        except OSError as e:
+            print(f"写入级联调用记录失败: {str(e)}")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """返回各模型的调用次数、命中率和耗时（秒）"""
+        with self._lock:
+            result = {}
+            for model, tier_stats in self._tiers.items():
+                latencies = sorted(tier_stats['latencies'])
+                attempts = tier_stats['attempts']
+                result[model] = {
+                    'tier': tier_stats['tier'],
+                    'attempts': attempts,
+                    'accepted': tier_stats['accepted'],
+                    'hit_rate': tier_stats['accepted'] / attempts if attempts else 0.0,
+                    'latency_mean': sum(latencies) / len(latencies) if latencies else 0.0,
+                    'latency_p50': latencies[len(latencies) // 2] if latencies else 0.0,
+                    'latency_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+                }
+            return result
+
+
+class ModelCascade:
+    """多模态模型级联提取
+
+    按顺序调用配置的各级模型（通常先小模型后大模型），每一级的结果经过InvoiceValidator校验，
+    只有校验不通过时才交给下一级，所有级别都不通过时返回最后一级的结果并附上校验问题。
+    """
+
+    def __init__(self, extractor, validator: Optional[InvoiceValidator] = None,
+                 stats: Optional[CascadeStats] = None):
+        self.extractor = extractor
+        self.validator = validator or InvoiceValidator()
+        self.stats = stats or get_cascade_stats()
+
+    def run(self, image_bytes: bytes, invoice_type: Optional[str], models: List[str],
+            skip_fields: Iterable[str] = (), start_tier: int = 0) -> Dict[str, Any]:
+        """依次使用各级模型提取，直到结果通过校验
+
+        Args:
+            image_bytes: 待识别的图像字节
+            invoice_type: 发票类型提示
+            models: 按调用顺序排列的模型名称
+            skip_fields: 不需要校验的字段，如已由二维码确定的字段
+            start_tier: 第一个模型在级联中的序号，只用于统计
+
+        Returns:
+            Dict: 提取结果（中文字段）
+        """
+        extracted_info = {'error': '没有可用的模型'}
+        problems = []
+        for offset, model in enumerate(models):
+            start = time.perf_counter()
+            extracted_info = self.extractor.extract_info_from_bytes(image_bytes, invoice_type, model=model)
+            problems = self.check(model, start_tier + offset, extracted_info, time.perf_counter() - start,
+                                  invoice_type, skip_fields)
+            if not problems:
+                return extracted_info
+        return self._with_problems(extracted_info, problems)
+
+    async def arun(self, image_bytes: bytes, invoice_type: Optional[str], models: List[str],
+                   skip_fields: Iterable[str] = (), start_tier: int = 0) -> Dict[str, Any]:
+        """run的异步版本"""
+        extracted_info = {'error': '没有可用的模型'}
+        problems = []
+        for offset, model in enumerate(models):
+            start = time.perf_counter()
+            extracted_info = await self.extractor.extract_info_async(image_bytes, invoice_type, model=model)
+            problems = self.check(model, start_tier + offset, extracted_info, time.perf_counter() - start,
+                                  invoice_type, skip_fields)
+            if not problems:
+                return extracted_info
+        return self._with_problems(extracted_info, problems)
+
+    def check(self, model: str, tier: int, extracted_info: Dict[str, Any], latency: float,
+              invoice_type: Optional[str] = None, skip_fields: Iterable[str] = ()) -> List[str]:
+        """校验一级模型的结果并记录统计，返回发现的问题"""
+        problems = self.validator.validate(extracted_info, invoice_type, skip_fields)
+        self.stats.record(model, tier, not problems, latency, problems, invoice_type)
+        if problems:
+            print(f"模型{model}的结果未通过校验（{latency:.2f}秒）: {problems}")
+        else:
+            print(f"模型{model}的结果通过校验（{latency:.2f}秒）")
+        return problems
+
+    def _with_problems(self, extracted_info: Dict[str, Any], problems: List[str]) -> Dict[str, Any]:
+        """所有级别都未通过校验时，把校验问题写入警告字段"""
+        if isinstance(extracted_info, dict) and 'error' not in extracted_info and problems:
+            warnings = extracted_info.get('警告', [])
+            if not isinstance(warnings, list):
+                warnings = [warnings]
+            extracted_info['警告'] = warnings + problems
+        return extracted_info
+
+
+_cascade_stats = None
+_cascade_stats_lock = threading.Lock()
+
+
+def get_cascade_stats() -> CascadeStats:
+    """获取进程内共享的级联统计"""
+    global _cascade_stats
+    if _cascade_stats is None:
+        with _cascade_stats_lock:
+            if _cascade_stats is None:
+                _cascade_stats = CascadeStats()
+    return _cascade_stats
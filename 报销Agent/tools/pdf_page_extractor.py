@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Any, Optional, Callable, Iterator
+import fitz  # PyMuPDF
+from config import PDF_CONFIG
+
+
+def split_pdf_pages(pdf_bytes: bytes, max_pages: Optional[int] = None) -> List[bytes]:
+    """将PDF拆分为单页PDF字节列表
+
+    单页PDF直接返回原始字节；多页PDF拆分时不生成新的文档ID，同一文件每次拆分得到的页面字节相同，
+    提取缓存和去重索引才能按页面内容命中。
+
+    Args:
+        pdf_bytes: PDF文件的原始字节
+        max_pages: 最多拆分的页数，默认使用配置值
+
+    Returns:
+        List[bytes]: 每页一个单页PDF
+    """
+    max_pages = max_pages or PDF_CONFIG['max_pages']
+    pages = []
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+        page_count = len(doc)
+        if page_count == 1:
+            return [pdf_bytes]
+        if page_count > max_pages:
+            print(f"PDF共{page_count}页，超出上限，仅处理前{max_pages}页")
+        for page_index in range(min(page_count, max_pages)):
+            with fitz.open() as single:
+                single.insert_pdf(doc, from_page=page_index, to_page=page_index)
+                pages.append(single.tobytes(no_new_id=True))
+    return pages
+
+
+def _real_invoice_id(invoice_info: Dict[str, Any]) -> str:
+    """返回真实的发票号码，缺失或自动生成的AUTO编号返回空字符串"""
+    invoice_id = str(invoice_info.get('invoice_id') or '').strip()
+    return '' if invoice_id.upper().startswith('AUTO') else invoice_id
+
+
+class PDFPageExtractor:
+    """多页PDF逐页提取器
+
+    每页独立交给多模态发票处理器（文本层优先，必要时由渲染进程池渲染后识别），
+    按页完成顺序输出结果，并按发票号码拆分出PDF中包含的多张发票。
+    """
+
+    def __init__(self, processor, page_workers: Optional[int] = None):
+        self.processor = processor
+        self.page_workers = page_workers or PDF_CONFIG['page_workers']
+
+    def iter_pages(self, pdf_bytes: bytes, invoice_type: Optional[str] = None,
+                   file_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """并发处理PDF的每一页，按完成顺序逐页返回结果
+
+        Args:
+            pdf_bytes: PDF文件的原始字节
+            invoice_type: 发票类型提示
+            file_name: 原始文件名，用于预分类
+
+        Returns:
+            Iterator[Dict]: 每项包含page（从1开始）、page_count、status、message、invoice_info
+        """
+        pages = split_pdf_pages(pdf_bytes)
+        print(f"PDF共拆分为{len(pages)}页，开始逐页提取")
+        if not pages:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.page_workers, len(pages))) as executor:
+            futures = {
+                executor.submit(self.processor.extract_from_bytes, page_bytes, 'pdf', invoice_type, file_name): page_index
+                for page_index, page_bytes in enumerate(pages)
+            }
+            for future in as_completed(futures):
+                page_index = futures[future]
+                try:
+                    response = future.result()
+                except Exception as e:
+                    response = {'status': 'error', 'message': f'第{page_index + 1}页处理失败: {str(e)}'}
+                yield {
+                    'page': page_index + 1,
+                    'page_count': len(pages),
+                    'status': response.get('status', 'error'),
+                    'message': response.get('message', ''),
+                    'invoice_info': response.get('invoice_info')
+                }
+
+    def extract(self,
+                pdf_bytes: bytes,
+                invoice_type: Optional[str] = None,
+                on_invoice: Optional[Callable[[Dict[str, Any]], None]] = None,
+                file_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """提取PDF中的全部发票，每张发票一条标准化记录
+
+        同一发票号码跨多页（如酒店账单明细页）时只保留一条；没有真实发票号码（为空或是自动生成的AUTO编号）的页面：
+        既没有金额的视为附页，不产生记录；有金额的（如酒店账单）在同一文件中有其他带发票号码的页面时视为该发票的附页，
+        整个文件都没有发票号码时才各自作为一条记录，这些页面要等所有页面处理完成后才能确定。
+
+        Args:
+            pdf_bytes: PDF文件的原始字节
+            invoice_type: 发票类型提示
+            on_invoice: 每识别出一张新发票时的回调，参数为发票信息（含page字段）
+            file_name: 原始文件名，用于预分类
+
+        Returns:
+            List[Dict]: 按页码排序的发票信息列表
+        """
+        invoices = []
+        seen_ids = set()
+        unnumbered = []
+        for page_result in self.iter_pages(pdf_bytes, invoice_type, file_name):
+            invoice_info = page_result['invoice_info']
+            if page_result['status'] not in ('success', 'warning') or not invoice_info:
+                print(f"第{page_result['page']}页未提取到发票: {page_result['message']}")
+                continue
+
+            invoice_id = _real_invoice_id(invoice_info)
+            invoice_info['page'] = page_result['page']
+            if not invoice_id:
+                if float(invoice_info.get('amount') or 0) > 0:
+                    unnumbered.append(invoice_info)
+                else:
+                    print(f"第{page_result['page']}页没有发票号码和金额，视为附页")
+                continue
+            if invoice_id in seen_ids:
+                print(f"第{page_result['page']}页为发票{invoice_id}的续页，已合并")
+                continue
+            seen_ids.add(invoice_id)
+
+            invoices.append(invoice_info)
+            if on_invoice:
+                on_invoice(invoice_info)
+
+        for invoice_info in sorted(unnumbered, key=lambda item: item['page']):
+            if seen_ids:
+                print(f"第{invoice_info['page']}页没有发票号码，视为本文件中发票的附页")
+                continue
+            invoices.append(invoice_info)
+            if on_invoice:
+                on_invoice(invoice_info)
+
+        invoices.sort(key=lambda item: item['page'])
+        print(f"PDF提取完成，共识别出{len(invoices)}张发票")
+        return invoices
@@ -0,0 +1,141 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence
+import fitz  # PyMuPDF
+from config import PDF_CONFIG, IMAGE_PREPROCESS_CONFIG
+
+
+def choose_zoom(page_width: float, page_height: float,
+                short_side: Optional[int] = None, max_long_side: Optional[int] = None) -> float:
+    """根据页面尺寸选择渲染倍数
+
+    使渲染结果的短边正好达到发送给模型的目标短边，不必先渲染大图再缩小，
+    同时保证长边不超过上限，倍数限制在配置的范围内。
+
+    Args:
+        page_width: 页面宽度（点，1/72英寸）
+        page_height: 页面高度（点）
+        short_side: 目标短边像素，默认使用图像预处理配置
+        max_long_side: 长边像素上限，默认使用图像预处理配置
+
+    Returns:
+        float: 渲染倍数（1倍为72dpi）
+    """
+    short_side = short_side or IMAGE_PREPROCESS_CONFIG['short_side']
+    max_long_side = max_long_side or IMAGE_PREPROCESS_CONFIG['max_long_side']
+    if page_width <= 0 or page_height <= 0:
+        return PDF_CONFIG['min_zoom']
+    zoom = min(short_side / min(page_width, page_height), max_long_side / max(page_width, page_height))
+    return max(PDF_CONFIG['min_zoom'], min(PDF_CONFIG['max_zoom'], zoom))
+
+
+def _rasterize_worker(pdf_bytes: bytes, page_indexes: Sequence[int], zoom: float, image_format: str) -> List[bytes]:
+    """在子进程中把PDF的若干页渲染为图像字节（需为模块级函数以便跨进程调用）
+
+    zoom不大于0时按每页尺寸自动选择倍数。同一子进程处理的多页只打开一次PDF。
+    """
+    images = []
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+        for page_index in page_indexes:
+            page = doc.load_page(page_index)
+            page_zoom = zoom if zoom > 0 else choose_zoom(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(page_zoom, page_zoom), alpha=False)
+            images.append(pixmap.tobytes(image_format))
+    return images
+
+
+def _warm_up_worker() -> bool:
+    """预热任务，子进程启动时已导入本模块和PyMuPDF，任务本身不做任何事"""
+    return True
+
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """获取进程内共享的页面渲染进程池，首次使用时创建"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=max(1, PDF_CONFIG['render_workers']))
+        return _render_pool
+
+
+def _reset_render_pool() -> None:
+    """丢弃已损坏的进程池，下次使用时重新创建"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False)
+        _render_pool = None
+
+
+def warm_up_render_pool() -> None:
+    """提前启动全部渲染子进程，避免第一次上传PDF时承担进程启动开销"""
+    pool = get_render_pool()
+    futures = [pool.submit(_warm_up_worker) for _ in range(max(1, PDF_CONFIG['render_workers']))]
+    for future in futures:
+        try:
+            future.result()
+        except BrokenProcessPool:
+            _reset_render_pool()
+            return
+
+
+def rasterize_pdf(pdf_bytes: bytes,
+                  page_indexes: Optional[Sequence[int]] = None,
+                  zoom: Optional[float] = None,
+                  image_format: Optional[str] = None) -> List[bytes]:
+    """在渲染进程池中把PDF页面渲染为图像字节，全程在内存中完成
+
+    多页时按进程数把页面分成若干组并行渲染，每组只传输和打开一次PDF。
+
+    Args:
+        pdf_bytes: PDF文件的原始字节
+        page_indexes: 要渲染的页码（从0开始），默认渲染全部页面（不超过配置的页数上限）
+        zoom: 渲染倍数，默认使用配置值，配置为0时按页面尺寸自动选择
+        image_format: 输出格式，png或jpg等PyMuPDF支持的格式，默认使用配置值
+
+    Returns:
+        List[bytes]: 与page_indexes顺序一致的图像字节
+    """
+    zoom = PDF_CONFIG['render_zoom'] if zoom is None else zoom
+    image_format = image_format or PDF_CONFIG['render_format']
+    if page_indexes is None:
+        with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+            page_indexes = list(range(min(len(doc), PDF_CONFIG['max_pages'])))
+    page_indexes = list(page_indexes)
+    if not page_indexes:
+        return []
+
+    group_count = min(len(page_indexes), max(1, PDF_CONFIG['render_workers']))
+    groups = [page_indexes[offset::group_count] for offset in range(group_count)]
+    try:
+        pool = get_render_pool()
+        futures = [pool.submit(_rasterize_worker, pdf_bytes, group, zoom, image_format) for group in groups]
+        rendered = [future.result() for future in futures]
+    except BrokenProcessPool:
+        print("页面渲染进程池不可用，改为在当前进程中渲染")
+        _reset_render_pool()
+        rendered = [_rasterize_worker(pdf_bytes, group, zoom, image_format) for group in groups]
+
+    images_by_page = {}
+    for group, images in zip(groups, rendered):
+        images_by_page.update(zip(group, images))
+    return [images_by_page[page_index] for page_index in page_indexes]
+
+
+def render_pdf_page(pdf_bytes: bytes, page_index: int = 0, zoom: Optional[float] = None) -> bytes:
+    """使用渲染进程池将PDF指定页渲染为图像字节
+
+    Args:
+        pdf_bytes: PDF文件的原始字节
+        page_index: 页码（从0开始）
+        zoom: 渲染倍数，默认使用配置值，配置为0时按页面尺寸自动选择
+
+    Returns:
+        图像字节（格式由配置决定，默认PNG）
+    """
+    return rasterize_pdf(pdf_bytes, [page_index], zoom)[0]
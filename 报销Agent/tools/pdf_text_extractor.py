@@ -0,0 +1,321 @@
+import re
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+import fitz  # PyMuPDF
+
+# 同一行文字的纵向中心允许的偏差（PDF坐标单位）
+ROW_TOLERANCE = 4.0
+
+DATE_PATTERN = re.compile(r'(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日')
+AMOUNT_PATTERN = re.compile(r'[¥￥]\s*(\d+(?:\.\d{1,2})?)')
+INVOICE_NUMBER_PATTERN = re.compile(r'发票号码\s*[:：]?\s*(\d{8,20})')
+ISSUE_DATE_PATTERN = re.compile(r'开票日期\s*[:：]?\s*(\d{4}\s*年\s*\d{1,2}\s*月\s*\d{1,2}\s*日)')
+STATION_PATTERN = re.compile(r'^([一-龥]{1,10}站)$')
+TRAIN_NUMBER_PATTERN = re.compile(r'^[GDCZTKYLS]?\d{1,5}$')
+ID_NUMBER_PATTERN = re.compile(r'\d{6,10}\*{4}\d{3}[\dXx]')
+
+
+# 票据类别对应的提取结果发票类型（与多模态模型输出的中文类型一致）
+KIND_TO_INVOICE_TYPE = {
+    'train': '火车票',
+    'flight': '机票',
+    'hotel': '住宿票据',
+    'meal': '餐饮票据',
+    'taxi': '出租车票据',
+    'toll': '高速通行费',
+}
+
+
+def detect_invoice_kind(text: str) -> str:
+    """根据票面文字判断票据类别"""
+    if '铁路电子客票' in text:
+        return 'train'
+    if '航空运输电子客票行程单' in text:
+        return 'flight'
+    if '住宿服务' in text or '住宿费' in text:
+        return 'hotel'
+    if '餐饮服务' in text:
+        return 'meal'
+    if '通行费' in text:
+        return 'toll'
+    if '客运服务' in text or '出租' in text:
+        return 'taxi'
+    return 'other'
+
+
+def parse_stay_period(text: str, issue_date: str = '') -> Dict[str, str]:
+    """从备注等文字中解析入住、退房日期和住宿天数
+
+    Args:
+        text: 包含入离日期的文字，如"入离日期:4-23至4-25,共2天"
+        issue_date: 开票日期（YYYY年MM月DD日），日期不含年份时据此推断年份
+
+    Returns:
+        Dict: 入住日期、退房日期、住宿天数，无法解析时返回空字典
+    """
+    issue_match = DATE_PATTERN.search(issue_date or '')
+    issue_year = int(issue_match.group(1)) if issue_match else datetime.now().year
+    issue_month = int(issue_match.group(2)) if issue_match else 12
+
+    full_match = re.search(
+        r'(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?\s*[至到~]\s*(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?', text)
+    match = re.search(r'(\d{1,2})[-/.月](\d{1,2})日?\s*[至到~-]\s*(\d{1,2})[-/.月](\d{1,2})日?', text)
+    if full_match:
+        y1, m1, d1, y2, m2, d2 = (int(x) for x in full_match.groups())
+    elif match:
+        m1, d1, m2, d2 = (int(x) for x in match.groups())
+        # 入住月份晚于开票月份时说明跨年入住
+        y1 = issue_year - 1 if m1 > issue_month else issue_year
+        y2 = y1 + 1 if m2 < m1 else y1
+    else:
+        return {}
+
+    try:
+        check_in = datetime(y1, m1, d1)
+        check_out = datetime(y2, m2, d2)
+    except ValueError:
+        return {}
+
+    nights = re.search(r'共\s*(\d+)\s*[天晚]', text)
+    return {
+        '入住日期': f'{check_in.year}年{check_in.month:02d}月{check_in.day:02d}日',
+        '退房日期': f'{check_out.year}年{check_out.month:02d}月{check_out.day:02d}日',
+        '住宿天数': nights.group(1) if nights else str(max(1, (check_out - check_in).days)),
+    }
+
+
+class PDFTextExtractor:
+    """电子发票（数电票）PDF文本层提取器
+
+    直接读取PDF的文本和坐标，按发票类型定位关键字段，输出与多模态模型相同的中文字段，
+    文本层缺失或校验不通过时返回None，由调用方回退到多模态模型。
+    """
+
+    def extract(self, pdf_bytes: bytes, invoice_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """从PDF字节中提取发票信息
+
+        Args:
+            pdf_bytes: PDF文件的原始字节
+            invoice_type: 发票类型提示（当前仅用于日志）
+
+        Returns:
+            Dict: 提取的发票信息（中文字段），无法可靠提取时返回None
+        """
+        try:
+            with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+                if len(doc) == 0:
+                    return None
+                page = doc.load_page(0)
+                words = page.get_text('words')
+                page_width = page.rect.width
+        except Exception as e:
+            print(f"读取PDF文本层失败: {str(e)}")
+            return None
+
+        if not words:
+            print("PDF没有文本层，需要使用多模态模型识别")
+            return None
+
+        return self.extract_from_words(words, page_width, invoice_type)
+
+    def page_text(self, pdf_bytes: bytes, page_index: int = 0) -> str:
+        """读取PDF指定页的文本，没有文本层或读取失败时返回空字符串"""
+        try:
+            with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+                if page_index >= len(doc):
+                    return ''
+                return doc.load_page(page_index).get_text()
+        except Exception as e:
+            print(f"读取PDF文本失败: {str(e)}")
+            return ''
+
+    def extract_from_words(self, words: List[tuple], page_width: float,
+                           invoice_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """根据单页的文字及坐标提取发票信息
+
+        Args:
+            words: PyMuPDF page.get_text('words')的结果
+            page_width: 页面宽度
+            invoice_type: 发票类型提示（当前仅用于日志）
+
+        Returns:
+            Dict: 提取的发票信息（中文字段），无法可靠提取时返回None
+        """
+        rows = self._group_rows(words)
+        full_text = '\n'.join(' '.join(w[4] for w in row) for row in rows)
+        kind = detect_invoice_kind(full_text)
+        print(f"PDF文本层识别的票据类别: {kind}, 类型提示: {invoice_type}")
+
+        info = {
+            '发票号码': self._search(INVOICE_NUMBER_PATTERN, full_text) or self._find_standalone_number(words),
+            '日期': self._normalize_date(self._search(ISSUE_DATE_PATTERN, full_text)),
+        }
+
+        if kind == 'train':
+            info.update(self._extract_train(words, rows, full_text, info['日期']))
+        elif kind == 'flight':
+            info.update(self._extract_flight(full_text, info['日期']))
+        else:
+            info.update(self._extract_general(rows, full_text, page_width))
+            if kind == 'hotel':
+                info.update(self._extract_hotel(full_text, info))
+
+        info['发票类型'] = KIND_TO_INVOICE_TYPE.get(kind, '其他票据')
+        info['提取方式'] = 'PDF文本层'
+
+        errors = self.validate(info, kind)
+        if errors:
+            print(f"PDF文本层提取结果未通过校验，回退到多模态模型: {errors}")
+            return None
+        return info
+
+    def validate(self, info: Dict[str, Any], kind: str) -> List[str]:
+        """校验文本层提取结果，返回问题列表，为空表示通过"""
+        errors = []
+        if not re.fullmatch(r'\d{8,20}', str(info.get('发票号码', ''))):
+            errors.append('发票号码缺失或格式错误')
+        try:
+            if float(info.get('金额', 0)) <= 0:
+                errors.append('金额必须大于0')
+        except (TypeError, ValueError):
+            errors.append('金额无法解析')
+        if not DATE_PATTERN.fullmatch(str(info.get('日期', ''))):
+            errors.append('开票日期缺失')
+
+        if kind in ('train', 'flight'):
+            if not info.get('起始站') or not info.get('到站'):
+                errors.append('缺少起始站或到站')
+            elif info['起始站'] == info['到站']:
+                errors.append('起始站与到站相同')
+            if not DATE_PATTERN.fullmatch(str(info.get('乘坐日期', ''))):
+                errors.append('缺少乘坐日期')
+        elif kind == 'hotel':
+            if not info.get('酒店名称'):
+                errors.append('缺少酒店名称')
+        return errors
+
+    def _extract_train(self, words: List[tuple], rows: List[List[tuple]],
+                       full_text: str, issue_date: str) -> Dict[str, Any]:
+        """提取铁路电子客票字段"""
+        info = {}
+
+        # 起止站在同一行，左侧为出发站，右侧为到达站
+        for row in rows:
+            stations = [w for w in row if STATION_PATTERN.match(w[4])]
+            if len(stations) >= 2:
+                info['起始站'] = stations[0][4]
+                info['到站'] = stations[-1][4]
+                break
+
+        for word in words:
+            text = word[4]
+            if 'ride_date' not in info:
+                date = self._normalize_date(text)
+                if date and date != issue_date and DATE_PATTERN.fullmatch(text):
+                    info['ride_date'] = date
+            if '车次' not in info and TRAIN_NUMBER_PATTERN.match(text) and not text.isdigit():
+                info['车次'] = text
+
+        info['乘坐日期'] = info.pop('ride_date', '')
+        info['开车时间'] = self._search(r'(\d{1,2}:\d{2})开', full_text) or ''
+        info['座号'] = self._search(r'(\d{1,2}车\d{1,3}[A-F]?号)', full_text) or ''
+        info['座位等级'] = self._search(r'(商务座|特等座|一等座|二等座|软卧|硬卧|软座|硬座|无座)', full_text) or ''
+        info['电子客票号'] = self._search(r'电子客票号\s*[:：]?\s*(\d{10,})', full_text) or ''
+
+        # 乘客姓名与身份证号位于同一行
+        for row in rows:
+            for index, word in enumerate(row):
+                if ID_NUMBER_PATTERN.fullmatch(word[4]) and index + 1 < len(row):
+                    info['乘客姓名'] = row[index + 1][4]
+                    break
+            if '乘客姓名' in info:
+                break
+
+        amount = self._search(r'票价\s*[:：]?\s*[¥￥]\s*(\d+(?:\.\d{1,2})?)', full_text) or self._max_amount(full_text)
+        info['票价'] = amount or ''
+        info['金额'] = amount or ''
+        info['购买方名称'] = self._search(r'购买方名称\s*[:：]\s*(\S+)', full_text) or ''
+        return info
+
+    def _extract_flight(self, full_text: str, issue_date: str) -> Dict[str, Any]:
+        """提取航空运输电子客票行程单字段"""
+        dates = [self._normalize_date(m.group(0)) for m in DATE_PATTERN.finditer(full_text)]
+        travel_dates = [d for d in dates if d and d != issue_date]
+        amount = self._search(r'合计\s*[¥￥]?\s*(\d+(?:\.\d{1,2})?)', full_text) or self._max_amount(full_text)
+        return {
+            '起始站': self._search(r'自\s*[:：]\s*([一-龥]+)', full_text) or '',
+            '到站': self._search(r'至\s*[:：]\s*([一-龥]+)', full_text) or '',
+            '航班号': self._search(r'\b([A-Z0-9]{2}\d{3,4})\b', full_text) or '',
+            '乘客姓名': self._search(r'旅客姓名\s*[:：]?\s*([一-龥]{2,4})', full_text) or '',
+            '乘坐日期': travel_dates[0] if travel_dates else '',
+            '票价': amount or '',
+            '金额': amount or '',
+        }
+
+    def _extract_general(self, rows: List[List[tuple]], full_text: str, page_width: float) -> Dict[str, Any]:
+        """提取增值税电子发票的通用字段：购买方、销售方、金额、税率"""
+        info = {}
+        for row in rows:
+            for index, word in enumerate(row):
+                if not re.fullmatch(r'名称\s*[:：]?', word[4]) or index + 1 >= len(row):
+                    continue
+                value = row[index + 1][4]
+                # 购买方信息位于左半页，销售方信息位于右半页
+                if word[0] < page_width / 2:
+                    info.setdefault('购买方名称', value)
+                else:
+                    info.setdefault('销售方名称', value)
+
+        amount = self._search(r'（小写）\s*[¥￥]\s*(\d+(?:\.\d{1,2})?)', full_text) or self._max_amount(full_text)
+        info['金额'] = amount or ''
+        info['价税合计(小写)'] = amount or ''
+        tax_rate = self._search(r'(\d{1,2})\s*%', full_text)
+        if tax_rate:
+            info['税率/征收率'] = f'{tax_rate}%'
+        return info
+
+    def _extract_hotel(self, full_text: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        """提取住宿发票的酒店名称、入住和退房日期"""
+        hotel_info = {'酒店名称': info.get('销售方名称', '')}
+        hotel_info.update(parse_stay_period(full_text, info.get('日期', '')))
+        return hotel_info
+
+    def _group_rows(self, words: List[tuple]) -> List[List[tuple]]:
+        """按纵向中心把文字分组为行，每行内按横坐标排序"""
+        rows = []
+        for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+            center = (word[1] + word[3]) / 2
+            if rows and abs(rows[-1][0] - center) <= ROW_TOLERANCE:
+                rows[-1][1].append(word)
+            else:
+                rows.append((center, [word]))
+        return [sorted(row, key=lambda w: w[0]) for _, row in rows]
+
+    def _search(self, pattern, text: str) -> Optional[str]:
+        """返回第一个匹配的分组内容"""
+        match = re.search(pattern, text)
+        return match.group(1) if match else None
+
+    def _find_standalone_number(self, words: List[tuple]) -> str:
+        """发票号码与标签分离时，取独立的20位数电票号码"""
+        for word in words:
+            if re.fullmatch(r'\d{20}', word[4]):
+                return word[4]
+        return ''
+
+    def _max_amount(self, text: str) -> Optional[str]:
+        """票面最大的人民币金额通常为价税合计"""
+        amounts = [m.group(1) for m in AMOUNT_PATTERN.finditer(text)]
+        if not amounts:
+            return None
+        return max(amounts, key=float)
+
+    def _normalize_date(self, text: Optional[str]) -> str:
+        """统一为YYYY年MM月DD日格式"""
+        if not text:
+            return ''
+        match = DATE_PATTERN.search(text)
+        if not match:
+            return ''
+        year, month, day = match.groups()
+        return f'{year}年{int(month):02d}月{int(day):02d}日'
@@ -0,0 +1,167 @@
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+import fitz  # PyMuPDF
+from PIL import Image
+from config import PREVIEW_CACHE_CONFIG
+from tools.file_registry import get_file_registry
+
+IMAGE_FILE_TYPES = {'jpg', 'jpeg', 'png'}
+PREVIEW_FILE_TYPES = IMAGE_FILE_TYPES | {'pdf'}
+
+
+class PreviewCache:
+    """上传文件的缩略图缓存
+
+    每个文件ID只生成一次JPEG缩略图（PDF取首页），先查内存中的LRU缓存，再查磁盘缓存，
+    都没有时才读取原文件生成。聊天记录重新渲染时只传输几十KB的缩略图，
+    原图只在用户明确要求查看时才读取。
+    """
+
+    def __init__(self,
+                 root: Optional[str] = None,
+                 max_side: Optional[int] = None,
+                 memory_items: Optional[int] = None,
+                 disk_max_bytes: Optional[int] = None):
+        self.root = root or PREVIEW_CACHE_CONFIG['root']
+        self.max_side = max_side or PREVIEW_CACHE_CONFIG['max_side']
+        self.memory_items = memory_items or PREVIEW_CACHE_CONFIG['memory_items']
+        self.disk_max_bytes = disk_max_bytes or PREVIEW_CACHE_CONFIG['disk_max_bytes']
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def get(self, file_id: str) -> Optional[bytes]:
+        """返回文件的缩略图JPEG字节，文件不存在或类型不支持预览时返回None
+
+        Args:
+            file_id: 文件登记表中的文件ID
+
+        Returns:
+            Optional[bytes]: 缩略图JPEG字节
+        """
+        if not file_id:
+            return None
+        with self._lock:
+            if file_id in self._memory:
+                self._memory.move_to_end(file_id)
+                return self._memory[file_id]
+
+        preview = self._read_disk(file_id)
+        if preview is None:
+            preview = self._generate(file_id)
+            if preview is None:
+                return None
+            self._write_disk(file_id, preview)
+
+        with self._lock:
+            self._memory[file_id] = preview
+            self._memory.move_to_end(file_id)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return preview
+
+    def invalidate(self, file_id: str) -> None:
+        """删除文件的缩略图缓存"""
+        with self._lock:
+            self._memory.pop(file_id, None)
+        try:
+            os.unlink(self._disk_path(file_id))
+        except FileNotFoundError:
+            pass
+
+    def _disk_path(self, file_id: str) -> str:
+        return os.path.join(self.root, f'{file_id}_{self.max_side}.jpg')
+
+    def _read_disk(self, file_id: str) -> Optional[bytes]:
+        path = self._disk_path(file_id)
+        try:
+            with open(path, 'rb') as preview_file:
+                preview = preview_file.read()
+            # 更新修改时间，磁盘淘汰时按修改时间判断最近使用
+            os.utime(path)
+            return preview
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, file_id: str, preview: bytes) -> None:
+        """写入磁盘缓存，总大小超过上限时删除最久未使用的缩略图"""
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(preview)
+        path = self._disk_path(file_id)
+        os.replace(temp_path, path)
+
+        entries = [entry for entry in os.scandir(self.root) if entry.name.endswith('.jpg')]
+        total_bytes = sum(entry.stat().st_size for entry in entries)
+        if total_bytes <= self.disk_max_bytes:
+            return
+        for entry in sorted(entries, key=lambda item: item.stat().st_mtime):
+            if total_bytes <= self.disk_max_bytes:
+                break
+            if entry.path == path:
+                continue
+            total_bytes -= entry.stat().st_size
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _generate(self, file_id: str) -> Optional[bytes]:
+        """读取原文件生成缩略图，图片通过内存映射读取，PDF按缩略图尺寸直接渲染首页"""
+        registry = get_file_registry()
+        file_meta = registry.describe(file_id)
+        if file_meta is None:
+            return None
+        file_type = (file_meta['file_type'] or '').lower()
+        if file_type not in PREVIEW_FILE_TYPES:
+            return None
+
+        try:
+            if file_type == 'pdf':
+                pdf_bytes = registry.get_bytes(file_id)
+                if not pdf_bytes:
+                    return None
+                image = self._render_pdf_thumbnail(pdf_bytes)
+            else:
+                with registry.open_view(file_id) as view:
+                    if not view:
+                        return None
+                    with Image.open(view) as img:
+                        # draft让JPEG在解码时直接按比例缩小，避免先解码全尺寸图像
+                        img.draft('RGB', (self.max_side, self.max_side))
+                        img.thumbnail((self.max_side, self.max_side))
+                        image = img.convert('RGB')
+        except Exception as e:
+            print(f"生成文件 {file_meta['file_name']} 的缩略图失败: {str(e)}")
+            return None
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=PREVIEW_CACHE_CONFIG['jpeg_quality'])
+        print(f"已生成文件 {file_meta['file_name']} 的缩略图，大小: {buffer.tell()}字节")
+        return buffer.getvalue()
+
+    def _render_pdf_thumbnail(self, pdf_bytes: bytes) -> Image.Image:
+        """按缩略图尺寸渲染PDF首页，渲染量很小，直接在当前进程中完成"""
+        with fitz.open(stream=pdf_bytes, filetype='pdf') as doc:
+            page = doc.load_page(0)
+            zoom = min(self.max_side / max(page.rect.width, page.rect.height), 2.0)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+
+_preview_cache = None
+_preview_cache_lock = threading.Lock()
+
+
+def get_preview_cache() -> PreviewCache:
+    """获取进程内共享的缩略图缓存"""
+    global _preview_cache
+    if _preview_cache is None:
+        with _preview_cache_lock:
+            if _preview_cache is None:
+                _preview_cache = PreviewCache()
+    return _preview_cache
@@ -1,9 +1,20 @@
 import json
+import hashlib
+import uuid
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 import pandas as pd
 from qwen_agent.tools.base import BaseTool, register_tool
-from config import REIMBURSEMENT_TYPE_MAPPING, EXPENSE_CATEGORY_MAPPING
+from config import REIMBURSEMENT_TYPE_MAPPING, EXPENSE_CATEGORY_MAPPING, HOTEL_CAP_CONFIG
+from tools.duplicate_index import get_duplicate_index, make_invoice_key
+from tools.trip_matcher import TripMatcher, LEG_NAMES
+from tools.gazetteer import canonical_place
+from tools.hotel_coverage import check_hotel_coverage
+
+def new_claim_id() -> str:
+    """生成新的报销单编号，同一张报销单在增删发票、重新生成时应沿用同一个编号"""
+    return f"BX{uuid.uuid4().hex[:10].upper()}"
+
 
 @register_tool('reimbursement_generator')
 class ReimbursementGenerator(BaseTool):
@@ -25,7 +36,8 @@ class ReimbursementGenerator(BaseTool):
             '分摊原因': {'type': 'string', 'description': '分摊原因'},
             '住宿费超标金额': {'type': 'string', 'description': '住宿费超标金额'},
             '城市内公务交通车费超标金额': {'type': 'string', 'description': '城市内公务交通车费超标金额'},
-            '超标说明': {'type': 'string', 'description': '超标说明'}
+            '超标说明': {'type': 'string', 'description': '超标说明'},
+            'claim_id': {'type': 'string', 'description': '报销单编号，不提供时根据发票自动生成'}
         },
         'required': ['trips', 'invoices']
     }]
@@ -53,6 +65,18 @@ class ReimbursementGenerator(BaseTool):
                     'message': '无法生成报销单：没有发票信息'
                 }, ensure_ascii=False)
             
+            # 检查发票是否重复或已在其他报销单中报销，有问题时不生成报销单
+            claim_id = generation_data.get('claim_id') or self._make_claim_id(invoices)
+            duplicate_index = get_duplicate_index()
+            if duplicate_index is not None:
+                duplicate_issues = duplicate_index.check_claimable(invoices, claim_id)
+                if duplicate_issues:
+                    return json.dumps({
+                        'status': 'error',
+                        'message': '无法生成报销单：' + '; '.join(duplicate_issues),
+                        'duplicate_issues': duplicate_issues
+                    }, ensure_ascii=False)
+            
             # 预处理发票信息，确保交通票据使用travel_date而不是date
             invoices = self._preprocess_invoices(invoices)
             
@@ -63,19 +87,33 @@ class ReimbursementGenerator(BaseTool):
                 'warnings': []
             }
             
+            # 住宿覆盖情况同时用于校验和计算住宿晚数，只计算一次
+            hotel_coverage = check_hotel_coverage(trips, invoices)
+            
             if not confirmed:
                 # 检查票据是否完整，例如往返票是否齐全
-                validation_results = self._validate_invoices_against_trips(trips, invoices)
+                validation_results = self._validate_invoices_against_trips(trips, invoices, hotel_coverage)
             
             # 生成报销单
-            reimbursement_form = self._generate_reimbursement_form(trips, invoices, generation_data)
+            reimbursement_form = self._generate_reimbursement_form(trips, invoices, generation_data, hotel_coverage)
             
             # 构建表格展示
             expense_summary = self._generate_expense_summary(reimbursement_form)
             
+            # 用户确认后在同一事务中检查并登记发票的报销状态，防止并发确认时同一张发票被两张报销单报销
+            if confirmed and duplicate_index is not None:
+                claim_result = duplicate_index.claim(invoices, claim_id)
+                if claim_result['issues']:
+                    return json.dumps({
+                        'status': 'error',
+                        'message': '无法确认报销单：' + '; '.join(claim_result['issues']),
+                        'duplicate_issues': claim_result['issues']
+                    }, ensure_ascii=False)
+            
             result = {
                 'status': 'success',
                 'message': '报销单已成功生成',
+                'claim_id': claim_id,
                 'validation_results': validation_results,
                 'reimbursement_form': reimbursement_form,
                 'expense_summary': expense_summary
@@ -93,6 +131,16 @@ class ReimbursementGenerator(BaseTool):
                 'message': f'报销单生成失败: {str(e)}'
             }, ensure_ascii=False)
     
+    def _make_claim_id(self, invoices: List[Dict]) -> str:
+        """调用方未提供报销单编号时根据发票生成编号，同一组发票重新生成时编号不变
+        
+        增删发票后编号会改变，已在原编号下登记的发票会被视为在其他报销单中报销，
+        因此Web界面和批量报销为每张报销单生成固定的编号（new_claim_id）并通过claim_id传入。
+        """
+        invoice_keys = sorted(make_invoice_key(inv) or str(inv.get('invoice_id', '')) for inv in invoices)
+        digest = hashlib.sha1('\n'.join(invoice_keys).encode('utf-8')).hexdigest()[:10].upper()
+        return f"BX{digest}"
+    
     def _preprocess_invoices(self, invoices: List[Dict]) -> List[Dict]:
         """预处理发票信息，确保交通票据使用travel_date作为显示日期"""
         processed_invoices = []
@@ -116,121 +164,64 @@ class ReimbursementGenerator(BaseTool):
             
         return processed_invoices
     
-    def _validate_invoices_against_trips(self, trips: List[Dict], invoices: List[Dict]) -> Dict:
-        """验证发票是否与行程匹配，使用更加灵活的验证规则"""
+    def _validate_invoices_against_trips(self, trips: List[Dict], invoices: List[Dict],
+                                         hotel_coverage: Optional[Dict] = None) -> Dict:
+        """验证发票是否与行程匹配，使用更加灵活的验证规则，hotel_coverage为已计算的住宿覆盖情况"""
         validation_results = {
             'is_valid': True,
             'issues': [],
             'warnings': []  # 增加警告字段，用于展示可能的问题但不阻止提交
         }
         
-        # 找出所有交通类发票
-        transportation_invoices = [
-            inv for inv in invoices 
-            if inv.get('invoice_type') in ['火车票', '机票', '汽车票']
-        ]
+        # 行程的去程、回程与交通票据一一匹配，每张票据最多对应一段行程
+        trip_matching = TripMatcher().match(trips, invoices)
+        validation_results['trip_matching'] = trip_matching
         
-        # 调试输出
-        print(f"找到{len(transportation_invoices)}张交通票据:")
-        for i, inv in enumerate(transportation_invoices):
-            print(f"  票据{i+1}: 从{inv.get('departure','')}到{inv.get('destination','')}")
+        for trip_index in trip_matching['incomplete_trips']:
+            validation_results['warnings'].append(f"行程 #{trip_index+1} 缺少出发地或目的地信息")
         
-        # 检查每个行程的往返票
-        for i, trip in enumerate(trips):
-            departure = trip.get('departure_place', '')
-            arrival = trip.get('arrival_place', '')
-            round_trip = trip.get('round_trip', True)
-            
-            if not departure or not arrival:
-                validation_results['warnings'].append(f"行程 #{i+1} 缺少出发地或目的地信息")
-                continue
-            
-            print(f"检查行程{i+1}: 从{departure}到{arrival}, 是否往返: {round_trip}")
-            
-            # 检查去程票 - 使用改进的地点匹配算法
-            matching_outbound = []
-            for inv in transportation_invoices:
-                if (self._is_place_match(inv.get('departure', ''), departure) and 
-                    self._is_place_match(inv.get('destination', ''), arrival)):
-                    matching_outbound.append(inv)
-                    
-            has_outbound = len(matching_outbound) > 0
-            
-            if not has_outbound:
-                print(f"  未找到从{departure}到{arrival}的去程票据")
-                # 在没有找到确切匹配的情况下，再尝试模糊匹配
-                for inv in transportation_invoices:
-                    inv_dep = inv.get('departure', '')
-                    inv_dest = inv.get('destination', '')
-                    print(f"  比较: '{inv_dep}'-'{inv_dest}' vs '{departure}'-'{arrival}'")
-                
-                # 改为警告而不是错误，允许用户继续提交
-                validation_results['warnings'].append(f"可能缺少从 {departure} 到 {arrival} 的去程票据")
-            else:
-                print(f"  找到{len(matching_outbound)}张从{departure}到{arrival}的去程票据")
-            
-            # 检查回程票（如果是往返行程）
-            if round_trip:
-                matching_return = []
-                for inv in transportation_invoices:
-                    if (self._is_place_match(inv.get('departure', ''), arrival) and 
-                        self._is_place_match(inv.get('destination', ''), departure)):
-                        matching_return.append(inv)
-                        
-                has_return = len(matching_return) > 0
-                
-                if not has_return:
-                    print(f"  未找到从{arrival}到{departure}的回程票据")
-                    # 在没有找到确切匹配的情况下，再尝试模糊匹配
-                    for inv in transportation_invoices:
-                        inv_dep = inv.get('departure', '')
-                        inv_dest = inv.get('destination', '')
-                        print(f"  比较: '{inv_dep}'-'{inv_dest}' vs '{arrival}'-'{departure}'")
-                    
-                    # 改为警告而不是错误，允许用户继续提交
-                    validation_results['warnings'].append(f"可能缺少从 {arrival} 到 {departure} 的回程票据")
-                else:
-                    print(f"  找到{len(matching_return)}张从{arrival}到{departure}的回程票据")
+        for leg in trip_matching['unmatched_legs']:
+            # 改为警告而不是错误，允许用户继续提交
+            validation_results['warnings'].append(
+                f"可能缺少从 {leg['departure']} 到 {leg['arrival']} 的{LEG_NAMES[leg['leg']]}票据"
+            )
         
-        # 检查酒店住宿发票
-        hotel_invoices = [inv for inv in invoices if inv.get('invoice_type') == '酒店住宿发票']
-        print(f"找到{len(hotel_invoices)}张酒店住宿发票")
+        for invoice_index in trip_matching['unused_invoices']:
+            inv = invoices[invoice_index]
+            travel_date = inv.get('travel_date') or inv.get('date', '')
+            validation_results['warnings'].append(
+                f"交通票据 {inv.get('departure', '')}→{inv.get('destination', '')}（{travel_date}）未对应任何行程"
+            )
         
-        for trip in trips:
-            departure_date = trip.get('departure_date')
-            arrival_date = trip.get('arrival_date')
-            days = trip.get('days', 1)
-            
-            if not departure_date or not arrival_date:
-                continue
-                
-            print(f"检查行程: 从{departure_date}到{arrival_date}, 共{days}天")
-            
-            # 检查是否有覆盖整个行程的酒店发票
-            covered_nights = 0
-            for inv in hotel_invoices:
-                check_in = inv.get('check_in_date')
-                check_out = inv.get('check_out_date')
-                nights = inv.get('nights', 1)  # 默认至少1晚
-                
-                print(f"  酒店发票: 入住{check_in}至{check_out}, {nights}晚")
-                
-                # 放宽匹配条件，只要日期有重叠就算有效
-                if check_in and check_out:
-                    # 检查是否与行程日期有重叠
-                    if not (check_out < departure_date or check_in > arrival_date):
-                        covered_nights += nights
-                        print(f"  匹配成功，累计住宿{covered_nights}晚")
-            
-            # 根据行程天数计算预期住宿晚数
-            expected_nights = max(0, days - 1)  # 出差天数减1为需要住宿的晚数，至少为0
-            
-            if covered_nights < expected_nights:
-                print(f"  酒店发票覆盖不完整: 需要{expected_nights}晚，实际只有{covered_nights}晚")
+        # 检查住宿发票对每个行程的每一晚是否恰好覆盖一次
+        if hotel_coverage is None:
+            hotel_coverage = check_hotel_coverage(trips, invoices)
+        validation_results['hotel_coverage'] = hotel_coverage
+        
+        for coverage in hotel_coverage['trips']:
+            trip_no = coverage['trip_index'] + 1
+            if coverage['uncovered_nights']:
                 # 改为警告而不是错误，允许用户继续提交
-                validation_results['warnings'].append(f"酒店住宿发票可能覆盖不完整，出差{days}天但只有{covered_nights}晚的住宿记录")
-            else:
-                print(f"  酒店发票覆盖完整: 需要{expected_nights}晚，实际有{covered_nights}晚")
+                validation_results['warnings'].append(
+                    f"行程 #{trip_no} 需住宿{coverage['expected_nights']}晚，"
+                    f"其中{len(coverage['uncovered_nights'])}晚没有住宿发票：{coverage['uncovered_text']}"
+                )
+            if coverage['double_booked_nights']:
+                validation_results['warnings'].append(
+                    f"行程 #{trip_no} 在{coverage['double_booked_text']}有多张住宿发票重复覆盖"
+                )
+        
+        for invoice_index in hotel_coverage['outside_invoices']:
+            inv = invoices[invoice_index]
+            validation_results['warnings'].append(
+                f"住宿发票 {inv.get('hotel_name', '') or inv.get('invoice_id', '')}"
+                f"（{inv.get('check_in_date', '')}至{inv.get('check_out_date', '')}）不在任何行程日期内"
+            )
+        for invoice_index in hotel_coverage['unparsed_invoices']:
+            inv = invoices[invoice_index]
+            validation_results['warnings'].append(
+                f"住宿发票 {inv.get('hotel_name', '') or inv.get('invoice_id', '')} 缺少有效的入住或退房日期"
+            )
         
         # 如果只有警告但没有错误，仍然允许生成报销单
         if validation_results['warnings'] and not validation_results['issues']:
@@ -238,62 +229,9 @@ class ReimbursementGenerator(BaseTool):
             
         return validation_results
     
-    def _is_place_match(self, station_name: str, city_name: str) -> bool:
-        """检查站名是否与城市名匹配，使用通用灵活的匹配规则
-        
-        Args:
-            station_name: 车站/机场名称
-            city_name: 城市名称
-            
-        Returns:
-            bool: 如果站名匹配城市名则返回True
-        """
-        if not station_name or not city_name:
-            return False
-            
-        # 标准化处理，去除空格并转为小写
-        station = station_name.strip().lower()
-        city = city_name.strip().lower()
-        
-        # 1. 直接包含关系
-        if city in station:
-            return True
-            
-        # 2. 处理常见车站/机场名称格式
-        common_suffixes = ["站", "东站", "西站", "南站", "北站", "机场", "国际机场"]
-        for suffix in common_suffixes:
-            if f"{city}{suffix}" in station:
-                return True
-                
-        # 3. 两个名称的编辑距离较小，可能是相同地点的不同表达
-        # 对于短名称（如"广州"），要求更高的相似度
-        if len(city) <= 2:
-            # 对于短城市名(1-2个字)，必须包含在站名中
-            return city in station
-        else:
-            # 对于较长城市名，如果站名中包含城市名的大部分字符，视为匹配
-            # 例如"福州"和"福州长乐国际机场"
-            char_match_count = sum(1 for c in city if c in station)
-            if char_match_count >= len(city) * 0.7:  # 至少70%的字符匹配
-                return True
-        
-        # 4. 处理行政区划简称
-        # 例如"北京市"和"北京"，"广州市"和"广州"
-        if city.endswith("市") or city.endswith("省"):
-            short_city = city[:-1]  # 移除"市"或"省"字
-            if short_city in station:
-                return True
-                
-        # 5. 处理某些特定的机场与城市关系 (这部分可以通过配置文件加载，而不是硬编码)
-        # 例如"虹桥"和"浦东"代表"上海"
-        
-        # 6. 允许模糊匹配
-        # 在生产环境中，此处可以集成更复杂的自然语言处理或模糊匹配算法
-        
-        return False
-    
-    def _generate_reimbursement_form(self, trips: List[Dict], invoices: List[Dict], data: Dict) -> Dict:
-        """生成报销单"""
+    def _generate_reimbursement_form(self, trips: List[Dict], invoices: List[Dict], data: Dict,
+                                     hotel_coverage: Optional[Dict] = None) -> Dict:
+        """生成报销单，hotel_coverage为已计算的住宿覆盖情况"""
         # 确定报销类型
         reimbursement_type = self._determine_reimbursement_type(trips)
         
@@ -321,14 +259,38 @@ class ReimbursementGenerator(BaseTool):
             "超标说明": data.get("超标说明", "无")
         }
         
+        # 住宿晚数按行程日期内实际有住宿发票的晚数计算，重叠的发票和嵌套的行程只计一次
+        if hotel_coverage is None:
+            hotel_coverage = check_hotel_coverage(trips, invoices)
+        hotel_nights = hotel_coverage['total_nights']
+        
         # 生成报销单
         reimbursement_form = {
             '报销类型': reimbursement_type,
             '报销总金额': total_amount,
+            '住宿晚数': hotel_nights,
             '行程信息': trips,
             '费用明细': categorized_invoices
         }
         
+        # 配置了该报销类型的住宿费标准时，按住宿晚数计算标准金额；用户未填写超标金额时自动填入。
+        # 住宿费只计算计入住宿晚数的部分：日期无法解析或不在行程日期内的发票不计入，部分在行程外的发票按晚数折算，
+        # 这些发票在校验结果中另有提醒
+        nightly_cap = HOTEL_CAP_CONFIG['nightly_caps'].get(reimbursement_type)
+        if nightly_cap:
+            hotel_amount = 0.0
+            for invoice_index, (inside_nights, stay_nights) in hotel_coverage['invoice_nights'].items():
+                if inside_nights:
+                    hotel_amount += float(invoices[invoice_index].get('amount', 0) or 0) * inside_nights / stay_nights
+            hotel_standard = nightly_cap * hotel_nights
+            over_amount = max(0.0, hotel_amount - hotel_standard)
+            reimbursement_form['住宿费标准金额'] = round(hotel_standard, 2)
+            if over_amount > 0 and str(form_fields['住宿费超标金额']).strip() in ('', '0'):
+                form_fields['住宿费超标金额'] = f"{over_amount:.2f}"
+                if form_fields['超标说明'] in ('', '无'):
+                    form_fields['超标说明'] = (f"住宿{hotel_nights}晚，标准{nightly_cap:g}元/晚，"
+                                           f"住宿费{hotel_amount:.2f}元，超标{over_amount:.2f}元")
+        
         # 添加用户填写的字段
         reimbursement_form.update(form_fields)
         
@@ -337,9 +299,9 @@ class ReimbursementGenerator(BaseTool):
     def _determine_reimbursement_type(self, trips: List[Dict]) -> str:
         """根据出差地点确定报销类型"""
         for trip in trips:
-            destination = trip.get('arrival_place', '')
+            destination = canonical_place(trip.get('arrival_place', ''))
             
-            # 检查目的地是否在特定的分类中
+            # 检查目的地所属城市是否在特定的分类中
             for reim_type, cities in REIMBURSEMENT_TYPE_MAPPING.items():
                 if destination in cities:
                     return reim_type
@@ -393,6 +355,10 @@ class ReimbursementGenerator(BaseTool):
         # 生成表格
         if summary_data:
             df = pd.DataFrame(summary_data)
-            return df.to_markdown(index=False)
+            summary = df.to_markdown(index=False)
+            if '住宿费标准金额' in reimbursement_form:
+                summary += (f"\n\n住宿{reimbursement_form['住宿晚数']}晚，住宿费标准{reimbursement_form['住宿费标准金额']}元，"
+                            f"超标金额{reimbursement_form['住宿费超标金额']}元")
+            return summary
         else:
             return "暂无费用汇总信息" 
\ No newline at end of file
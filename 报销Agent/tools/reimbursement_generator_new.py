@@ -5,6 +5,7 @@ from typing import Dict, List, Any, Optional
 import pandas as pd
 from qwen_agent.tools.base import BaseTool, register_tool
 from config import REIMBURSEMENT_TYPE_MAPPING, EXPENSE_CATEGORY_MAPPING
+from tools.gazetteer import resolve_city, canonical_place
 
 @register_tool('reimbursement_generator')
 class ReimbursementGenerator(BaseTool):
@@ -200,18 +201,24 @@ class ReimbursementGenerator(BaseTool):
         return validation_results
     
     def _is_place_match(self, station_name: str, city_name: str) -> bool:
-        """检查站名是否包含城市名称
+        """检查站名是否属于该城市
+        
+        站名和城市名都通过地名对照表解析为城市后比较；站名不在对照表中时，检查站名是否包含城市名
         
         Args:
             station_name: 车站/机场名称
             city_name: 城市名称
             
         Returns:
-            bool: 如果站名包含城市名则返回True
+            bool: 如果站名属于该城市则返回True
         """
         if not station_name or not city_name:
             return False
-        return city_name in station_name
+        city = canonical_place(city_name)
+        station_city = resolve_city(station_name)
+        if station_city:
+            return station_city == city
+        return city in station_name
     
     def _generate_reimbursement_form(self, trips: List[Dict], invoices: List[Dict], data: Dict) -> Dict:
         """生成报销单"""
@@ -243,9 +250,9 @@ class ReimbursementGenerator(BaseTool):
     def _determine_reimbursement_type(self, trips: List[Dict]) -> str:
         """根据出差地点确定报销类型"""
         for trip in trips:
-            destination = trip.get('arrival_place', '')
+            destination = canonical_place(trip.get('arrival_place', ''))
             
-            # 检查目的地是否在特定的分类中
+            # 检查目的地所属城市是否在特定的分类中
             for reim_type, cities in REIMBURSEMENT_TYPE_MAPPING.items():
                 if destination in cities:
                     return reim_type
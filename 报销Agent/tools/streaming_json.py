@@ -0,0 +1,132 @@
+import json
+from typing import Dict, List, Any, Tuple
+
+
+class IncrementalJSONParser:
+    """增量解析模型流式输出中的JSON对象
+
+    每次feed一段新生成的文本，顶层字段的值一旦完整就立即返回，不必等待整个对象生成完毕。
+    对象之前的```json等前缀会被跳过。
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self._state = 'seek_object'
+        self._key_chars: List[str] = []
+        self._value_chars: List[str] = []
+        self._value_depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = ''
+
+    @property
+    def done(self) -> bool:
+        """顶层对象是否已经结束"""
+        return self._state == 'done'
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """输入新生成的文本
+
+        Args:
+            text: 模型新输出的一段文本
+
+        Returns:
+            List[Tuple[str, Any]]: 本次新完成的(字段名, 值)
+        """
+        completed = []
+        for char in text:
+            field = self._consume(char)
+            if field:
+                completed.append(field)
+        return completed
+
+    def _consume(self, char: str):
+        state = self._state
+        if state == 'seek_object':
+            if char == '{':
+                self._state = 'seek_key'
+        elif state == 'seek_key':
+            if char == '"':
+                self._key_chars = []
+                self._escape = False
+                self._state = 'in_key'
+            elif char == '}':
+                self._state = 'done'
+        elif state == 'in_key':
+            if self._escape:
+                self._escape = False
+                self._key_chars.append(char)
+            elif char == '\\':
+                self._escape = True
+                self._key_chars.append(char)
+            elif char == '"':
+                self._key = self._decode_string(''.join(self._key_chars))
+                self._state = 'seek_colon'
+            else:
+                self._key_chars.append(char)
+        elif state == 'seek_colon':
+            if char == ':':
+                self._value_chars = []
+                self._value_depth = 0
+                self._in_string = False
+                self._escape = False
+                self._state = 'seek_value'
+        elif state == 'seek_value':
+            if not char.isspace():
+                self._state = 'in_value'
+                return self._consume_value(char)
+        elif state == 'in_value':
+            return self._consume_value(char)
+        return None
+
+    def _consume_value(self, char: str):
+        """逐字符读取字段值，值完整时返回(字段名, 值)"""
+        if self._in_string:
+            self._value_chars.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._value_depth == 0:
+                    return self._finish_value('seek_key')
+            return None
+
+        if char == '"':
+            self._in_string = True
+            self._value_chars.append(char)
+        elif char in '{[':
+            self._value_depth += 1
+            self._value_chars.append(char)
+        elif char in '}]':
+            if self._value_depth == 0:
+                # 顶层对象结束，同时结束当前的数字、布尔等简单值
+                return self._finish_value('done')
+            self._value_depth -= 1
+            self._value_chars.append(char)
+            if self._value_depth == 0:
+                return self._finish_value('seek_key')
+        elif char == ',' and self._value_depth == 0:
+            return self._finish_value('seek_key')
+        else:
+            self._value_chars.append(char)
+        return None
+
+    def _finish_value(self, next_state: str):
+        self._state = next_state
+        raw_value = ''.join(self._value_chars).strip()
+        if not raw_value:
+            return None
+        try:
+            value = json.loads(raw_value)
+        except json.JSONDecodeError:
+            value = raw_value
+        self.fields[self._key] = value
+        return self._key, value
+
+    def _decode_string(self, raw: str) -> str:
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return raw
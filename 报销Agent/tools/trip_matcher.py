@@ -0,0 +1,242 @@
+import datetime
+from collections import defaultdict, deque
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from config import TRIP_MATCH_CONFIG
+from tools.invoice_validator import parse_invoice_date
+from tools.gazetteer import resolve_city, canonical_place, normalize_place
+
+TRANSPORT_INVOICE_TYPES = ['火车票', '机票', '汽车票']
+
+LEG_NAMES = {'outbound': '去程', 'return': '回程'}
+
+
+class CityResolver:
+    """把票据上的站名解析为行程中出现的城市
+
+    先通过地名对照表解析站名所属的城市；对照表中没有的站名，在行程城市中查找站名包含的最长城市名。
+    同一站名只解析一次。
+    """
+
+    def __init__(self, cities: Iterable[str]):
+        self.cities = sorted({city for city in cities if city}, key=len, reverse=True)
+        self._cache = {}
+
+    def resolve(self, place: str) -> Optional[str]:
+        if place not in self._cache:
+            city = resolve_city(place)
+            if city is None:
+                name = normalize_place(place)
+                city = next((city for city in self.cities if city in name), None)
+            self._cache[place] = city
+        return self._cache[place]
+
+
+def _min_cost_flow(supplies: Dict[datetime.date, int],
+                   capacities: Dict[datetime.date, int],
+                   tolerance_days: int) -> Dict[Tuple[datetime.date, datetime.date], int]:
+    """按日期聚合的最小费用最大流
+
+    同一天的行程段之间、同一天的票据之间可以互换，因此按日期聚合为节点，节点数只与不同日期的数量有关，
+    与行程段和票据的数量无关。行程日期与票据日期相差不超过容差时连边，费用为相差天数。
+    用最短增广路求解，得到的是匹配数量最多的方案中日期偏差之和最小的一个。
+
+    Args:
+        supplies: {行程日期: 该日期的行程段数}
+        capacities: {票据日期: 该日期的票据数}
+        tolerance_days: 允许相差的天数
+
+    Returns:
+        Dict: {(行程日期, 票据日期): 匹配数量}
+    """
+    leg_dates = sorted(supplies)
+    invoice_dates = sorted(capacities)
+    source, sink = 0, 1 + len(leg_dates) + len(invoice_dates)
+    graph = [[] for _ in range(sink + 1)]
+    # 边保存为[终点, 剩余容量, 费用, 反向边在终点邻接表中的位置]
+    def add_edge(start, end, capacity, cost):
+        graph[start].append([end, capacity, cost, len(graph[end])])
+        graph[end].append([start, 0, -cost, len(graph[start]) - 1])
+
+    invoice_node = {invoice_date: 1 + len(leg_dates) + index for index, invoice_date in enumerate(invoice_dates)}
+    for index, leg_date in enumerate(leg_dates):
+        add_edge(source, 1 + index, supplies[leg_date], 0)
+        for offset in range(-tolerance_days, tolerance_days + 1):
+            invoice_date = leg_date + datetime.timedelta(days=offset)
+            if invoice_date in invoice_node:
+                add_edge(1 + index, invoice_node[invoice_date], supplies[leg_date], abs(offset))
+    for invoice_date, node in invoice_node.items():
+        add_edge(node, sink, capacities[invoice_date], 0)
+
+    while True:
+        # 残量网络中有负费用的反向边，用SPFA求最短路
+        distance = [float('inf')] * (sink + 1)
+        previous = [None] * (sink + 1)
+        in_queue = [False] * (sink + 1)
+        distance[source] = 0
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            in_queue[node] = False
+            for edge_index, (end, capacity, cost, _) in enumerate(graph[node]):
+                if capacity > 0 and distance[node] + cost < distance[end]:
+                    distance[end] = distance[node] + cost
+                    previous[end] = (node, edge_index)
+                    if not in_queue[end]:
+                        in_queue[end] = True
+                        queue.append(end)
+        if previous[sink] is None:
+            break
+        flow = float('inf')
+        node = sink
+        while node != source:
+            start, edge_index = previous[node]
+            flow = min(flow, graph[start][edge_index][1])
+            node = start
+        node = sink
+        while node != source:
+            start, edge_index = previous[node]
+            edge = graph[start][edge_index]
+            edge[1] -= flow
+            graph[node][edge[3]][1] += flow
+            node = start
+
+    result = {}
+    for index, leg_date in enumerate(leg_dates):
+        for end, capacity, cost, reverse in graph[1 + index]:
+            if end != source and cost >= 0:
+                flow = graph[end][reverse][1]
+                if flow:
+                    result[(leg_date, invoice_dates[end - 1 - len(leg_dates)])] = flow
+    return result
+
+
+class TripMatcher:
+    """行程与交通票据匹配器
+
+    每个行程拆分为去程和往返行程的回程两段，每张交通票据只归一化一次为（出发城市，到达城市，日期），
+    按城市对分桶，桶内按日期聚合后求最小日期偏差的最优指派，保证每张票据最多对应一段行程。无法确定日期的票据和行程段最后在同城市对内补充匹配。
+    """
+
+    def __init__(self, date_tolerance_days: Optional[int] = None):
+        self.date_tolerance_days = (TRIP_MATCH_CONFIG['date_tolerance_days']
+                                    if date_tolerance_days is None else date_tolerance_days)
+
+    def match(self, trips: List[Dict[str, Any]], invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """匹配行程段和交通票据
+
+        Args:
+            trips: 行程信息，使用departure_place、arrival_place、departure_date、arrival_date、round_trip
+            invoices: 发票信息，只处理交通类票据，使用departure、destination、travel_date或date
+
+        Returns:
+            Dict: matched为匹配结果（行程序号、去程/回程、发票序号），unmatched_legs为未找到票据的行程段，
+                  unused_invoices为未对应任何行程段的交通票据序号，incomplete_trips为缺少地点的行程序号，
+                  序号均为输入列表中的下标
+        """
+        legs, incomplete_trips = self._build_legs(trips)
+        resolver = CityResolver(city for leg in legs for city in (leg['departure'], leg['arrival']))
+
+        # 每张票据只解析一次，按城市对分桶
+        transport_indexes = [index for index, invoice in enumerate(invoices)
+                             if invoice.get('invoice_type') in TRANSPORT_INVOICE_TYPES]
+        invoice_buckets = defaultdict(list)
+        for index in transport_indexes:
+            invoice = invoices[index]
+            departure = resolver.resolve(invoice.get('departure', ''))
+            destination = resolver.resolve(invoice.get('destination', ''))
+            if departure and destination:
+                travel_date = parse_invoice_date(invoice.get('travel_date') or invoice.get('date'))
+                invoice_buckets[(departure, destination)].append((index, travel_date))
+
+        leg_buckets = defaultdict(list)
+        for leg_index, leg in enumerate(legs):
+            leg_buckets[(leg['departure'], leg['arrival'])].append(leg_index)
+
+        invoice_of_leg = {}
+        for key, leg_indexes in leg_buckets.items():
+            invoice_of_leg.update(self._match_bucket(
+                [(leg_index, legs[leg_index]['date']) for leg_index in leg_indexes],
+                invoice_buckets.get(key, [])
+            ))
+
+        matched = []
+        unmatched_legs = []
+        for leg_index, leg in enumerate(legs):
+            entry = {key: value for key, value in leg.items() if key != 'date'}
+            entry['date'] = leg['date'].isoformat() if leg['date'] else ''
+            if leg_index in invoice_of_leg:
+                entry['invoice_index'] = invoice_of_leg[leg_index]
+                matched.append(entry)
+            else:
+                unmatched_legs.append(entry)
+        used = set(invoice_of_leg.values())
+        unused_invoices = [index for index in transport_indexes if index not in used]
+
+        print(f"行程匹配: {len(legs)}段行程，{len(transport_indexes)}张交通票据，"
+              f"匹配{len(matched)}段，未匹配行程{len(unmatched_legs)}段，未使用票据{len(unused_invoices)}张")
+        return {
+            'matched': matched,
+            'unmatched_legs': unmatched_legs,
+            'unused_invoices': unused_invoices,
+            'incomplete_trips': incomplete_trips
+        }
+
+    def _build_legs(self, trips: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[int]]:
+        """把行程拆分为去程和回程"""
+        legs = []
+        incomplete_trips = []
+        for trip_index, trip in enumerate(trips):
+            departure = canonical_place(trip.get('departure_place', ''))
+            arrival = canonical_place(trip.get('arrival_place', ''))
+            if not departure or not arrival:
+                incomplete_trips.append(trip_index)
+                continue
+            legs.append({'trip_index': trip_index, 'leg': 'outbound',
+                         'departure': departure, 'arrival': arrival,
+                         'date': parse_invoice_date(trip.get('departure_date'))})
+            if trip.get('round_trip', True):
+                legs.append({'trip_index': trip_index, 'leg': 'return',
+                             'departure': arrival, 'arrival': departure,
+                             'date': parse_invoice_date(trip.get('arrival_date'))})
+        return legs, incomplete_trips
+
+    def _match_bucket(self,
+                      legs: List[Tuple[int, Optional[datetime.date]]],
+                      invoices: List[Tuple[int, Optional[datetime.date]]]) -> Dict[int, int]:
+        """在同一城市对内匹配行程段和票据，返回{行程段序号: 发票序号}"""
+        dated_legs = [item for item in legs if item[1] is not None]
+        dated_invoices = [item for item in invoices if item[1] is not None]
+
+        result = self._assign(dated_legs, dated_invoices)
+
+        # 日期未知的行程段或票据可以与同城市对内任意剩余的一方匹配，代价相同，按顺序配对即可
+        used = set(result.values())
+        remaining_invoices = [item for item in invoices if item[0] not in used]
+        remaining_legs = [item for item in legs if item[0] not in result]
+        for leg_index, leg_date in remaining_legs:
+            for position, (invoice_index, invoice_date) in enumerate(remaining_invoices):
+                if leg_date is None or invoice_date is None:
+                    result[leg_index] = invoice_index
+                    remaining_invoices.pop(position)
+                    break
+        return result
+
+    def _assign(self, legs, invoices) -> Dict[int, int]:
+        """日期已知的行程段与票据的最优指派：先保证匹配数量最多，再使日期偏差之和最小"""
+        if not legs or not invoices:
+            return {}
+        legs_by_date = defaultdict(list)
+        for leg_index, leg_date in legs:
+            legs_by_date[leg_date].append(leg_index)
+        invoices_by_date = defaultdict(list)
+        for invoice_index, invoice_date in invoices:
+            invoices_by_date[invoice_date].append(invoice_index)
+
+        flows = _min_cost_flow({leg_date: len(indexes) for leg_date, indexes in legs_by_date.items()},
+                               {invoice_date: len(indexes) for invoice_date, indexes in invoices_by_date.items()},
+                               self.date_tolerance_days)
+        result = {}
+        for (leg_date, invoice_date), flow in sorted(flows.items()):
+            for _ in range(flow):
+                result[legs_by_date[leg_date].pop(0)] = invoices_by_date[invoice_date].pop(0)
+        return result
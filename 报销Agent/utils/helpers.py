@@ -54,6 +54,32 @@ def save_base64_to_file(base64_str: str, file_type: str = 'pdf') -> Optional[str
         print(f"保存文件失败: {e}")
         return None
 
+def decode_base64_data(base64_str: str) -> bytes:
+    """将Base64字符串（可带data URL前缀）解码为字节
+
+    先去掉空白字符，再使用严格模式解码，非法字符会直接抛出binascii.Error，
+    无需在Python层逐字符检查多兆字节的字符串。
+
+    Args:
+        base64_str: Base64编码的字符串
+
+    Returns:
+        bytes: 解码后的原始字节
+    """
+    # 移除可能的前缀，如 "data:image/jpeg;base64,"
+    prefix, separator, payload = base64_str.partition(',')
+    if separator:
+        base64_str = payload
+    # 去掉换行、空格等空白字符（MIME等格式每76个字符换一行），严格模式不接受空白字符
+    base64_str = ''.join(base64_str.split())
+    
+    # 修复Base64 padding
+    missing_padding = len(base64_str) % 4
+    if missing_padding:
+        base64_str += '=' * (4 - missing_padding)
+    
+    return base64.b64decode(base64_str, validate=True)
+
 def format_amount(amount: float) -> str:
     """格式化金额，保留两位小数"""
     return f"{amount:.2f}"